@@ -0,0 +1,213 @@
+"""
+Servidores locais que imitam a CNN, a Evolution API, o MCP e o REST do Supabase.
+
+Cada servidor responde com payloads no formato das APIs reais, com latência
+(e variação) e taxa de erro configuráveis, e conta as chamadas recebidas por
+método e caminho. Todos rodam num event loop próprio, numa thread separada,
+para não disputar o loop da aplicação medida.
+"""
+import asyncio
+import random
+import re
+import socket
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from typing import Callable, Dict, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class Injecao:
+    """Latência e erros simulados de um upstream."""
+
+    def __init__(self, latencia: float = 0.0, variacao: float = 0.0, taxa_erro: float = 0.0, status_erro: int = 503):
+        self.latencia = latencia
+        self.variacao = variacao
+        self.taxa_erro = taxa_erro
+        self.status_erro = status_erro
+
+    def atraso(self) -> float:
+        if not self.latencia:
+            return 0.0
+        return max(0.0, random.gauss(self.latencia, self.latencia * self.variacao))
+
+
+def _caminho_normalizado(caminho: str) -> str:
+    # /agenda/123/remarcar -> /agenda/{id}/remarcar: contagem por endpoint
+    return re.sub(r"/\d+(?=/|$)", "/{id}", re.sub(r"/[A-Za-z0-9_-]{20,}(?=/|$)", "/{id}", caminho))
+
+
+class FakeUpstream:
+    def __init__(self, nome: str, responder: Callable[[Request, str], object], injecao: Optional[Injecao] = None):
+        self.nome = nome
+        self.responder = responder
+        self.injecao = injecao or Injecao()
+        self.chamadas: Counter = Counter()
+        self.url: Optional[str] = None
+        self.app = Starlette(routes=[
+            Route("/{caminho:path}", self._tratar, methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+        ])
+
+    async def _tratar(self, request: Request):
+        caminho = "/" + request.path_params["caminho"]
+        self.chamadas[f"{request.method} {_caminho_normalizado(caminho)}"] += 1
+        atraso = self.injecao.atraso()
+        if atraso:
+            await asyncio.sleep(atraso)
+        if self.injecao.taxa_erro and random.random() < self.injecao.taxa_erro:
+            return JSONResponse({"erro": "falha simulada"}, status_code=self.injecao.status_erro)
+        corpo = await self.responder(request, caminho)
+        if isinstance(corpo, tuple):
+            return JSONResponse(corpo[1], status_code=corpo[0])
+        return JSONResponse(corpo)
+
+    def total(self) -> int:
+        return sum(self.chamadas.values())
+
+
+_ids = iter(range(10_000_000, 99_999_999))
+
+
+def _telefone(cpf: str) -> str:
+    return "479" + cpf[-8:]
+
+
+async def responder_cnn(request: Request, caminho: str):
+    params = request.query_params
+    hoje = date.today()
+    if caminho == "/paciente/lista":
+        cpf = params.get("cpfCnpj") or "00000000000"
+        return {"pagina": 0, "totalPaginas": 1, "lista": [{
+            "id": int(cpf[-7:] or 1), "nome": "Paciente Benchmark", "cpfcnpj": cpf,
+            "dataNascimento": "1990-01-01", "contato": {"telefoneCelular": _telefone(cpf)}
+        }]}
+    if caminho == "/convenio-paciente/lista":
+        return {"pagina": 0, "totalPaginas": 1, "lista": [{"id": 1, "idTipoConvenio": 12642}]}
+    if caminho in ("/especialidade/lista", "/tipo-convenio/lista", "/tipo-consulta/lista", "/tipo-procedimento/lista"):
+        return {"pagina": 0, "totalPaginas": 1, "lista": [{"id": i, "nome": f"Item {i}"} for i in range(1, 6)]}
+    if caminho == "/executor-agenda/lista":
+        return {"pagina": 0, "totalPaginas": 1, "lista": [
+            {"id": 1405079 + i, "nome": f"Dr. {i}", "idEspecialidade": 1} for i in range(5)
+        ]}
+    if caminho.startswith("/executor-agenda/disponibilidade"):
+        inicio = date.fromisoformat(params.get("data", hoje.isoformat())[:10])
+        fim = date.fromisoformat(params.get("dataFim", params.get("data", hoje.isoformat()))[:10])
+        horarios = []
+        dia = inicio
+        while dia <= fim:
+            horarios += [{"data": dia.isoformat(), "horaInicio": f"{h:02d}:00:00", "horaFim": f"{h:02d}:30:00"} for h in range(8, 18)]
+            dia += timedelta(days=1)
+        return horarios
+    if caminho.startswith("/executor-agenda/"):
+        return {"id": int(caminho.rsplit("/", 1)[-1]), "nome": "Dr. Benchmark"}
+    if caminho == "/agenda/lista":
+        return {"pagina": 0, "totalPaginas": 1, "lista": [{
+            "id": 89706156, "idPaciente": 1398881, "idPessoaExecutor": 1405079, "status": "AGENDADO",
+            "data": (hoje + timedelta(days=1)).isoformat(), "horaInicio": "09:00:00", "horaFim": "09:15:00",
+            "telefoneCelularPaciente": "(47) 99999-9999"
+        }]}
+    if request.method == "POST":
+        return {"id": next(_ids)}
+    return {"pagina": 0, "totalPaginas": 1, "lista": []}
+
+
+async def responder_evolution(request: Request, caminho: str):
+    if caminho.startswith("/message/status/"):
+        return {"status": "READ"}
+    if caminho == "/message/send":
+        return {"key": {"id": f"BENCH{next(_ids)}"}, "status": "PENDING"}
+    return {}
+
+
+async def responder_mcp(request: Request, caminho: str):
+    if caminho == "/process":
+        corpo = await request.json()
+        return {"response": f"Recebido: {corpo.get('message', '')[:40]}", "context": {"etapa": "inicio"}}
+    if caminho == "/execute":
+        corpo = await request.json()
+        return {"tool": corpo.get("tool"), "result": {"ok": True}}
+    if caminho == "/tools":
+        return {"tools": []}
+    return {}
+
+
+async def responder_supabase(request: Request, caminho: str):
+    if caminho.endswith("/companies"):
+        filtro = request.query_params.get("cnpj", "")
+        cnpj = filtro[3:] if filtro.startswith("eq.") else filtro
+        if not cnpj:
+            return []
+        return [{
+            "cnpj": cnpj, "clinica_cid": f"cid{cnpj[-4:]}", "api_key": "chave",
+            "id_rotulo": 68780, "id_local": 10919, "id_origem_paciente": 69210
+        }]
+    return []
+
+
+class Servidores:
+    """Sobe os quatro upstreams falsos em portas livres de 127.0.0.1."""
+
+    def __init__(self, injecoes: Optional[Dict[str, Injecao]] = None):
+        injecoes = injecoes or {}
+        self.upstreams: Dict[str, FakeUpstream] = {
+            "cnn": FakeUpstream("cnn", responder_cnn, injecoes.get("cnn")),
+            "evolution": FakeUpstream("evolution", responder_evolution, injecoes.get("evolution")),
+            "mcp": FakeUpstream("mcp", responder_mcp, injecoes.get("mcp")),
+            "supabase": FakeUpstream("supabase", responder_supabase, injecoes.get("supabase")),
+        }
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._servidores = []
+        self._thread: Optional[threading.Thread] = None
+
+    def iniciar(self) -> "Servidores":
+        pronto = threading.Event()
+
+        def rodar():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            tarefas = []
+            for upstream in self.upstreams.values():
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(("127.0.0.1", 0))
+                upstream.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+                servidor = uvicorn.Server(uvicorn.Config(
+                    upstream.app, log_level="warning", access_log=False, lifespan="off", backlog=4096
+                ))
+                self._servidores.append(servidor)
+                tarefas.append(self._loop.create_task(servidor.serve(sockets=[sock])))
+
+            async def aguardar():
+                while not all(s.started for s in self._servidores):
+                    await asyncio.sleep(0.01)
+                pronto.set()
+                await asyncio.gather(*tarefas)
+
+            self._loop.run_until_complete(aguardar())
+
+        self._thread = threading.Thread(target=rodar, name="upstreams-falsos", daemon=True)
+        self._thread.start()
+        if not pronto.wait(timeout=10):
+            raise RuntimeError("Servidores falsos não iniciaram")
+        return self
+
+    def parar(self) -> None:
+        for servidor in self._servidores:
+            servidor.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def chamadas(self) -> Dict[str, int]:
+        return {nome: upstream.total() for nome, upstream in self.upstreams.items()}
+
+    def detalhes(self) -> Dict[str, Dict[str, int]]:
+        return {nome: dict(upstream.chamadas) for nome, upstream in self.upstreams.items()}
+
+    def zerar(self) -> None:
+        for upstream in self.upstreams.values():
+            upstream.chamadas.clear()
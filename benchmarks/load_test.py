@@ -0,0 +1,289 @@
+"""
+Teste de carga da API com CNN, Evolution, MCP e Supabase simulados localmente.
+
+Sobe os upstreams falsos de ``benchmarks/fakes.py``, aponta a aplicação para
+eles e executa cada cenário em níveis fixos de concorrência, reportando
+p50/p95/p99, requisições por segundo e chamadas aos upstreams por requisição.
+
+Cenários:
+    webhook      mensagens do WhatsApp (ack do webhook + processamento até o envio)
+    agendamento  executores -> disponibilidade -> criação do agendamento
+    consulta     paciente por CPF e resumo do paciente
+
+Com ``--baseline`` os resultados são comparados a uma execução salva (``--salvar``)
+e o comando termina com código 1 se houver regressão além da ``--tolerancia``.
+
+Uso:
+    python -m benchmarks.load_test --requests 300 --concurrency 1,10,50
+    python -m benchmarks.load_test --cnn-latency 0.08 --error-rate 0.02 --salvar benchmarks/baseline.json
+    python -m benchmarks.load_test --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks.fakes import Injecao, Servidores
+
+
+def percentil(ordenados: List[float], p: float) -> float:
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def _configurar_ambiente(servidores: Servidores, clinicas: int) -> None:
+    os.environ.update({
+        "SUPABASE_URL": servidores.upstreams["supabase"].url,
+        "SUPABASE_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.benchmark",
+        "EVOLUTION_API_URL": servidores.upstreams["evolution"].url,
+        "EVOLUTION_API_KEY": "chave",
+        "MCP_SERVER_URL": servidores.upstreams["mcp"].url,
+        "MCP_API_KEY": "chave",
+        "CNN_API_URL": servidores.upstreams["cnn"].url,
+        # Estado só em memória: cada execução começa do zero
+        "CONVERSA_BACKEND": "memory",
+        "IDEMPOTENCY_BACKEND": "memory",
+        "PACIENTE_INDEX_SQLITE_PATH": "",
+        "LEMBRETES_ENABLED": "false",
+        # O acompanhamento de status consulta a Evolution em segundo plano, sem relação com
+        # a requisição medida; desligado para não somar chamadas de um cenário a outro
+        "EVOLUTION_STATUS_INTERVAL": "86400",
+        # O benchmark usa várias clínicas; o limite por clínica fica o de produção
+        "TENANT_MAX_CONCURRENCY": os.environ.get("TENANT_MAX_CONCURRENCY", str(max(32, 256 // max(clinicas, 1)))),
+    })
+
+
+class Cenario:
+    def __init__(self, nome: str, passos: Callable[[object, int, str], Awaitable[List[float]]]):
+        self.nome = nome
+        self.passos = passos
+
+
+async def _webhook(client, i: int, cnpj: str) -> List[float]:
+    inicio = time.perf_counter()
+    response = await client.post(
+        f"/api/v1/webhook/whatsapp/{cnpj}",
+        json={"from": f"55479{i % 5000:08d}", "body": "Quero marcar uma consulta", "key": {"id": uuid.uuid4().hex}}
+    )
+    response.raise_for_status()
+    return [time.perf_counter() - inicio]
+
+
+async def _agendamento(client, i: int, cnpj: str) -> List[float]:
+    headers = {"X-Clinica-CNPJ": cnpj}
+    dia = (date.today() + timedelta(days=1 + i % 14)).isoformat()
+    tempos = []
+
+    inicio = time.perf_counter()
+    response = await client.get("/api/v1/executores", params={"id_especialidade": 1}, headers=headers)
+    response.raise_for_status()
+    tempos.append(time.perf_counter() - inicio)
+    id_executor = response.json()["lista"][i % 5]["id"]
+
+    inicio = time.perf_counter()
+    response = await client.get("/api/v1/disponibilidade", params={
+        "id_executor": id_executor, "cod_tipo_atendimento": 46272, "data_inicio": dia, "data_fim": dia
+    }, headers=headers)
+    response.raise_for_status()
+    tempos.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    response = await client.post("/api/v1/agendamentos", json={
+        "idPaciente": 1398881, "idPessoaExecutor": id_executor, "data": dia,
+        "horaInicio": "09:00:00", "horaFim": "09:30:00", "idTipoConsulta": 46272
+    }, headers={**headers, "Idempotency-Key": uuid.uuid4().hex})
+    response.raise_for_status()
+    tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+async def _consulta(client, i: int, cnpj: str) -> List[float]:
+    headers = {"X-Clinica-CNPJ": cnpj}
+    cpf = f"{i % 2000:011d}"
+    tempos = []
+    for caminho in (f"/api/v1/pacientes/{cpf}", f"/api/v1/pacientes/{cpf}/resumo"):
+        inicio = time.perf_counter()
+        response = await client.get(caminho, headers=headers)
+        response.raise_for_status()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+CENARIOS = {
+    "webhook": Cenario("webhook", _webhook),
+    "agendamento": Cenario("agendamento", _agendamento),
+    "consulta": Cenario("consulta", _consulta),
+}
+
+
+async def _drenar(timeout: float) -> float:
+    # Espera o processamento das mensagens do webhook e o envio das respostas
+    from services.outbound_dispatcher import get_outbound_dispatcher
+    from services.webhook_queue import get_webhook_queue
+
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < timeout:
+        fila, despachante = get_webhook_queue(), get_outbound_dispatcher()
+        ocupado = (fila and (fila.depth or fila.stats()["active"])) or (despachante and (despachante.stats()["depth"] or despachante.stats()["active"]))
+        if not ocupado:
+            break
+        await asyncio.sleep(0.01)
+    return time.perf_counter() - inicio
+
+
+async def executar(cenario: Cenario, app, servidores: Servidores, total: int, concorrencia: int, cnpjs: List[str], aquecimento: int) -> Dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        # Aquecimento: pools, caches de clínica e catálogos, fora da medição
+        for i in range(aquecimento):
+            try:
+                await cenario.passos(client, i, cnpjs[i % len(cnpjs)])
+            except Exception:
+                pass
+        await _drenar(30)
+        servidores.zerar()
+
+        latencias: List[float] = []
+        erros = 0
+        contador = itertools.count()
+
+        async def trabalhador():
+            nonlocal erros
+            while True:
+                i = next(contador)
+                if i >= total:
+                    return
+                try:
+                    latencias.extend(await cenario.passos(client, aquecimento + i, cnpjs[i % len(cnpjs)]))
+                except Exception:
+                    erros += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabalhador() for _ in range(concorrencia)))
+        duracao = time.perf_counter() - inicio
+        # Só conta as chamadas depois que as mensagens do cenário foram processadas e enviadas
+        drenagem = await _drenar(120)
+        chamadas = servidores.chamadas()
+
+    latencias.sort()
+    return {
+        "requests": len(latencias),
+        "errors": erros,
+        "rps": len(latencias) / duracao if duracao else 0.0,
+        "p50": percentil(latencias, 0.50),
+        "p95": percentil(latencias, 0.95),
+        "p99": percentil(latencias, 0.99),
+        "drain_seconds": drenagem,
+        "upstream_calls": chamadas,
+        "upstream_calls_per_request": {k: v / max(len(latencias), 1) for k, v in chamadas.items()},
+        "upstream_detail": servidores.detalhes(),
+    }
+
+
+def comparar(chave: str, atual: Dict, base: Dict, tolerancia: float) -> List[str]:
+    problemas = []
+    if atual["p95"] > base["p95"] * (1 + tolerancia):
+        problemas.append(f"p95 {base['p95'] * 1000:.1f}ms -> {atual['p95'] * 1000:.1f}ms")
+    if atual["p99"] > base["p99"] * (1 + tolerancia):
+        problemas.append(f"p99 {base['p99'] * 1000:.1f}ms -> {atual['p99'] * 1000:.1f}ms")
+    if atual["rps"] < base["rps"] * (1 - tolerancia):
+        problemas.append(f"req/s {base['rps']:.1f} -> {atual['rps']:.1f}")
+    # Mais chamadas por requisição costuma ser cache ou coalescência quebrados
+    for upstream, valor in atual["upstream_calls_per_request"].items():
+        anterior = base.get("upstream_calls_per_request", {}).get(upstream)
+        if anterior is not None and valor > anterior * (1 + tolerancia) + 0.01:
+            problemas.append(f"{upstream}/req {anterior:.2f} -> {valor:.2f}")
+    return [f"{chave}: {p}" for p in problemas]
+
+
+def imprimir(chave: str, r: Dict) -> None:
+    chamadas = " ".join(f"{k}={v / max(r['requests'], 1):.2f}" for k, v in r["upstream_calls"].items() if v)
+    print(
+        f"{chave:<18} req/s={r['rps']:8.1f}  p50={r['p50'] * 1000:7.1f}ms  p95={r['p95'] * 1000:7.1f}ms  "
+        f"p99={r['p99'] * 1000:7.1f}ms  erros={r['errors']:<4} "
+        + (f"drenagem={r['drain_seconds']:.2f}s  " if r["drain_seconds"] else "")
+        + f"upstream/req: {chamadas}"
+    )
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="webhook,agendamento,consulta")
+    parser.add_argument("--requests", type=int, default=200, help="iterações por cenário e concorrência")
+    parser.add_argument("--concurrency", default="1,10,50", help="níveis de concorrência separados por vírgula")
+    parser.add_argument("--clinicas", type=int, default=10, help="clínicas distintas na carga")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--cnn-latency", type=float, default=0.05)
+    parser.add_argument("--evolution-latency", type=float, default=0.03)
+    parser.add_argument("--mcp-latency", type=float, default=0.2)
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.2, help="desvio da latência, em fração da média")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de respostas com erro em todos os upstreams")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--salvar", help="grava os resultados como baseline (JSON)")
+    parser.add_argument("--baseline", help="compara com um baseline salvo")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    args = parser.parse_args()
+
+    def injecao(latencia: float) -> Injecao:
+        return Injecao(latencia, args.jitter, args.error_rate, args.error_status)
+
+    servidores = Servidores({
+        "cnn": injecao(args.cnn_latency),
+        "evolution": injecao(args.evolution_latency),
+        "mcp": injecao(args.mcp_latency),
+        "supabase": injecao(args.supabase_latency),
+    }).iniciar()
+    _configurar_ambiente(servidores, args.clinicas)
+
+    from main import app, lifespan
+
+    cnpjs = [f"{30747815000000 + i:014d}" for i in range(args.clinicas)]
+    resultados: Dict[str, Dict] = {}
+    try:
+        async with lifespan(app):
+            for nome in args.scenarios.split(","):
+                for concorrencia in (int(c) for c in args.concurrency.split(",")):
+                    chave = f"{nome}@{concorrencia}"
+                    resultados[chave] = await executar(
+                        CENARIOS[nome.strip()], app, servidores, args.requests, concorrencia, cnpjs, args.warmup
+                    )
+                    imprimir(chave, resultados[chave])
+    finally:
+        servidores.parar()
+
+    if args.salvar:
+        with open(args.salvar, "w", encoding="utf-8") as arquivo:
+            json.dump(
+                {k: {c: v for c, v in r.items() if c != "upstream_detail"} for k, r in resultados.items()},
+                arquivo, indent=2, sort_keys=True
+            )
+        print(f"Baseline salvo em {args.salvar}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as arquivo:
+            base = json.load(arquivo)
+        problemas = [
+            p for chave, r in resultados.items() if chave in base
+            for p in comparar(chave, r, base[chave], args.tolerancia)
+        ]
+        if problemas:
+            print("\nREGRESSÕES (tolerância {:.0%}):".format(args.tolerancia))
+            for problema in problemas:
+                print(f"  {problema}")
+            return 1
+        print(f"\nSem regressões em relação a {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
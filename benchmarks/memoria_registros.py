@@ -0,0 +1,80 @@
+"""
+Mede a memória por entrada dos registros compactos (``models.Registro*``)
+contra os dicts do ``json.loads`` que os caches guardavam antes.
+
+Os payloads imitam os da CNN: horários só com os campos tipados (sem
+``bruto``) e pacientes e executores com campos extras (com
+``bruto``, as chaves não tipadas em JSON).
+
+Uso:
+    python -m benchmarks.memoria_registros --quantidade 20000
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from models import RegistroExecutor, RegistroHorario, RegistroPaciente
+
+
+def _horario(i: int) -> Dict:
+    dia = date(2025, 5, 1) + timedelta(days=i % 30)
+    return {"data": dia.isoformat(), "horaInicio": f"{8 + i % 10:02d}:{i % 4 * 15:02d}:00", "horaFim": f"{8 + i % 10:02d}:{i % 4 * 15 + 14:02d}:00"}
+
+
+def _executor(i: int) -> Dict:
+    return {
+        "id": 1405079 + i, "nome": f"Dr. Executor Benchmark {i}", "idEspecialidade": 1616148,
+        "crm": f"{10000 + i}", "ativo": True, "email": f"executor{i}@clinica.com.br",
+        "especialidades": [{"id": 1616148, "nome": "Clínica Geral"}],
+    }
+
+
+def _paciente(i: int) -> Dict:
+    return {
+        "id": 1398881 + i, "nome": f"Paciente Benchmark da Silva {i}", "cpfcnpj": f"{13873588048 + i:011d}",
+        "dataNascimento": "1988-01-13", "sexo": "M", "ativo": True, "idOrigem": 69210,
+        "contato": {"telefoneCelular": f"4799{i:07d}", "email": f"paciente{i}@email.com"},
+        "endereco": {"cep": "89010000", "logradouro": "Rua XV de Novembro", "numero": str(i), "cidade": "Blumenau", "uf": "SC"},
+    }
+
+
+ENTIDADES = {
+    "horario": (_horario, RegistroHorario),
+    "executor": (_executor, RegistroExecutor),
+    "paciente": (_paciente, RegistroPaciente),
+}
+
+
+def _medir(construir: Callable[[], List]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        objetos = construir()
+        gc.collect()
+        atual, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del objetos
+    return atual
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantidade", type=int, default=20000, help="entradas por entidade")
+    args = parser.parse_args()
+
+    print(f"{'entidade':>12} {'dict (B)':>10} {'registro (B)':>13} {'economia':>9}")
+    for nome, (gerar, registro) in ENTIDADES.items():
+        # Cada entrada vem de um JSON próprio, como nas respostas da CNN
+        corpos = [json.dumps(gerar(i)).encode() for i in range(args.quantidade)]
+        como_dict = _medir(lambda: [json.loads(c) for c in corpos])
+        como_registro = _medir(lambda: [registro.from_cnn(json.loads(c)) for c in corpos])
+        por_dict, por_registro = como_dict / args.quantidade, como_registro / args.quantidade
+        print(f"{nome:>12} {por_dict:>10.0f} {por_registro:>13.0f} {1 - por_registro / por_dict:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Mede o CPU por requisição para devolver respostas grandes da CNN.
+
+Compara, para listas de agendamentos de vários tamanhos:
+    dict       caminho antigo: ``response.json()`` do httpx, ``jsonable_encoder`` e
+               ``JSONResponse`` (o que o FastAPI faz com um dict retornado)
+    orjson     ``response.json()`` e ``ORJSONResponse`` (rotas que transformam dados)
+    repasse    bytes da CNN repassados sem parse (``responder(bytes)``)
+
+Uso:
+    python -m benchmarks.serializacao --tamanhos 100,1000,10000 --repeticoes 50
+"""
+import argparse
+import json
+import os
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+# O pacote services lê as configurações ao ser importado
+for _var, _valor in {
+    "SUPABASE_URL": "http://supabase.local",
+    "SUPABASE_KEY": "chave",
+    "EVOLUTION_API_URL": "http://evolution.local",
+    "EVOLUTION_API_KEY": "chave",
+    "MCP_SERVER_URL": "http://mcp.local",
+    "MCP_API_KEY": "chave",
+}.items():
+    os.environ.setdefault(_var, _valor)
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from services.respostas import responder
+
+
+def payload_agendamentos(quantidade: int) -> bytes:
+    hoje = date.today()
+    lista = [{
+        "id": 89706156 + i,
+        "idPaciente": 1398881 + i,
+        "nomePaciente": f"Paciente Benchmark {i}",
+        "idPessoaExecutor": 1405079 + i % 20,
+        "nomeExecutor": f"Dr. Executor {i % 20}",
+        "idTipoConsulta": 46272,
+        "status": "AGENDADO",
+        "data": (hoje + timedelta(days=i % 30)).isoformat(),
+        "horaInicio": "09:00:00",
+        "horaFim": "09:15:00",
+        "telefoneCelularPaciente": "(47) 99999-9999",
+        "observacoes": "Consulta de rotina com observações acentuadas",
+        "procedimentos": [{"idEspecialidade": 1616148, "idTipoProcedimento": 133964, "quantidade": 1}],
+        "convenio": {"id": 1656570, "nome": "Particular"},
+    } for i in range(quantidade)]
+    return json.dumps({"pagina": 0, "totalPaginas": 1, "lista": lista}, ensure_ascii=False).encode()
+
+
+def _dict(upstream: httpx.Response) -> bytes:
+    return JSONResponse(jsonable_encoder(upstream.json())).body
+
+
+def _orjson(upstream: httpx.Response) -> bytes:
+    return responder(upstream.json()).body
+
+
+def _repasse(upstream: httpx.Response) -> bytes:
+    return responder(upstream.content).body
+
+
+MODOS: Dict[str, Callable[[httpx.Response], bytes]] = {"dict": _dict, "orjson": _orjson, "repasse": _repasse}
+
+
+def medir(corpo: bytes, funcao: Callable[[httpx.Response], bytes], repeticoes: int) -> float:
+    # Cada repetição usa uma resposta nova: o .json() do httpx não fica em cache
+    respostas = [httpx.Response(200, content=corpo) for _ in range(repeticoes)]
+    inicio = time.process_time()
+    for resposta in respostas:
+        funcao(resposta)
+    return (time.process_time() - inicio) / repeticoes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", default="100,1000,10000", help="itens por lista, separados por vírgula")
+    parser.add_argument("--repeticoes", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'itens':>7} {'KB':>8} " + " ".join(f"{m + ' (ms)':>13}" for m in MODOS))
+    for tamanho in (int(t) for t in args.tamanhos.split(",")):
+        corpo = payload_agendamentos(tamanho)
+        # Aquecimento e conferência: todos os modos produzem o mesmo JSON
+        saidas = [json.loads(f(httpx.Response(200, content=corpo))) for f in MODOS.values()]
+        assert all(s == saidas[0] for s in saidas)
+        tempos: List[float] = [medir(corpo, f, args.repeticoes) for f in MODOS.values()]
+        print(
+            f"{tamanho:>7} {len(corpo) / 1024:>8.1f} "
+            + " ".join(f"{t * 1000:>13.3f}" for t in tempos)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Mede o atraso (lag) do event loop sob carga concorrente em /clinicas/{cnpj}.
+
+Compara o modo antigo, em que o client síncrono do Supabase roda direto no
+event loop, com o modo atual, em que as consultas vão para o pool de threads.
+
+Uso:
+    python -m benchmarks.supabase_event_loop_lag --requests 200 --concurrency 50 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+for _var, _valor in {
+    "SUPABASE_URL": "http://supabase.local",
+    "SUPABASE_KEY": "chave",
+    "EVOLUTION_API_URL": "http://evolution.local",
+    "EVOLUTION_API_KEY": "chave",
+    "MCP_SERVER_URL": "http://mcp.local",
+    "MCP_API_KEY": "chave",
+}.items():
+    os.environ.setdefault(_var, _valor)
+
+import httpx
+
+from services import supabase_service
+from services.clinica_cache import get_clinica_cache
+
+
+class _FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class _FakeQuery:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.cnpj = None
+
+    def select(self, *args):
+        return self
+
+    def eq(self, campo, valor):
+        self.cnpj = valor
+        return self
+
+    def execute(self):
+        # Simula o round trip síncrono do supabase-py
+        time.sleep(self.latency)
+        return _FakeResponse([{"cnpj": self.cnpj, "clinica_cid": "1", "api_key": "chave"}])
+
+
+class FakeSupabaseClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def table(self, nome):
+        return _FakeQuery(self.latency)
+
+
+async def _executar_no_loop(self, query):
+    return query.execute()
+
+
+async def _medir_lag(parar: asyncio.Event, amostras: list, intervalo: float = 0.005):
+    loop = asyncio.get_running_loop()
+    while not parar.is_set():
+        inicio = loop.time()
+        await asyncio.sleep(intervalo)
+        amostras.append(loop.time() - inicio - intervalo)
+
+
+async def cenario(nome: str, total: int, concorrencia: int, latency: float, bloqueante: bool):
+    from main import app
+
+    supabase_service.close_supabase()
+    supabase_service.init_supabase(client=FakeSupabaseClient(latency))
+    get_clinica_cache().clear()
+
+    original = supabase_service.SupabaseService._execute
+    if bloqueante:
+        supabase_service.SupabaseService._execute = _executar_no_loop
+
+    amostras: list = []
+    parar = asyncio.Event()
+    medidor = asyncio.create_task(_medir_lag(parar, amostras))
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def uma(i: int):
+            async with semaforo:
+                # CNPJs distintos para não medir o cache de clínicas
+                response = await client.get(f"/api/v1/clinicas/{i:014d}")
+                response.raise_for_status()
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(uma(i) for i in range(total)))
+        duracao = time.perf_counter() - inicio
+
+    parar.set()
+    await medidor
+    supabase_service.SupabaseService._execute = original
+    supabase_service.close_supabase()
+
+    amostras.sort()
+    p99 = amostras[int(len(amostras) * 0.99) - 1] if amostras else 0.0
+    print(
+        f"{nome:<12} req/s={total / duracao:8.1f}  "
+        f"lag médio={statistics.mean(amostras or [0]) * 1000:7.2f}ms  "
+        f"lag p99={p99 * 1000:7.2f}ms  lag máx={max(amostras or [0]) * 1000:7.2f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="latência simulada do Supabase (s)")
+    args = parser.parse_args()
+
+    await cenario("antes", args.requests, args.concurrency, args.latency, bloqueante=True)
+    await cenario("depois", args.requests, args.concurrency, args.latency, bloqueante=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 from pydantic import ConfigDict
+from typing import Dict, Optional
 
 class Settings(BaseSettings):
     model_config = ConfigDict(extra="allow", env_file=".env")
@@ -8,6 +9,7 @@ class Settings(BaseSettings):
     # Configurações do Supabase
     SUPABASE_URL: str
     SUPABASE_KEY: str
+    SUPABASE_MAX_WORKERS: int = 8
     
     # Configurações do Evolution API
     EVOLUTION_API_URL: str
@@ -16,6 +18,137 @@ class Settings(BaseSettings):
     # Configurações do MCP
     MCP_SERVER_URL: str
     MCP_API_KEY: str
+    MCP_READ_TIMEOUT: float = 60.0
+    
+    # Configurações da Clínica nas Nuvens
+    CNN_API_URL: str = "https://api.clinicanasnuvens.com.br"
+    
+    # Pool de conexões HTTP (um pool keep-alive por host de upstream)
+    HTTP2_ENABLED: bool = True
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 30.0
+    HTTP_WRITE_TIMEOUT: float = 30.0
+    HTTP_POOL_TIMEOUT: float = 5.0
+    
+    # Cache dos catálogos da CNN (especialidades, tipos, executores)
+    CATALOGO_TTL: float = 3600.0
+    CATALOGO_STALE_TTL: float = 86400.0
+    CATALOGO_REFRESH_AHEAD: float = 0.8
+    CATALOGO_TTLS: Dict[str, float] = {}
+    CATALOGO_MAX_ENTRIES: int = 4096
+    
+    # Cache de disponibilidade (por dia)
+    DISPONIBILIDADE_TTL: float = 60.0
+    DISPONIBILIDADE_MAX_ENTRIES: int = 50000
+    # Consultas simultâneas por clínica na busca entre vários executores
+    BUSCA_CONCORRENCIA_POR_CLINICA: int = 8
+    
+    # Listagem de agendamentos: tamanho (em dias) de cada trecho buscado na CNN
+    AGENDAMENTOS_CHUNK_DIAS: int = 7
+    
+    # Timeout por chamada nas consultas compostas (fan-out)
+    FANOUT_TIMEOUT: float = 5.0
+    
+    # Execução em lote das tools do MCP (POST /api/tools/execute)
+    TOOLS_BATCH_MAX_CALLS: int = 20
+    # max-age do manifesto de tools (GET /api/tools); depois disso o cliente revalida pelo ETag
+    TOOLS_MANIFEST_MAX_AGE: int = 300
+    
+    # Resiliência das chamadas externas (prazo, retentativas e circuit breaker)
+    REQUEST_DEADLINE: float = 30.0
+    ATENDIMENTO_DEADLINE: float = 120.0
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 0.1
+    RETRY_MAX_DELAY: float = 2.0
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RESET_TIMEOUT: float = 30.0
+    
+    # Leituras idênticas em andamento na CNN viram uma única chamada
+    SINGLE_FLIGHT_ENABLED: bool = True
+    
+    # Limite de chamadas à CNN por clínica (token bucket + concorrência adaptativa)
+    CNN_RATE_LIMIT_RPS: float = 10.0
+    CNN_RATE_LIMIT_BURST: float = 20.0
+    CNN_CONCURRENCY_INITIAL: int = 8
+    CNN_CONCURRENCY_MIN: int = 1
+    CNN_CONCURRENCY_MAX: int = 32
+    CNN_LATENCY_TOLERANCE: float = 2.0
+    CNN_BACKGROUND_SHARE: float = 0.5
+    CNN_LIMITER_QUEUE_TIMEOUT: float = 5.0
+    
+    # Multi-clínica: resolução da clínica por requisição
+    DEFAULT_CLINICA_CNPJ: Optional[str] = None
+    TENANT_API_KEYS: Dict[str, str] = {}  # API key -> CNPJ
+    TENANT_REQUIRE_API_KEY: bool = False
+    TENANT_MAX_CONCURRENCY: int = 32
+    TENANT_QUEUE_TIMEOUT: float = 2.0
+    
+    # Índice local de pacientes (CPF/CNPJ, telefone e nome) por clínica
+    PACIENTE_INDEX_ENABLED: bool = True
+    PACIENTE_INDEX_SQLITE_PATH: Optional[str] = "pacientes.sqlite3"
+    PACIENTE_INDEX_TTL: float = 3600.0
+    PACIENTE_INDEX_MAX_AGE: float = 2592000.0
+    PACIENTE_INDEX_MAX_POR_CLINICA: int = 50000
+    
+    # Importação em lote de pacientes
+    IMPORTACAO_CONCORRENCIA: int = 8
+    IMPORTACAO_CHECKPOINT_DIR: str = "importacoes"
+    IMPORTACAO_PRAZO_LINHA: float = 30.0
+    
+    # Cache de clínicas (resolução por CNPJ)
+    CLINICA_CACHE_TTL: float = 300.0
+    CLINICA_CACHE_NEGATIVE_TTL: float = 30.0
+    CLINICA_CACHE_MAX_SIZE: int = 1024
+    
+    # Fila de processamento do webhook do WhatsApp
+    WEBHOOK_WORKERS: int = 8
+    WEBHOOK_MAX_QUEUE_DEPTH: int = 1000
+    WEBHOOK_DRAIN_TIMEOUT: float = 10.0
+    
+    # Fila de envio de mensagens do WhatsApp (Evolution API)
+    EVOLUTION_SEND_WORKERS: int = 4
+    EVOLUTION_SEND_MAX_QUEUE: int = 10000
+    EVOLUTION_SEND_RATE: float = 20.0
+    EVOLUTION_SEND_BURST: float = 20.0
+    EVOLUTION_INSTANCE_RATE: float = 5.0
+    EVOLUTION_INSTANCE_BURST: float = 10.0
+    EVOLUTION_SEND_MAX_ATTEMPTS: int = 4
+    EVOLUTION_STATUS_INTERVAL: float = 15.0
+    EVOLUTION_STATUS_BATCH: int = 50
+    EVOLUTION_STATUS_CONCURRENCY: int = 5
+    EVOLUTION_STATUS_TTL: float = 3600.0
+    
+    # Lembretes de consulta pelo WhatsApp
+    LEMBRETES_ENABLED: bool = False
+    LEMBRETES_ANTECEDENCIAS: str = "24,2"  # horas antes da consulta
+    LEMBRETES_STATUS: str = "AGENDADO,CONFIRMADO"
+    LEMBRETES_TIMEZONE: str = "America/Sao_Paulo"
+    LEMBRETES_HORIZONTE_DIAS: int = 2
+    LEMBRETES_SYNC_INTERVAL: float = 300.0
+    LEMBRETES_REFRESH_INTERVAL: float = 3600.0
+    LEMBRETES_REVALIDACAO: float = 600.0
+    LEMBRETES_SYNC_CONCURRENCY: int = 4
+    LEMBRETES_MAX_PENDENTES: int = 200
+    LEMBRETES_SQLITE_PATH: Optional[str] = "lembretes.sqlite3"
+    
+    # Idempotência (webhook e POST /agendamentos, /pacientes)
+    IDEMPOTENCY_BACKEND: str = "memory"  # memory, sqlite ou redis
+    IDEMPOTENCY_TTL: float = 86400.0
+    IDEMPOTENCY_PENDING_TTL: float = 120.0
+    IDEMPOTENCY_MAX_ENTRIES: int = 100000
+    IDEMPOTENCY_SQLITE_PATH: str = "idempotency.sqlite3"
+    IDEMPOTENCY_REDIS_URL: str = "redis://localhost:6379/0"
+    
+    # Contexto das conversas do WhatsApp
+    CONVERSA_BACKEND: str = "sqlite"  # memory, sqlite ou supabase
+    CONVERSA_SQLITE_PATH: str = "conversas.sqlite3"
+    CONVERSA_SUPABASE_TABLE: str = "conversas"
+    CONVERSA_TTL: float = 86400.0
+    CONVERSA_FLUSH_INTERVAL: float = 2.0
+    CONVERSA_CACHE_MAX_SIZE: int = 10000
 
 @lru_cache()
 def get_settings():
@@ -0,0 +1,116 @@
+import asyncio
+import re
+from typing import AsyncIterator, Dict, Optional
+from fastapi import Depends, Header, HTTPException, Query, Request
+from config import get_settings
+from services.clinica_cache import get_clinica_cache, ClinicaResolvida
+from services.cnn_api import CNNService
+from services.metrics import clinica_atual
+
+settings = get_settings()
+
+# Limite de requisições simultâneas por clínica (uma clínica não esgota as demais)
+_limites: Dict[str, asyncio.Semaphore] = {}
+
+
+def normalizar_cnpj(cnpj: Optional[str]) -> Optional[str]:
+    if not cnpj:
+        return None
+    return re.sub(r"\D", "", str(cnpj)) or None
+
+
+async def resolver_clinica(cnpj: str) -> ClinicaResolvida:
+    clinica = await get_clinica_cache().get(cnpj)
+    if not clinica:
+        raise HTTPException(status_code=404, detail="Clínica não encontrada")
+    return clinica
+
+
+class Tenant:
+    """Clínica da requisição, com o CNNService já ligado ao pool compartilhado."""
+
+    __slots__ = ("cnpj", "clinica", "cnn")
+
+    def __init__(self, cnpj: str, clinica: ClinicaResolvida):
+        self.cnpj = cnpj
+        self.clinica = clinica
+        self.cnn: CNNService = clinica.cnn_service()
+
+
+async def _cnpj_do_corpo(request: Request) -> Optional[str]:
+    # As tools do MCP enviam o CNPJ no corpo das requisições POST
+    if request.method not in ("POST", "PUT"):
+        return None
+    # Corpos que não são JSON (ex.: importação em CSV/NDJSON) não são lidos aqui
+    if not request.headers.get("content-type", "").startswith("application/json"):
+        return None
+    try:
+        corpo = await request.json()
+    except ValueError:
+        return None
+    return corpo.get("cnpj") if isinstance(corpo, dict) else None
+
+
+async def identificar_cnpj(
+    request: Request,
+    x_clinica_cnpj: Optional[str] = Header(None, alias="X-Clinica-CNPJ"),
+    x_api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    cnpj: Optional[str] = Query(None, description="CNPJ da clínica")
+) -> str:
+    explicito = normalizar_cnpj(
+        request.path_params.get("cnpj") or x_clinica_cnpj or cnpj or await _cnpj_do_corpo(request)
+    )
+
+    if x_api_key:
+        do_token = normalizar_cnpj(settings.TENANT_API_KEYS.get(x_api_key))
+        if not do_token:
+            raise HTTPException(status_code=401, detail="API key inválida")
+        if explicito and explicito != do_token:
+            raise HTTPException(status_code=403, detail="API key não pertence a esta clínica")
+        return do_token
+
+    if settings.TENANT_REQUIRE_API_KEY:
+        raise HTTPException(status_code=401, detail="API key obrigatória")
+
+    resolvido = explicito or normalizar_cnpj(settings.DEFAULT_CLINICA_CNPJ)
+    if not resolvido:
+        raise HTTPException(status_code=400, detail="CNPJ da clínica não informado")
+    return resolvido
+
+
+def _limite(cnpj: str) -> asyncio.Semaphore:
+    limite = _limites.get(cnpj)
+    if limite is None:
+        limite = _limites[cnpj] = asyncio.Semaphore(settings.TENANT_MAX_CONCURRENCY)
+    return limite
+
+
+async def get_tenant(cnpj: str = Depends(identificar_cnpj)) -> AsyncIterator[Tenant]:
+    # Rotula as métricas das chamadas externas desta requisição com a clínica
+    clinica_atual.set(cnpj)
+    clinica = await resolver_clinica(cnpj)
+
+    limite = _limite(cnpj)
+    try:
+        await asyncio.wait_for(limite.acquire(), settings.TENANT_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=429,
+            detail="Muitas requisições simultâneas para esta clínica",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        yield Tenant(cnpj, clinica)
+    finally:
+        limite.release()
+
+
+def tenant_stats() -> Dict:
+    return {
+        cnpj: {
+            "limit": settings.TENANT_MAX_CONCURRENCY,
+            "available": limite._value,
+            "waiting": len(limite._waiters or ())
+        }
+        for cnpj, limite in _limites.items()
+    }
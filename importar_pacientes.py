@@ -0,0 +1,68 @@
+"""
+Importa pacientes (e seus convênios) de um arquivo CSV ou NDJSON.
+
+Cada linha do relatório (NDJSON) traz o resultado de uma linha do arquivo; o
+resumo com linhas por segundo vai para a saída de erro. O checkpoint permite
+interromper e retomar a importação sem recriar quem já foi importado.
+
+Uso:
+    python importar_pacientes.py --cnpj 30747815000108 pacientes.csv
+    python importar_pacientes.py --cnpj 30747815000108 pacientes.ndjson --concorrencia 16 --relatorio relatorio.ndjson
+"""
+import argparse
+import asyncio
+import json
+import sys
+from config import get_settings
+from dependencies import normalizar_cnpj
+from services.clinica_cache import get_clinica_cache
+from services.http_clients import init_http_clients, close_http_clients
+from services.supabase_service import init_supabase, close_supabase
+from services.patient_index import close_patient_index
+from services.importacao_pacientes import importar_pacientes, ler_csv, ler_ndjson, pedacos_arquivo
+
+
+async def main(args: argparse.Namespace) -> int:
+    settings = get_settings()
+    init_http_clients(settings)
+    init_supabase()
+    try:
+        clinica = await get_clinica_cache().get(normalizar_cnpj(args.cnpj))
+        if not clinica:
+            print("Clínica não encontrada!", file=sys.stderr)
+            return 1
+
+        formato = args.formato or ("ndjson" if args.arquivo.endswith((".ndjson", ".jsonl")) else "csv")
+        leitor = ler_csv if formato == "csv" else ler_ndjson
+        saida = open(args.relatorio, "w", encoding="utf-8") if args.relatorio else sys.stdout
+        try:
+            async for resultado in importar_pacientes(
+                clinica.cnn_service(),
+                leitor(pedacos_arquivo(open(args.arquivo, "rb"))),
+                concorrencia=args.concorrencia,
+                checkpoint=args.checkpoint or f"{args.arquivo}.checkpoint.jsonl",
+                id_origem=clinica.clinica.id_origem_paciente
+            ):
+                if "resumo" in resultado:
+                    print(json.dumps(resultado["resumo"], ensure_ascii=False), file=sys.stderr)
+                else:
+                    saida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+        finally:
+            if saida is not sys.stdout:
+                saida.close()
+        return 0
+    finally:
+        await close_patient_index()
+        await close_http_clients()
+        close_supabase()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importação em lote de pacientes")
+    parser.add_argument("arquivo", help="Arquivo CSV (com cabeçalho) ou NDJSON")
+    parser.add_argument("--cnpj", required=True, help="CNPJ da clínica")
+    parser.add_argument("--formato", choices=("csv", "ndjson"), help="Padrão: pela extensão do arquivo")
+    parser.add_argument("--concorrencia", type=int, default=get_settings().IMPORTACAO_CONCORRENCIA)
+    parser.add_argument("--checkpoint", help="Padrão: <arquivo>.checkpoint.jsonl")
+    parser.add_argument("--relatorio", help="Arquivo do relatório (padrão: saída padrão)")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -1,16 +1,73 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
+import time
+from config import get_settings
 from routes import router
+from dependencies import Tenant, get_tenant
+from services.http_clients import init_http_clients, close_http_clients
+from services.supabase_service import init_supabase, close_supabase
+from services.webhook_queue import init_webhook_queue, close_webhook_queue
+from services.outbound_dispatcher import init_outbound_dispatcher, close_outbound_dispatcher
+from services.reminder_scheduler import init_reminder_scheduler, close_reminder_scheduler
+from services.atendimento import processar_mensagem_whatsapp
+from services.idempotency import get_idempotency_store, close_idempotency_store
+from services.conversation_store import init_conversation_store, close_conversation_store
+from services.resilience import prazo
+from services.patient_index import close_patient_index
+from services.metrics import get_metricas, close_metricas, instrumentar_servicos
+from services.respostas import responder
+from services.tool_registry import LoteTools, executar_lote, get_manifesto
 
 # Carrega variáveis de ambiente
 load_dotenv()
 
+# Latência, status e erros de todas as operações de CNN, Evolution, MCP e Supabase
+instrumentar_servicos()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = get_settings()
+    # Medição contínua do atraso do event loop
+    get_metricas().start()
+    # Pools HTTP compartilhados por todo o processo (um por host de upstream)
+    app.state.http_clients = init_http_clients(settings)
+    # Client único do Supabase, com consultas fora do event loop
+    init_supabase()
+    get_idempotency_store()
+    await init_conversation_store()
+    # Fila de envio das mensagens do WhatsApp (prioridade e ordem por número)
+    await init_outbound_dispatcher()
+    # Lembretes de consulta (desligado por padrão: LEMBRETES_ENABLED)
+    await init_reminder_scheduler()
+    # Workers que processam as mensagens recebidas pelo webhook
+    await init_webhook_queue(
+        processar_mensagem_whatsapp,
+        workers=settings.WEBHOOK_WORKERS,
+        max_depth=settings.WEBHOOK_MAX_QUEUE_DEPTH
+    )
+    # Manifesto das tools serializado uma vez (servido com ETag em /api/tools)
+    get_manifesto()
+    yield
+    await close_reminder_scheduler()
+    await close_webhook_queue(settings.WEBHOOK_DRAIN_TIMEOUT)
+    # Depois do webhook: as respostas ainda em processamento precisam ser enviadas
+    await close_outbound_dispatcher(settings.WEBHOOK_DRAIN_TIMEOUT)
+    await close_idempotency_store()
+    await close_conversation_store()
+    await close_patient_index()
+    await close_http_clients()
+    close_supabase()
+    await close_metricas()
+
 app = FastAPI(
     title="MCP Clínica nas Nuvens",
     description="API de integração para atendimento automatizado via WhatsApp",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configuração CORS
@@ -22,6 +79,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Rotas cujo stream de resposta dura mais que uma requisição; o prazo é aplicado
+# a cada linha processada (IMPORTACAO_PRAZO_LINHA)
+ROTAS_SEM_PRAZO = frozenset({"/api/v1/pacientes/importacao"})
+
+@app.middleware("http")
+async def prazo_da_requisicao(request: Request, call_next):
+    if request.url.path in ROTAS_SEM_PRAZO:
+        return await call_next(request)
+    # Prazo propagado a todas as chamadas externas feitas durante a requisição
+    segundos = get_settings().REQUEST_DEADLINE
+    try:
+        pedido = float(request.headers.get("X-Request-Timeout", ""))
+        if pedido > 0:
+            segundos = min(segundos, pedido)
+    except ValueError:
+        pass
+    with prazo(segundos):
+        return await call_next(request)
+
+@app.middleware("http")
+async def metricas_da_requisicao(request: Request, call_next):
+    inicio = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Rótulo pelo template da rota (ex.: /api/v1/clinicas/{cnpj}), não pelo caminho
+        rota = getattr(request.scope.get("route"), "path", None) or _rotas.get(request.scope.get("endpoint"), "desconhecida")
+        get_metricas().requisicoes.observe(time.perf_counter() - inicio, request.method, rota, str(status))
+
 # Inclui as rotas
 app.include_router(router, prefix="/api/v1")
 
@@ -33,124 +122,36 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(get_metricas().exportar(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/tools")
-async def list_tools():
-    tools = [
-        {
-            "name": "listar_pacientes",
-            "description": "Lista todos os pacientes da clínica",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "nome": "string (opcional, filtro por nome)",
-                "cpf": "string (opcional, filtro por CPF)"
-            }
-        },
-        {
-            "name": "criar_paciente",
-            "description": "Cria um novo paciente na clínica",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "nome": "string",
-                "cpf": "string",
-                "data_nascimento": "string (YYYY-MM-DD)",
-                "telefone": "string",
-                "email": "string"
-            }
-        },
-        {
-            "name": "obter_paciente",
-            "description": "Obtém os dados de um paciente específico",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "cpf": "string"
-            }
-        },
-        {
-            "name": "listar_convenios_paciente",
-            "description": "Lista os convênios de um paciente específico",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "id_paciente": "integer"
-            }
-        },
-        {
-            "name": "associar_convenio_paciente",
-            "description": "Associa um convênio a um paciente",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "paciente_id": "string",
-                "convenio_id": "string",
-                "numero_carteira": "string"
-            }
-        },
-        {
-            "name": "listar_tipos_convenios",
-            "description": "Lista todos os tipos de convênios disponíveis",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)"
-            }
-        },
-        {
-            "name": "listar_executores",
-            "description": "Lista todos os médicos/executores disponíveis",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "id_especialidade": "integer (opcional)",
-                "id_tipo_convenio": "integer (opcional)",
-                "nome": "string (opcional)"
-            }
-        },
-        {
-            "name": "listar_especialidades",
-            "description": "Lista todas as especialidades disponíveis",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "nome": "string (opcional, filtro por nome)"
-            }
-        },
-        {
-            "name": "verificar_disponibilidade",
-            "description": "Verifica a disponibilidade de horários",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "executor_id": "string",
-                "data_inicio": "string (YYYY-MM-DD)",
-                "data_fim": "string (YYYY-MM-DD)"
-            }
-        },
-        {
-            "name": "criar_agendamento",
-            "description": "Cria um novo agendamento",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "paciente_id": "string",
-                "executor_id": "string",
-                "data": "string (YYYY-MM-DD)",
-                "hora": "string (HH:MM)",
-                "convenio_id": "string (opcional)",
-                "observacoes": "string (opcional)"
-            }
-        },
-        {
-            "name": "listar_agendamentos",
-            "description": "Lista os agendamentos",
-            "parameters": {
-                "cnpj": "string (CNPJ da clínica)",
-                "paciente_id": "string (opcional)",
-                "executor_id": "string (opcional)",
-                "data_inicio": "string (YYYY-MM-DD, opcional)",
-                "data_fim": "string (YYYY-MM-DD, opcional)"
-            }
-        },
-        {
-            "name": "obter_clinica",
-            "description": "Obtém os dados de uma clínica pelo CNPJ",
-            "parameters": {
-                "cnpj": "string"
-            }
-        }
-    ]
-    return {"tools": tools}
+async def list_tools(request: Request):
+    manifesto = get_manifesto()
+    headers = {
+        "ETag": manifesto.etag,
+        "Cache-Control": f"public, max-age={get_settings().TOOLS_MANIFEST_MAX_AGE}"
+    }
+    # Cliente com a versão atual: 304 sem corpo
+    if manifesto.corresponde(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(manifesto.corpo, media_type="application/json", headers=headers)
+
+@app.post("/api/tools/execute")
+async def execute_tools(lote: LoteTools, tenant: Tenant = Depends(get_tenant)):
+    try:
+        # Chamadas independentes em paralelo, as demais na ordem do depends_on
+        return responder({"results": await executar_lote(tenant, lote.calls)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Endpoint -> template da rota; com duas rotas para o mesmo endpoint vale a primeira
+_rotas = {}
+for _rota in app.routes:
+    _rotas.setdefault(getattr(_rota, "endpoint", None), getattr(_rota, "path", None))
 
 if __name__ == "__main__":
     import uvicorn
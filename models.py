@@ -1,6 +1,8 @@
+import orjson
+from dataclasses import dataclass
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List, Dict
-from datetime import datetime
+from typing import Any, ClassVar, Optional, List, Dict, Tuple
+from datetime import date, datetime
 
 class Clinica(BaseModel):
     model_config = ConfigDict(extra="allow", populate_by_name=True)
@@ -47,4 +49,126 @@ class ContextoConversa(BaseModel):
     clinica: Optional[Clinica] = None
     ultimo_agendamento: Optional[Agendamento] = None
     etapa_atual: str = "inicio"
-    dados_coletados: Dict = Field(default_factory=dict)
\ No newline at end of file
+    dados_coletados: Dict = Field(default_factory=dict)
+
+# Registros compactos das entidades da CNN guardadas em cache. Os campos usados
+# pela API ficam tipados; o resto do payload original (``bruto``, JSON em bytes)
+# só existe quando há algo que os campos tipados não reproduzem.
+
+_AUSENTE = object()
+
+
+def _bruto(item: Dict, tipados: Dict[str, Any]) -> Optional[bytes]:
+    # Fica no bruto toda chave que os campos tipados não devolvem idêntica
+    extras = {
+        k: v for k, v in item.items()
+        if v is None or type(tipados.get(k, _AUSENTE)) is not type(v) or tipados[k] != v
+    }
+    return orjson.dumps(extras) if extras else None
+
+
+def _inteiro(valor: Any, campo: str) -> int:
+    if isinstance(valor, bool) or not isinstance(valor, (int, str)):
+        raise ValueError(f"{campo} inválido: {valor!r}")
+    return int(valor)
+
+
+def _texto(valor: Any, campo: str, obrigatorio: bool = False) -> Optional[str]:
+    if valor is None and not obrigatorio:
+        return None
+    if not isinstance(valor, str):
+        raise ValueError(f"{campo} inválido: {valor!r}")
+    return valor
+
+
+class _RegistroCNN:
+    __slots__ = ()
+    # (atributo, chave na CNN) dos campos reproduzidos sem o payload original
+    CAMPOS: ClassVar[Tuple[Tuple[str, str], ...]] = ()
+
+    def _com_bruto(self, item: Dict):
+        self.bruto = _bruto(item, {chave: getattr(self, atributo) for atributo, chave in self.CAMPOS})
+        return self
+
+    def para_cnn(self) -> Dict:
+        dados = {chave: getattr(self, atributo) for atributo, chave in self.CAMPOS if getattr(self, atributo) is not None}
+        if self.bruto is not None:
+            dados.update(orjson.loads(self.bruto))
+        return dados
+
+
+@dataclass(slots=True)
+class RegistroPaciente(_RegistroCNN):
+    id: int
+    nome: Optional[str]
+    cpfcnpj: Optional[str] = None
+    data_nascimento: Optional[str] = None
+    telefones: Tuple[str, ...] = ()
+    bruto: Optional[bytes] = None
+
+    CAMPOS: ClassVar = (("id", "id"), ("nome", "nome"), ("cpfcnpj", "cpfcnpj"), ("data_nascimento", "dataNascimento"))
+
+    @classmethod
+    def from_cnn(cls, item: Dict) -> "RegistroPaciente":
+        contato = item.get("contato")
+        if not isinstance(contato, dict):
+            contato = {}
+        telefones = tuple(dict.fromkeys(
+            t for t in (contato.get("telefoneCelular"), item.get("telefoneCelular"), item.get("telefone"))
+            if isinstance(t, str) and t
+        ))
+        return cls(
+            _inteiro(item.get("id"), "id"),
+            _texto(item.get("nome"), "nome"),
+            _texto(item.get("cpfcnpj"), "cpfcnpj"),
+            _texto(item.get("dataNascimento"), "dataNascimento"),
+            telefones
+        )._com_bruto(item)
+
+    @property
+    def documento(self) -> Optional[str]:
+        # Algumas respostas da CNN trazem ``cpfCnpj``; ele fica no bruto com a chave original
+        if self.cpfcnpj is not None or self.bruto is None:
+            return self.cpfcnpj
+        valor = orjson.loads(self.bruto).get("cpfCnpj")
+        return valor if isinstance(valor, str) else None
+
+
+@dataclass(slots=True)
+class RegistroExecutor(_RegistroCNN):
+    id: int
+    nome: Optional[str]
+    id_especialidade: Optional[int] = None
+    bruto: Optional[bytes] = None
+
+    CAMPOS: ClassVar = (("id", "id"), ("nome", "nome"), ("id_especialidade", "idEspecialidade"))
+
+    @classmethod
+    def from_cnn(cls, item: Dict) -> "RegistroExecutor":
+        id_especialidade = item.get("idEspecialidade")
+        return cls(
+            _inteiro(item.get("id"), "id"),
+            _texto(item.get("nome"), "nome"),
+            _inteiro(id_especialidade, "idEspecialidade") if id_especialidade is not None else None
+        )._com_bruto(item)
+
+
+@dataclass(slots=True)
+class RegistroHorario(_RegistroCNN):
+    data: str
+    hora_inicio: str
+    hora_fim: Optional[str] = None
+    bruto: Optional[bytes] = None
+
+    CAMPOS: ClassVar = (("data", "data"), ("hora_inicio", "horaInicio"), ("hora_fim", "horaFim"))
+
+    @classmethod
+    def from_cnn(cls, item: Dict) -> "RegistroHorario":
+        data = _texto(item.get("data"), "data", obrigatorio=True)
+        # Valida a data aqui: o cache agrupa os horários por dia
+        date.fromisoformat(data[:10])
+        return cls(
+            data,
+            _texto(item.get("horaInicio"), "horaInicio", obrigatorio=True),
+            _texto(item.get("horaFim"), "horaFim")
+        )._com_bruto(item)
@@ -1,5 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from typing import Dict, Optional
+import asyncio
+import os
+import tempfile
+from datetime import date, timedelta
+from config import get_settings
 from models import MensagemWhatsApp, ContextoConversa, Clinica
 from services import (
     EvolutionService,
@@ -7,119 +13,158 @@ from services import (
     CNNService,
     SupabaseService
 )
+from services.clinica_cache import get_clinica_cache
+from dependencies import Tenant, get_tenant, resolver_clinica, normalizar_cnpj, tenant_stats
+from services.webhook_queue import get_webhook_queue
+from services.outbound_dispatcher import get_outbound_dispatcher
+from services.reminder_scheduler import get_reminder_scheduler
+from services.conversation_store import get_conversation_store
+from services.fanout import reunir, Chamada
+from services.respostas import linha_ndjson, responder
+from services.catalog_cache import get_catalog_cache
+from services.disponibilidade_cache import get_disponibilidade_cache
+from services.rate_limiter import get_cnn_limiters
+from services.resilience import get_circuitos
+from services.single_flight import get_cnn_single_flight
+from services.patient_index import get_patient_index
+from services.importacao_pacientes import importar_pacientes, ler_csv, ler_ndjson, pedacos_arquivo
+from services.busca_disponibilidade import buscar_horarios
+from services.agendamentos_paginados import CursorInvalido, FiltroAgendamentos, iterar_agendamentos, listar_pagina
+from services.idempotency import (
+    get_idempotency_store,
+    extrair_id_mensagem,
+    executar_idempotente
+)
 
 router = APIRouter()
+settings = get_settings()
 
 @router.post("/webhook/whatsapp")
-async def webhook_whatsapp(message: Dict):
-    try:
-        # Inicializa serviços
-        evolution_service = EvolutionService()
-        mcp_service = MCPService()
-        supabase_service = SupabaseService()
-        
-        # Extrai informações da mensagem
-        numero = message.get("from")
-        mensagem = message.get("body")
-        
-        if not numero or not mensagem:
-            raise HTTPException(status_code=400, detail="Mensagem inválida")
-        
-        # Identifica a clínica pelo número
-        clinica_data = await supabase_service.get_clinica_by_cnpj(numero)
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN com as credenciais da clínica
-        cnn_service = CNNService(clinica)
-        
-        # Processa a mensagem com o MCP
-        contexto = ContextoConversa(clinica=clinica)
-        resposta_mcp = await mcp_service.process_message(
-            message=mensagem,
-            context=contexto.model_dump()
-        )
-        
-        # Executa ações necessárias baseadas na resposta do MCP
-        if resposta_mcp.get("action"):
-            if resposta_mcp["action"] == "agendar_consulta":
-                # Implementar lógica de agendamento
-                pass
-            elif resposta_mcp["action"] == "remarcar_consulta":
-                # Implementar lógica de remarcação
-                pass
-            elif resposta_mcp["action"] == "cancelar_consulta":
-                # Implementar lógica de cancelamento
-                pass
-        
-        # Envia resposta ao paciente
-        await evolution_service.send_message(
-            number=numero,
-            message=resposta_mcp.get("response", "Desculpe, não entendi sua mensagem.")
+@router.post("/webhook/whatsapp/{cnpj}")
+async def webhook_whatsapp(message: Dict, cnpj: Optional[str] = None):
+    # Extrai informações da mensagem
+    numero = message.get("from")
+    mensagem = message.get("body")
+    
+    if not numero or not mensagem:
+        raise HTTPException(status_code=400, detail="Mensagem inválida")
+    
+    # Reentregas do Evolution API são descartadas antes de qualquer I/O externo
+    id_mensagem = extrair_id_mensagem(message)
+    chave = f"webhook:{id_mensagem}" if id_mensagem else None
+    store = get_idempotency_store()
+    if chave and await store.reserve(chave) is not None:
+        return {"status": "success", "duplicate": True}
+    
+    # Enfileira para os workers e responde imediatamente ao Evolution API
+    fila = get_webhook_queue()
+    # Sem CNPJ na URL, a clínica é identificada pelo número (comportamento original)
+    item = MensagemWhatsApp(
+        numero=numero,
+        mensagem=mensagem,
+        cnpj=normalizar_cnpj(cnpj)
+    )
+    if fila is None or not fila.enqueue(numero, item):
+        if chave:
+            await store.release(chave)
+        raise HTTPException(
+            status_code=503,
+            detail="Fila de mensagens cheia",
+            headers={"Retry-After": "5"}
         )
-        
-        return {"status": "success"}
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    if chave:
+        await store.complete(chave)
+    return {"status": "success", "queued": True}
+
+@router.get("/stats")
+async def obter_estatisticas():
+    fila = get_webhook_queue()
+    despachante = get_outbound_dispatcher()
+    lembretes = get_reminder_scheduler()
+    return {
+        "webhook_queue": fila.stats() if fila else None,
+        "whatsapp_envio": despachante.stats() if despachante else None,
+        "lembretes": lembretes.stats() if lembretes else None,
+        "clinica_cache": get_clinica_cache().stats(),
+        "conversas": get_conversation_store().stats(),
+        "catalogos": get_catalog_cache().stats(),
+        "disponibilidade": get_disponibilidade_cache().stats(),
+        "tenants": tenant_stats(),
+        "cnn_limiter": get_cnn_limiters().stats(),
+        "circuitos": get_circuitos().stats(),
+        "single_flight": get_cnn_single_flight().stats(),
+        "pacientes": get_patient_index().stats()
+    }
+
+def _cnpj_valido(cnpj: Optional[str]) -> str:
+    # Mesma forma (só dígitos) usada pela resolução do tenant, no cache e no Supabase
+    normalizado = normalizar_cnpj(cnpj)
+    if not normalizado:
+        raise HTTPException(status_code=400, detail="CNPJ inválido")
+    return normalizado
 
 @router.post("/clinicas")
 async def criar_clinica(clinica_data: Dict):
     try:
+        if clinica_data.get("cnpj"):
+            clinica_data = {**clinica_data, "cnpj": _cnpj_valido(clinica_data["cnpj"])}
         supabase_service = SupabaseService()
         nova_clinica = await supabase_service.create_clinica(clinica_data)
+        # Remove uma eventual entrada negativa para o CNPJ recém-criado
+        if clinica_data.get("cnpj"):
+            get_clinica_cache().invalidate(clinica_data["cnpj"])
         return nova_clinica
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/clinicas/{cnpj}")
 async def obter_clinica(cnpj: str):
     try:
-        supabase_service = SupabaseService()
-        clinica = await supabase_service.get_clinica_by_cnpj(cnpj)
-        if not clinica:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        return clinica
+        clinica = await resolver_clinica(_cnpj_valido(cnpj))
+        return clinica.dados
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/clinicas/{cnpj}")
 async def atualizar_clinica(cnpj: str, clinica_data: Dict):
     try:
+        cnpj = _cnpj_valido(cnpj)
+        if clinica_data.get("cnpj"):
+            clinica_data = {**clinica_data, "cnpj": _cnpj_valido(clinica_data["cnpj"])}
         supabase_service = SupabaseService()
         clinica_atualizada = await supabase_service.update_clinica(cnpj, clinica_data)
+        get_clinica_cache().invalidate(cnpj)
+        if clinica_data.get("cnpj"):
+            get_clinica_cache().invalidate(clinica_data["cnpj"])
         return clinica_atualizada
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/clinicas/{cnpj}")
 async def deletar_clinica(cnpj: str):
     try:
+        cnpj = _cnpj_valido(cnpj)
         supabase_service = SupabaseService()
         await supabase_service.delete_clinica(cnpj)
+        get_clinica_cache().invalidate(cnpj)
         return {"status": "success"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/pacientes/{cpf}")
-async def obter_paciente(cpf: str):
+async def obter_paciente(cpf: str, tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        # Usando uma clínica específica para teste
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN com as credenciais da clínica
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca o paciente
         paciente_data = await cnn_service.get_paciente(cpf)
@@ -137,7 +182,50 @@ async def obter_paciente(cpf: str):
         # Adiciona os convênios ao paciente
         paciente["convenios"] = convenios_data.get("lista", [])
         
-        return paciente
+        return responder(paciente)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/pacientes/{cpf}/resumo")
+async def obter_resumo_paciente(cpf: str, dias: int = 30, tenant: Tenant = Depends(get_tenant)):
+    try:
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
+        
+        # Busca o paciente (as demais consultas dependem do id)
+        paciente_data = await cnn_service.get_paciente(cpf)
+        if not paciente_data.get("lista") or len(paciente_data["lista"]) == 0:
+            raise HTTPException(status_code=404, detail="Paciente não encontrado")
+        paciente = paciente_data["lista"][0]
+        
+        # Convênios e próximos agendamentos em paralelo
+        hoje = date.today()
+        resultado = await reunir(
+            {
+                "convenios": Chamada(lambda: cnn_service.get_convenios_paciente(paciente["id"])),
+                "agendamentos": Chamada(
+                    lambda: cnn_service.get_agendamentos(
+                        codigo_paciente=paciente["id"],
+                        data_inicial=hoje.isoformat(),
+                        data_final=(hoje + timedelta(days=dias)).isoformat()
+                    ),
+                    opcional=True
+                )
+            },
+            timeout=settings.FANOUT_TIMEOUT
+        )
+        
+        return responder({
+            "paciente": paciente,
+            "convenios": (resultado["convenios"] or {}).get("lista", []),
+            "agendamentos": (resultado["agendamentos"] or {}).get("lista", []),
+            "parcial": resultado.parcial,
+            "erros": resultado.erros
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -145,17 +233,15 @@ async def obter_paciente(cpf: str):
 async def teste_clinica(cnpj: str):
     try:
         # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj(cnpj)
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
+        clinica_data = (await resolver_clinica(_cnpj_valido(cnpj))).dados
         
         # Retorna os dados da clínica (exceto a chave API por segurança)
         safe_data = {k: v for k, v in clinica_data.items() if k != 'api_key'}
         safe_data['api_key_length'] = len(clinica_data.get('api_key', '')) if 'api_key' in clinica_data else 0
         
         return safe_data
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -163,14 +249,7 @@ async def teste_clinica(cnpj: str):
 async def debug_auth(cnpj: str):
     try:
         # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj(cnpj)
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
+        clinica = (await resolver_clinica(_cnpj_valido(cnpj))).clinica
         
         # Cria a string de autenticação no formato correto
         import base64
@@ -185,73 +264,48 @@ async def debug_auth(cnpj: str):
             "auth_string": auth_string[:10] + "..." + auth_string[-10:],  # Mostra apenas partes da string
             "auth_base64": auth_base64
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/especialidades")
-async def listar_especialidades(nome: str = ""):
+async def listar_especialidades(nome: str = "", tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        # Usando uma clínica específica para teste
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN com as credenciais da clínica
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca as especialidades
         especialidades_data = await cnn_service.get_especialidades(nome)
         
-        return especialidades_data
+        return responder(especialidades_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para buscar convênios do paciente
 @router.get("/pacientes/{id_paciente}/convenios")
-async def listar_convenios_paciente(id_paciente: int):
+async def listar_convenios_paciente(id_paciente: int, tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
-        
-        # Busca os convênios do paciente
-        convenios_data = await cnn_service.get_convenios_paciente(id_paciente)
+        # Busca os convênios do paciente (bytes da CNN repassados sem parse)
+        convenios_data = await cnn_service.get_convenios_paciente(id_paciente, bruto=True)
         
-        return convenios_data
+        return responder(convenios_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para buscar executores de agenda
 @router.get("/executores")
-async def listar_executores(id_especialidade: Optional[int] = None, id_tipo_convenio: Optional[int] = None, nome: Optional[str] = None):
+async def listar_executores(id_especialidade: Optional[int] = None, id_tipo_convenio: Optional[int] = None, nome: Optional[str] = None, tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca os executores de agenda
         executores_data = await cnn_service.get_executores_agenda(
@@ -260,7 +314,9 @@ async def listar_executores(id_especialidade: Optional[int] = None, id_tipo_conv
             nome=nome
         )
         
-        return executores_data
+        return responder(executores_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -270,21 +326,12 @@ async def verificar_disponibilidade(
     id_executor: int, 
     cod_tipo_atendimento: int, 
     data_inicio: str, 
-    data_fim: str
+    data_fim: str,
+    tenant: Tenant = Depends(get_tenant)
 ):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Verifica a disponibilidade do executor
         disponibilidade_data = await cnn_service.get_disponibilidade_executor(
@@ -294,31 +341,77 @@ async def verificar_disponibilidade(
             data_fim=data_fim
         )
         
-        return disponibilidade_data
+        return responder(disponibilidade_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Endpoint para criar agendamento
-@router.post("/agendamentos")
-async def criar_agendamento(dados_agendamento: Dict):
+# Endpoint para buscar horários de vários executores de uma vez (NDJSON)
+@router.get("/disponibilidade/busca")
+async def buscar_disponibilidade(
+    cod_tipo_atendimento: int,
+    data_inicio: str,
+    data_fim: str,
+    id_especialidade: Optional[int] = None,
+    id_tipo_convenio: Optional[int] = None,
+    hora_inicio: Optional[str] = None,
+    hora_fim: Optional[str] = None,
+    limite: int = Query(10, ge=1, le=200),
+    tenant: Tenant = Depends(get_tenant)
+):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Tudo é buscado antes de iniciar a resposta (erros ainda viram HTTP)
+        horarios, falhas = await buscar_horarios(
+            cnn_service,
+            cod_tipo_atendimento=cod_tipo_atendimento,
+            data_inicio=data_inicio,
+            data_fim=data_fim,
+            id_especialidade=id_especialidade,
+            id_tipo_convenio=id_tipo_convenio,
+            hora_inicio=hora_inicio,
+            hora_fim=hora_fim,
+            limite=limite
+        )
         
-        # Cria o agendamento
-        agendamento_data = await cnn_service.criar_agendamento(dados_agendamento)
+        corpo = b"".join(linha_ndjson(horario) for horario in horarios)
+        if falhas:
+            # Linha final: a lista pode não ter os horários mais cedo desses executores
+            corpo += linha_ndjson({
+                "erro": "Disponibilidade não consultada para alguns executores",
+                "executores_com_falha": falhas
+            })
+        return Response(content=corpo, media_type="application/x-ndjson")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Endpoint para criar agendamento
+@router.post("/agendamentos")
+async def criar_agendamento(
+    dados_agendamento: Dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    tenant: Tenant = Depends(get_tenant)
+):
+    try:
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
+        
+        # Cria o agendamento (uma única vez por Idempotency-Key)
+        agendamento_data = await executar_idempotente(
+            f"agendamentos:{tenant.cnpj}",
+            idempotency_key,
+            dados_agendamento,
+            lambda: cnn_service.criar_agendamento(dados_agendamento)
+        )
         
         return agendamento_data
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -326,21 +419,12 @@ async def criar_agendamento(dados_agendamento: Dict):
 @router.put("/agendamentos/{id_agenda}/remarcar")
 async def remarcar_agendamento(
     id_agenda: int,
-    dados_remarcacao: Dict
+    dados_remarcacao: Dict,
+    tenant: Tenant = Depends(get_tenant)
 ):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Verifica se todos os campos necessários estão presentes
         required_fields = ["nova_data", "novo_horario_inicial", "novo_horario_final", "motivo"]
@@ -358,6 +442,8 @@ async def remarcar_agendamento(
         )
         
         return remarcacao_data
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -365,21 +451,12 @@ async def remarcar_agendamento(
 @router.put("/agendamentos/{id_agenda}/status")
 async def alterar_status_agendamento(
     id_agenda: int,
-    status: str
+    status: str,
+    tenant: Tenant = Depends(get_tenant)
 ):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Altera o status do agendamento
         status_data = await cnn_service.alterar_status_agendamento(
@@ -388,30 +465,84 @@ async def alterar_status_agendamento(
         )
         
         return status_data
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para criar paciente
 @router.post("/pacientes")
-async def criar_paciente(dados_paciente: Dict):
+async def criar_paciente(
+    dados_paciente: Dict,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    tenant: Tenant = Depends(get_tenant)
+):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
+        
+        # Cria o paciente (uma única vez por Idempotency-Key)
+        paciente_data = await executar_idempotente(
+            f"pacientes:{tenant.cnpj}",
+            idempotency_key,
+            dados_paciente,
+            lambda: cnn_service.criar_paciente(dados_paciente)
+        )
         
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        return paciente_data
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Endpoint para importação em lote de pacientes (CSV ou NDJSON)
+@router.post("/pacientes/importacao")
+async def importar_pacientes_lote(
+    request: Request,
+    formato: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    concorrencia: int = Query(settings.IMPORTACAO_CONCORRENCIA, ge=1, le=64),
+    checkpoint: Optional[str] = Query(None, pattern="^[A-Za-z0-9_-]{1,64}$", description="Identificador para retomar a importação"),
+    tenant: Tenant = Depends(get_tenant)
+):
+    try:
+        # O formato vem do parâmetro ou do Content-Type
+        if formato is None:
+            tipo = request.headers.get("content-type", "")
+            formato = "ndjson" if "ndjson" in tipo or "jsonl" in tipo else "csv"
+        leitor = ler_csv if formato == "csv" else ler_ndjson
+        
+        caminho = None
+        if checkpoint:
+            os.makedirs(settings.IMPORTACAO_CHECKPOINT_DIR, exist_ok=True)
+            caminho = os.path.join(settings.IMPORTACAO_CHECKPOINT_DIR, f"{tenant.cnpj}-{checkpoint}.jsonl")
+        
+        # O corpo vai para um arquivo temporário (só o primeiro 1 MB fica em memória):
+        # durante o stream da resposta não dá para continuar lendo a requisição
+        corpo = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+        try:
+            async for pedaco in request.stream():
+                await asyncio.to_thread(corpo.write, pedaco)
+            corpo.seek(0)
+        except BaseException:
+            corpo.close()
+            raise
+        
+        # As linhas são processadas aos pedaços enquanto o relatório é enviado
+        resultados = importar_pacientes(
+            tenant.cnn,
+            leitor(pedacos_arquivo(corpo)),
+            concorrencia=concorrencia,
+            checkpoint=caminho,
+            id_origem=tenant.clinica.clinica.id_origem_paciente
+        )
         
-        # Cria o paciente
-        paciente_data = await cnn_service.criar_paciente(dados_paciente)
+        async def ndjson():
+            async for resultado in resultados:
+                yield linha_ndjson(resultado)
         
-        return paciente_data
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -419,21 +550,12 @@ async def criar_paciente(dados_paciente: Dict):
 @router.post("/pacientes/{id_paciente}/convenios/{id_tipo_convenio}")
 async def associar_convenio_paciente(
     id_paciente: int,
-    id_tipo_convenio: int
+    id_tipo_convenio: int,
+    tenant: Tenant = Depends(get_tenant)
 ):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Associa o convênio ao paciente
         convenio_data = await cnn_service.associar_convenio(
@@ -442,102 +564,72 @@ async def associar_convenio_paciente(
         )
         
         return convenio_data
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para listar tipos de convênios
 @router.get("/tipos-convenios")
-async def listar_tipos_convenios():
+async def listar_tipos_convenios(tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca os tipos de convênios
         convenios_data = await cnn_service.get_tipo_convenios()
         
-        return convenios_data
+        return responder(convenios_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para listar tipos de procedimentos
 @router.get("/tipos-procedimentos")
-async def listar_tipos_procedimentos(nome: str = "", somente_ativos: bool = True):
+async def listar_tipos_procedimentos(nome: str = "", somente_ativos: bool = True, tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca os tipos de procedimentos
         procedimentos_data = await cnn_service.get_tipo_procedimentos(nome, somente_ativos)
         
-        return procedimentos_data
+        return responder(procedimentos_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para listar tipos de consultas
 @router.get("/tipos-consultas")
-async def listar_tipos_consultas(nome: str = ""):
+async def listar_tipos_consultas(nome: str = "", tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca os tipos de consultas
         consultas_data = await cnn_service.get_tipo_consultas(nome)
         
-        return consultas_data
+        return responder(consultas_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para buscar executor por ID
 @router.get("/executores/{id_executor}")
-async def buscar_executor(id_executor: int):
+async def buscar_executor(id_executor: int, tenant: Tenant = Depends(get_tenant)):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca o executor por ID
         executor_data = await cnn_service.get_executor_by_id(id_executor)
         
-        return executor_data
+        return responder(executor_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -547,31 +639,61 @@ async def listar_agendamentos(
     codigo_paciente: Optional[int] = None,
     data_inicial: Optional[str] = None,
     data_final: Optional[str] = None,
-    data_por: str = "AGENDAMENTO"
+    data_por: str = "AGENDAMENTO",
+    id_executor: Optional[int] = Query(None, description="Filtra por idPessoaExecutor"),
+    status: Optional[str] = Query(None, description="Status separados por vírgula"),
+    cursor: Optional[str] = None,
+    limite: Optional[int] = Query(None, ge=1, le=500),
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+    tenant: Tenant = Depends(get_tenant)
 ):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
+        filtro = FiltroAgendamentos(
+            codigo_paciente=codigo_paciente,
+            id_executor=id_executor,
+            status=status,
+            data_por=data_por
+        )
         
-        # Busca os agendamentos
+        # Stream NDJSON: cada trecho do período é enviado assim que chega da CNN
+        if formato == "ndjson":
+            if not data_inicial or not data_final:
+                raise HTTPException(status_code=400, detail="data_inicial e data_final são obrigatórios")
+            agendamentos = await iterar_agendamentos(cnn_service, filtro, data_inicial, data_final)
+            
+            async def ndjson():
+                async for agendamento in agendamentos:
+                    yield linha_ndjson(agendamento)
+            
+            return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+        
+        # Paginação por cursor (também usada quando há filtros locais)
+        if cursor or limite or id_executor or status:
+            return responder(await listar_pagina(
+                cnn_service,
+                filtro,
+                limite or 100,
+                data_inicial=data_inicial,
+                data_final=data_final,
+                cursor=cursor
+            ))
+        
+        # Busca os agendamentos (bytes da CNN repassados sem parse)
         agendamentos_data = await cnn_service.get_agendamentos(
             codigo_paciente=codigo_paciente,
             data_inicial=data_inicial,
             data_final=data_final,
-            data_por=data_por
+            data_por=data_por,
+            bruto=True
         )
         
-        return agendamentos_data
+        return responder(agendamentos_data)
+    except CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -581,54 +703,50 @@ async def obter_valores_procedimento(
     id_tipo_procedimento: int,
     id_tipo_convenio: int,
     data_base: str,
-    hora_base: str
+    hora_base: str,
+    tenant: Tenant = Depends(get_tenant)
 ):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
-        
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
         # Busca os valores do procedimento
         valores_data = await cnn_service.get_valores_procedimento(
             id_tipo_procedimento=id_tipo_procedimento,
             id_tipo_convenio=id_tipo_convenio,
             data_base=data_base,
-            hora_base=hora_base
+            hora_base=hora_base,
+            bruto=True
         )
         
-        return valores_data
+        return responder(valores_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Endpoint para listar pacientes
 @router.get("/pacientes")
-async def listar_pacientes(nome: str = "", email: str = "", telefone: str = ""):
+async def listar_pacientes(
+    nome: str = "",
+    email: str = "",
+    telefone: str = "",
+    local: bool = Query(False, description="Busca por nome só no índice local (sem acentos, trecho do nome)"),
+    tenant: Tenant = Depends(get_tenant)
+):
     try:
-        # Busca a clínica para usar nas credenciais
-        supabase_service = SupabaseService()
-        clinica_data = await supabase_service.get_clinica_by_cnpj("30747815000108")
-        
-        if not clinica_data:
-            raise HTTPException(status_code=404, detail="Clínica não encontrada")
-        
-        # Cria instância da clínica
-        clinica = Clinica(**clinica_data)
+        # Serviço da CNN da clínica da requisição
+        cnn_service = tenant.cnn
         
-        # Inicializa serviço da CNN
-        cnn_service = CNNService(clinica)
+        if local and nome:
+            pacientes = await get_patient_index().buscar_nome(cnn_service.cid, nome)
+            return responder({"pagina": 0, "totalPaginas": 1, "lista": pacientes})
         
-        # Busca os pacientes
-        pacientes_data = await cnn_service.get_pacientes(nome, email, telefone)
+        # Busca os pacientes (da CNN, os bytes saem como vieram)
+        pacientes_data = await cnn_service.get_pacientes(nome, email, telefone, bruto=True)
         
-        return pacientes_data
+        return responder(pacientes_data)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,227 @@
+import asyncio
+import base64
+import json
+from datetime import date, timedelta
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Tuple
+from fastapi import HTTPException
+from config import get_settings
+from services.cnn_api import CNNService
+from services.resilience import novo_prazo
+
+settings = get_settings()
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+class FiltroAgendamentos:
+    """Filtros aplicados no servidor sobre cada trecho recebido da CNN."""
+
+    __slots__ = ("codigo_paciente", "id_executor", "status", "data_por")
+
+    def __init__(
+        self,
+        codigo_paciente: Optional[int] = None,
+        id_executor: Optional[int] = None,
+        status: Optional[str] = None,
+        data_por: str = "AGENDAMENTO"
+    ):
+        self.codigo_paciente = codigo_paciente
+        self.id_executor = id_executor
+        # Aceita vários status separados por vírgula (ex.: "AGENDADO,CONFIRMADO")
+        self.status: Optional[FrozenSet[str]] = frozenset(
+            s.strip().upper() for s in status.split(",") if s.strip()
+        ) if status else None
+        self.data_por = data_por
+
+    def assinatura(self) -> List:
+        return [
+            self.codigo_paciente,
+            self.id_executor,
+            sorted(self.status) if self.status else None,
+            self.data_por
+        ]
+
+    def aplicar(self, itens: List) -> List[Dict]:
+        selecionados = []
+        for item in itens:
+            if not isinstance(item, dict):
+                continue
+            if self.codigo_paciente and item.get("idPaciente") != self.codigo_paciente:
+                continue
+            if self.id_executor and item.get("idPessoaExecutor") != self.id_executor:
+                continue
+            if self.status and str(item.get("status", "")).upper() not in self.status:
+                continue
+            selecionados.append(item)
+        return selecionados
+
+
+class _Posicao:
+    """Onde a listagem parou: início do trecho, página da CNN e itens já entregues dela."""
+
+    __slots__ = ("inicio", "fim", "pagina", "offset")
+
+    def __init__(self, inicio: date, fim: date, pagina: int = 0, offset: int = 0):
+        self.inicio = inicio
+        self.fim = fim
+        self.pagina = pagina
+        self.offset = offset
+
+    @property
+    def terminou(self) -> bool:
+        return self.inicio > self.fim
+
+    def fim_do_trecho(self) -> date:
+        return min(self.inicio + timedelta(days=settings.AGENDAMENTOS_CHUNK_DIAS - 1), self.fim)
+
+    def avancar(self, total_paginas: int) -> None:
+        # Próxima página da CNN dentro do trecho ou, no fim dele, o próximo trecho
+        self.offset = 0
+        if self.pagina + 1 < total_paginas:
+            self.pagina += 1
+        else:
+            self.inicio = self.fim_do_trecho() + timedelta(days=1)
+            self.pagina = 0
+
+
+def _data(valor: str, campo: str) -> date:
+    try:
+        return date.fromisoformat(valor[:10])
+    except (TypeError, ValueError):
+        raise CursorInvalido(f"{campo} deve estar no formato YYYY-MM-DD")
+
+
+def codificar_cursor(posicao: _Posicao, filtro: FiltroAgendamentos) -> str:
+    dados = {
+        "i": posicao.inicio.isoformat(),
+        "f": posicao.fim.isoformat(),
+        "p": posicao.pagina,
+        "o": posicao.offset,
+        "q": filtro.assinatura()
+    }
+    return base64.urlsafe_b64encode(json.dumps(dados, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str, filtro: FiltroAgendamentos) -> _Posicao:
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        posicao = _Posicao(date.fromisoformat(dados["i"]), date.fromisoformat(dados["f"]), int(dados["p"]), int(dados["o"]))
+    except (ValueError, KeyError, TypeError):
+        raise CursorInvalido("Cursor inválido")
+    if dados.get("q") != filtro.assinatura():
+        # O cursor só vale para os mesmos filtros da primeira página
+        raise CursorInvalido("Cursor não corresponde aos filtros informados")
+    return posicao
+
+
+async def _buscar_trecho(cnn_service: CNNService, posicao: _Posicao, filtro: FiltroAgendamentos) -> Tuple[List[Dict], int]:
+    payload = await cnn_service.get_agendamentos(
+        codigo_paciente=filtro.codigo_paciente,
+        data_inicial=posicao.inicio.isoformat(),
+        data_final=posicao.fim_do_trecho().isoformat(),
+        data_por=filtro.data_por,
+        pagina=posicao.pagina
+    )
+    if isinstance(payload, list):
+        return filtro.aplicar(payload), 1
+    if not isinstance(payload, dict):
+        return [], 1
+    return filtro.aplicar(payload.get("lista") or []), int(payload.get("totalPaginas") or 1)
+
+
+async def _buscar_trecho_no_stream(cnn_service: CNNService, posicao: _Posicao, filtro: FiltroAgendamentos) -> Tuple[List[Dict], int]:
+    # Roda numa task própria: o prazo novo não vaza para o stream
+    with novo_prazo(settings.REQUEST_DEADLINE):
+        return await _buscar_trecho(cnn_service, posicao, filtro)
+
+
+async def listar_pagina(
+    cnn_service: CNNService,
+    filtro: FiltroAgendamentos,
+    limite: int,
+    data_inicial: Optional[str] = None,
+    data_final: Optional[str] = None,
+    cursor: Optional[str] = None
+) -> Dict:
+    """
+    Retorna até ``limite`` agendamentos e o cursor da próxima página.
+
+    O período é dividido em trechos de ``AGENDAMENTOS_CHUNK_DIAS`` dias buscados
+    sob demanda; só os trechos necessários para preencher a página vão à CNN.
+    """
+    if cursor:
+        posicao = decodificar_cursor(cursor, filtro)
+    else:
+        if not data_inicial or not data_final:
+            raise CursorInvalido("data_inicial e data_final são obrigatórios sem cursor")
+        posicao = _Posicao(_data(data_inicial, "data_inicial"), _data(data_final, "data_final"))
+
+    itens: List[Dict] = []
+    while len(itens) < limite and not posicao.terminou:
+        encontrados, total_paginas = await _buscar_trecho(cnn_service, posicao, filtro)
+        restantes = encontrados[posicao.offset:]
+        faltam = limite - len(itens)
+        itens.extend(restantes[:faltam])
+        if len(restantes) > faltam:
+            posicao.offset += faltam
+        else:
+            posicao.avancar(total_paginas)
+
+    return {
+        "lista": itens,
+        "proximo_cursor": None if posicao.terminou else codificar_cursor(posicao, filtro)
+    }
+
+
+async def iterar_agendamentos(
+    cnn_service: CNNService,
+    filtro: FiltroAgendamentos,
+    data_inicial: str,
+    data_final: str
+) -> AsyncIterator[Dict]:
+    """
+    Percorre o período trecho a trecho, entregando cada agendamento assim que
+    o trecho chega. O trecho seguinte já é buscado enquanto o atual é enviado,
+    e no máximo dois ficam em memória.
+
+    O primeiro trecho é buscado antes de retornar, para que falhas iniciais
+    ainda virem erro HTTP; falhas posteriores encerram o stream com uma linha
+    ``{"erro": ...}``. O primeiro trecho usa o prazo da requisição; cada um dos
+    seguintes tem o seu (``REQUEST_DEADLINE``), já que o stream pode durar mais.
+    """
+    posicao = _Posicao(_data(data_inicial, "data_inicial"), _data(data_final, "data_final"))
+
+    def proximo() -> Optional[asyncio.Task]:
+        if posicao.terminou:
+            return None
+        atual = _Posicao(posicao.inicio, posicao.fim, posicao.pagina)
+        return asyncio.ensure_future(_buscar_trecho_no_stream(cnn_service, atual, filtro))
+
+    trecho = ([], 1) if posicao.terminou else await _buscar_trecho(cnn_service, posicao, filtro)
+
+    async def gerar() -> AsyncIterator[Dict]:
+        encontrados, total_paginas = trecho
+        tarefa = None
+        try:
+            while True:
+                posicao.avancar(total_paginas)
+                tarefa = proximo()
+                for item in encontrados:
+                    yield item
+                if tarefa is None:
+                    return
+                try:
+                    encontrados, total_paginas = await tarefa
+                except HTTPException as e:
+                    yield {"erro": e.detail}
+                    return
+                except Exception as e:
+                    yield {"erro": str(e) or type(e).__name__}
+                    return
+        finally:
+            if tarefa is not None and not tarefa.done():
+                tarefa.cancel()
+
+    return gerar()
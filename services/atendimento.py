@@ -0,0 +1,96 @@
+import logging
+from typing import Dict, Optional
+from config import get_settings
+from models import MensagemWhatsApp, ContextoConversa, Paciente
+from services.clinica_cache import get_clinica_cache
+from services.conversation_store import get_conversation_store
+from services.evolution_service import EvolutionService
+from services.mcp_service import MCPService
+from services.metrics import clinica_atual, metricas_da_clinica
+from services.outbound_dispatcher import INTERATIVA, get_outbound_dispatcher
+from services.patient_index import get_patient_index
+from services.resilience import prazo
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def _paciente_do_indice(dados: Dict) -> Optional[Paciente]:
+    contato = dados.get("contato") if isinstance(dados.get("contato"), dict) else {}
+    try:
+        return Paciente(
+            id=dados.get("id"),
+            nome=dados.get("nome"),
+            cpf_cnpj=dados.get("cpfcnpj"),
+            data_nascimento=dados.get("dataNascimento"),
+            telefone_celular=contato.get("telefoneCelular") or dados.get("telefoneCelular")
+        )
+    except ValueError:
+        # Cadastro incompleto na CNN: o MCP segue com a identificação normal
+        return None
+
+
+async def processar_mensagem_whatsapp(mensagem: MensagemWhatsApp) -> None:
+    # Prazo total do atendimento de uma mensagem (MCP + CNN + envio da resposta)
+    with prazo(settings.ATENDIMENTO_DEADLINE), metricas_da_clinica(getattr(mensagem, "cnpj", None)):
+        await _processar(mensagem)
+
+
+async def _processar(mensagem: MensagemWhatsApp) -> None:
+    # Identifica a clínica pelo CNPJ do webhook ou, na falta dele, pelo número
+    cnpj = getattr(mensagem, "cnpj", None) or mensagem.numero
+    clinica_resolvida = await get_clinica_cache().get(cnpj)
+    if not clinica_resolvida:
+        logger.warning("Clínica não encontrada para %s", cnpj)
+        return
+
+    clinica = clinica_resolvida.clinica
+    clinica_atual.set(clinica.cnpj)
+
+    # Recupera o contexto da conversa (paciente, etapa, dados coletados)
+    conversas = get_conversation_store()
+    contexto = await conversas.load(clinica.cnpj, mensagem.numero, clinica)
+
+    # Paciente que já falou com a clínica é reconhecido pelo telefone, sem ir à CNN
+    if contexto.paciente is None and settings.PACIENTE_INDEX_ENABLED:
+        pacientes, _ = await get_patient_index().buscar_telefone(clinica.cnn_id, mensagem.numero)
+        if len(pacientes) == 1:
+            contexto.paciente = _paciente_do_indice(pacientes[0])
+
+    # Processa a mensagem com o MCP
+    resposta_mcp = await MCPService().process_message(
+        message=mensagem.mensagem,
+        context=contexto.model_dump()
+    )
+
+    # O MCP pode devolver o contexto atualizado para o próximo turno
+    if isinstance(resposta_mcp.get("context"), dict):
+        try:
+            contexto = ContextoConversa(**{
+                **contexto.model_dump(exclude={"clinica"}),
+                **resposta_mcp["context"],
+                "clinica": clinica
+            })
+        except ValueError:
+            logger.warning("Contexto inválido retornado pelo MCP para %s", mensagem.numero)
+    await conversas.save(clinica.cnpj, mensagem.numero, contexto)
+
+    # Executa ações necessárias baseadas na resposta do MCP
+    if resposta_mcp.get("action"):
+        if resposta_mcp["action"] == "agendar_consulta":
+            # Implementar lógica de agendamento
+            pass
+        elif resposta_mcp["action"] == "remarcar_consulta":
+            # Implementar lógica de remarcação
+            pass
+        elif resposta_mcp["action"] == "cancelar_consulta":
+            # Implementar lógica de cancelamento
+            pass
+
+    # Envia resposta ao paciente pela fila de envio, à frente de lembretes e campanhas
+    resposta = resposta_mcp.get("response", "Desculpe, não entendi sua mensagem.")
+    despachante = get_outbound_dispatcher()
+    if despachante is None:
+        await EvolutionService().send_message(number=mensagem.numero, message=resposta)
+        return
+    await despachante.enviar(mensagem.numero, resposta, prioridade=INTERATIVA)
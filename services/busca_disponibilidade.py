@@ -0,0 +1,120 @@
+import asyncio
+import heapq
+import logging
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+from config import get_settings
+from services.cnn_api import CNNService
+from services.erros import ErroUpstream
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Limite de consultas de disponibilidade simultâneas por clínica
+_limites: Dict[str, asyncio.Semaphore] = {}
+
+
+def _limite_clinica(cid: str) -> asyncio.Semaphore:
+    limite = _limites.get(cid)
+    if limite is None:
+        limite = _limites[cid] = asyncio.Semaphore(settings.BUSCA_CONCORRENCIA_POR_CLINICA)
+    return limite
+
+
+def _hora(valor: Optional[str]) -> Optional[str]:
+    # Aceita "HH:MM" ou "HH:MM:SS" e compara sempre no formato completo
+    if not valor:
+        return None
+    return valor if len(valor) >= 8 else f"{valor}:00"
+
+
+def _chave_horario(horario: Dict):
+    return (str(horario.get("data", "")), _hora(horario.get("horaInicio")) or "")
+
+
+def _filtrar(horarios: Iterable[Dict], hora_inicio: Optional[str], hora_fim: Optional[str]) -> List[Dict]:
+    selecionados = []
+    for horario in horarios:
+        if not isinstance(horario, dict):
+            continue
+        inicio = _hora(horario.get("horaInicio")) or ""
+        if hora_inicio and inicio < hora_inicio:
+            continue
+        if hora_fim and inicio >= hora_fim:
+            continue
+        selecionados.append(horario)
+    selecionados.sort(key=_chave_horario)
+    return selecionados
+
+
+async def buscar_horarios(
+    cnn_service: CNNService,
+    cod_tipo_atendimento: int,
+    data_inicio: str,
+    data_fim: str,
+    id_especialidade: Optional[int] = None,
+    id_tipo_convenio: Optional[int] = None,
+    hora_inicio: Optional[str] = None,
+    hora_fim: Optional[str] = None,
+    limite: int = 10
+) -> Tuple[List[Dict], List[Any]]:
+    """
+    Resolve os executores e retorna os ``limite`` horários mais cedo e os ids
+    dos executores cuja consulta falhou.
+
+    A disponibilidade de todos os executores é buscada em paralelo (limitada
+    por clínica) e as listas ordenadas são intercaladas com um heap. Os
+    horários mais cedo só são conhecidos com todas as listas em mãos, então
+    tudo é buscado antes da resposta: se todos os executores falharem, o erro
+    ainda vira um status HTTP em vez de uma lista vazia.
+    """
+    executores_data = await cnn_service.get_executores_agenda(
+        id_especialidade=id_especialidade,
+        id_tipo_convenio=id_tipo_convenio
+    )
+    executores = [e for e in (executores_data or {}).get("lista", []) if isinstance(e, dict) and e.get("id")]
+    hora_inicio, hora_fim = _hora(hora_inicio), _hora(hora_fim)
+    limite_clinica = _limite_clinica(cnn_service.cid)
+
+    async def disponibilidade(executor: Dict) -> List[Dict]:
+        async with limite_clinica:
+            payload = await asyncio.wait_for(
+                cnn_service.get_disponibilidade_executor(
+                    id_executor=executor["id"],
+                    cod_tipo_atendimento=cod_tipo_atendimento,
+                    data_inicio=data_inicio,
+                    data_fim=data_fim
+                ),
+                settings.FANOUT_TIMEOUT
+            )
+        horarios = payload.get("lista", []) if isinstance(payload, dict) else payload or []
+        return [
+            {**horario, "idExecutor": executor["id"], "nomeExecutor": executor.get("nome")}
+            for horario in _filtrar(horarios, hora_inicio, hora_fim)
+        ]
+
+    resultados = await asyncio.gather(*(disponibilidade(e) for e in executores), return_exceptions=True)
+    listas: List[List[Dict]] = []
+    falhas: List[Any] = []
+    erros: List[Exception] = []
+    for executor, resultado in zip(executores, resultados):
+        if isinstance(resultado, Exception):
+            # Um executor com falha não impede a resposta dos demais
+            logger.warning("Falha ao consultar disponibilidade do executor %s: %s", executor["id"], resultado)
+            falhas.append(executor["id"])
+            erros.append(resultado)
+        elif isinstance(resultado, BaseException):
+            raise resultado
+        else:
+            listas.append(resultado)
+
+    if erros and not listas:
+        erro = erros[0]
+        if isinstance(erro, HTTPException):
+            raise erro
+        if isinstance(erro, asyncio.TimeoutError):
+            raise ErroUpstream(504, "Tempo esgotado ao consultar a disponibilidade dos executores", "cnn", codigo="timeout_upstream")
+        raise ErroUpstream(502, f"Falha ao consultar a disponibilidade dos executores: {erro}", "cnn", codigo="falha_upstream")
+
+    return list(islice(heapq.merge(*listas, key=_chave_horario), limite)), falhas
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+from config import get_settings
+from models import RegistroExecutor
+from services.rate_limiter import prioridade_baixa
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def normalizar(texto: Optional[str]) -> str:
+    # Remove acentos, ignora maiúsculas/minúsculas e espaços repetidos
+    decomposto = unicodedata.normalize("NFKD", texto or "")
+    sem_acento = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return " ".join(sem_acento.casefold().split())
+
+
+# Catálogos cujos itens ficam em cache como registros compactos
+REGISTROS = {"executores": RegistroExecutor}
+
+
+class Catalogo:
+    """Resposta completa de um endpoint de catálogo, indexada por nome normalizado."""
+
+    __slots__ = ("_payload", "registros", "indice", "carregado_em", "_consultas")
+
+    def __init__(self, payload: Any, registro: Optional[type] = None):
+        self.carregado_em = time.monotonic()
+        itens = payload.get("lista") if isinstance(payload, dict) else None
+        # Com registro, a lista sai do payload e fica só em ``registros``
+        self.registros: Optional[List[Any]] = None
+        if registro is not None and isinstance(itens, list):
+            try:
+                self.registros = [registro.from_cnn(item) for item in itens]
+            except (AttributeError, ValueError):
+                logger.warning("Catálogo com itens fora do formato esperado; mantido como veio da CNN")
+        if self.registros is not None:
+            self._payload = {k: v for k, v in payload.items() if k != "lista"}
+            self.indice: List[Tuple[str, Any]] = [(normalizar(r.nome), r) for r in self.registros]
+        else:
+            self._payload = payload
+            self.indice = [
+                (normalizar(item.get("nome")), item)
+                for item in (itens or [])
+                if isinstance(item, dict)
+            ]
+        self._consultas: "OrderedDict[str, List[Any]]" = OrderedDict()
+
+    def _resposta(self, itens: List[Any]) -> Dict:
+        if self.registros is not None:
+            itens = [r.para_cnn() for r in itens]
+        return {**self._payload, "lista": itens}
+
+    @property
+    def payload(self) -> Any:
+        if self.registros is not None:
+            return self._resposta(self.registros)
+        return self._payload
+
+    def filtrar(self, nome: Optional[str] = None) -> Any:
+        termo = normalizar(nome)
+        if not termo or not isinstance(self._payload, dict):
+            return self.payload
+        encontrados = self._consultas.get(termo)
+        if encontrados is None:
+            encontrados = [item for nome_normalizado, item in self.indice if termo in nome_normalizado]
+            self._consultas[termo] = encontrados
+            if len(self._consultas) > 256:
+                self._consultas.popitem(last=False)
+        return self._resposta(encontrados)
+
+
+def _cacheavel(catalogo: Catalogo) -> bool:
+    # Respostas de erro do upstream não entram no cache
+    if catalogo.registros is not None:
+        return True
+    payload = catalogo.payload
+    if not isinstance(payload, dict):
+        return False
+    return isinstance(payload.get("lista"), list) or "id" in payload
+
+
+class CatalogCache:
+    """
+    Cache por clínica dos catálogos da CNN (especialidades, tipos, executores).
+
+    Entradas frescas são servidas direto; passada a fração ``refresh_ahead`` do
+    TTL, uma atualização é disparada em background. Entradas vencidas continuam
+    sendo servidas por até ``stale_ttl`` enquanto são revalidadas. Depois disso a
+    entrada é descartada; acima de ``max_entries`` saem as menos usadas.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        stale_ttl: float,
+        refresh_ahead: float,
+        ttls: Optional[Dict[str, float]] = None,
+        max_entries: int = 4096
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self._entradas: "OrderedDict[Tuple[str, str, Hashable], Catalogo]" = OrderedDict()
+        self._cargas = SingleFlight()
+        self._refreshes: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def _ttl(self, tipo: str) -> float:
+        return self.ttls.get(tipo, self.ttl)
+
+    async def get(
+        self,
+        cid: str,
+        tipo: str,
+        params: Hashable,
+        loader: Callable[[], Awaitable[Any]]
+    ) -> Catalogo:
+        chave = (cid, tipo, params)
+        catalogo = self._entradas.get(chave)
+        if catalogo is not None:
+            idade = time.monotonic() - catalogo.carregado_em
+            ttl = self._ttl(tipo)
+            self._entradas.move_to_end(chave)
+            if idade < ttl:
+                self.hits += 1
+                if idade >= ttl * self.refresh_ahead:
+                    self._agendar_refresh(chave, loader)
+                return catalogo
+            if idade < ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._agendar_refresh(chave, loader)
+                return catalogo
+            del self._entradas[chave]
+
+        self.misses += 1
+        return await self._carregar(chave, loader)
+
+    async def _carregar(self, chave, loader) -> Catalogo:
+        return await self._cargas.do(chave, lambda: self._buscar(chave, loader))
+
+    async def _buscar(self, chave, loader) -> Catalogo:
+        catalogo = Catalogo(await loader(), REGISTROS.get(chave[1]))
+        # Uma invalidação durante a busca descarta o resultado antigo
+        if self._cargas.vigente(chave) and _cacheavel(catalogo):
+            self._guardar(chave, catalogo)
+        return catalogo
+
+    def _guardar(self, chave, catalogo: Catalogo) -> None:
+        self._entradas[chave] = catalogo
+        self._entradas.move_to_end(chave)
+        while len(self._entradas) > self.max_entries:
+            self._entradas.popitem(last=False)
+            self.evictions += 1
+
+    def _agendar_refresh(self, chave, loader) -> None:
+        if chave in self._cargas:
+            return
+        self.refreshes += 1
+        task = asyncio.create_task(self._refresh(chave, loader))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    async def _refresh(self, chave, loader) -> None:
+        try:
+            # Atualizações em background cedem a vez às chamadas do atendimento
+            with prioridade_baixa():
+                await self._carregar(chave, loader)
+        except Exception:
+            # Mantém a versão anterior; a próxima leitura tenta de novo
+            logger.warning("Falha ao atualizar catálogo %s", chave[1:], exc_info=True)
+
+    def invalidate(self, cid: str, tipo: Optional[str] = None) -> None:
+        for chave in [c for c in self._entradas if c[0] == cid and (tipo is None or c[1] == tipo)]:
+            del self._entradas[chave]
+        for chave in [c for c in self._cargas.chaves() if c[0] == cid and (tipo is None or c[1] == tipo)]:
+            self._cargas.esquecer(chave)
+
+    def clear(self) -> None:
+        self._entradas.clear()
+        for chave in self._cargas.chaves():
+            self._cargas.esquecer(chave)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entradas),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.stale_hits) / total if total else 0.0
+        }
+
+
+_cache: Optional[CatalogCache] = None
+
+
+def get_catalog_cache() -> CatalogCache:
+    global _cache
+    if _cache is None:
+        _cache = CatalogCache(
+            ttl=settings.CATALOGO_TTL,
+            stale_ttl=settings.CATALOGO_STALE_TTL,
+            refresh_ahead=settings.CATALOGO_REFRESH_AHEAD,
+            ttls=settings.CATALOGO_TTLS,
+            max_entries=settings.CATALOGO_MAX_ENTRIES
+        )
+    return _cache
@@ -0,0 +1,122 @@
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+from config import get_settings
+from models import Clinica
+from services.cnn_api import CNNService
+from services.single_flight import SingleFlight
+from services.supabase_service import SupabaseService
+
+settings = get_settings()
+
+
+class ClinicaResolvida:
+    """Clínica já validada, com os headers da CNN pré-calculados."""
+
+    __slots__ = ("dados", "clinica", "cnn_headers")
+
+    def __init__(self, dados: Dict):
+        self.dados = dados
+        self.clinica = Clinica(**dados)
+        self.cnn_headers = CNNService.build_headers(self.clinica)
+
+    def cnn_service(self, **kwargs) -> CNNService:
+        return CNNService(self.clinica, headers=self.cnn_headers, **kwargs)
+
+
+class ClinicaCache:
+    """Cache TTL+LRU de clínicas por CNPJ, com entradas negativas e single-flight."""
+
+    def __init__(
+        self,
+        loader: Callable[[str], Awaitable[Optional[Dict]]],
+        ttl: float,
+        negative_ttl: float,
+        max_size: int
+    ):
+        self.loader = loader
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        # cnpj -> (expira_em, ClinicaResolvida | None)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._consultas = SingleFlight()
+        self.hits = 0
+        self.negative_hits = 0
+
+    def _lookup(self, cnpj: str):
+        entry = self._entries.get(cnpj)
+        if entry is None:
+            return False, None
+        expira_em, valor = entry
+        if expira_em <= time.monotonic():
+            del self._entries[cnpj]
+            return False, None
+        self._entries.move_to_end(cnpj)
+        return True, valor
+
+    def _store(self, cnpj: str, valor: Optional[ClinicaResolvida]) -> None:
+        ttl = self.ttl if valor is not None else self.negative_ttl
+        self._entries[cnpj] = (time.monotonic() + ttl, valor)
+        self._entries.move_to_end(cnpj)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, cnpj: str) -> Optional[ClinicaResolvida]:
+        encontrado, valor = self._lookup(cnpj)
+        if encontrado:
+            self.hits += 1
+            if valor is None:
+                self.negative_hits += 1
+            return valor
+
+        # Vários misses concorrentes para o mesmo CNPJ aguardam uma única consulta
+        return await self._consultas.do(cnpj, lambda: self._carregar(cnpj))
+
+    async def _carregar(self, cnpj: str) -> Optional[ClinicaResolvida]:
+        dados = await self.loader(cnpj)
+        valor = ClinicaResolvida(dados) if dados else None
+        # Uma invalidação durante a consulta descarta o resultado antigo
+        if self._consultas.vigente(cnpj):
+            self._store(cnpj, valor)
+        return valor
+
+    def invalidate(self, cnpj: str) -> None:
+        self._entries.pop(cnpj, None)
+        self._consultas.esquecer(cnpj)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        for cnpj in self._consultas.chaves():
+            self._consultas.esquecer(cnpj)
+
+    def stats(self) -> Dict:
+        misses = self._consultas.leaders
+        total = self.hits + misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": misses,
+            "negative_hits": self.negative_hits,
+            "coalesced": self._consultas.collapsed,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+_cache: Optional[ClinicaCache] = None
+
+
+async def _carregar_clinica(cnpj: str) -> Optional[Dict]:
+    return await SupabaseService().get_clinica_by_cnpj(cnpj)
+
+
+def get_clinica_cache() -> ClinicaCache:
+    global _cache
+    if _cache is None:
+        _cache = ClinicaCache(
+            loader=_carregar_clinica,
+            ttl=settings.CLINICA_CACHE_TTL,
+            negative_ttl=settings.CLINICA_CACHE_NEGATIVE_TTL,
+            max_size=settings.CLINICA_CACHE_MAX_SIZE
+        )
+    return _cache
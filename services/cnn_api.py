@@ -1,89 +1,214 @@
+import asyncio
+import time
 import httpx
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import base64
 from models import Clinica
+from config import get_settings
+from services.http_clients import get_http_clients
+from services.catalog_cache import get_catalog_cache
+from services.disponibilidade_cache import get_disponibilidade_cache
+from services.erros import ErroUpstream, retry_after_segundos
+from services.rate_limiter import LimiteExcedido, get_cnn_limiters
+from services.resilience import chamar, tempo_restante
+from services.single_flight import get_cnn_single_flight, normalizar_params
+from services.patient_index import get_patient_index
+
+settings = get_settings()
 
 class CNNService:
-    def __init__(self, clinica: Clinica):
-        self.base_url = "https://api.clinicanasnuvens.com.br"
+    def __init__(
+        self,
+        clinica: Clinica,
+        client: Optional[httpx.AsyncClient] = None,
+        headers: Optional[Dict[str, str]] = None
+    ):
+        self.base_url = settings.CNN_API_URL
+        self.client = client or get_http_clients().get(self.base_url)
+        self.headers = headers or self.build_headers(clinica)
+        self.cid = clinica.cnn_id
+    
+    @staticmethod
+    def build_headers(clinica: Clinica) -> Dict[str, str]:
         # Cria a string de autenticação no formato correto: "apiCnn:{api_key}"
         auth_string = f"apiCnn:{clinica.api_key}"
         # Codifica em Base64
         auth_base64 = base64.b64encode(auth_string.encode()).decode()
         
-        self.headers = {
+        return {
             "accept": "application/json",
             "clinicaNasNuvens-cid": clinica.cnn_id,
             "authorization": f"Basic {auth_base64}"
         }
     
-    async def get_paciente(self, cpf_cnpj: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/paciente/lista",
-                params={"cpfCnpj": cpf_cnpj},
-                headers=self.headers
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        # Prazo, retentativas e circuit breaker (por clínica) ficam na camada de resiliência
+        def executar():
+            return chamar(
+                "cnn",
+                f"cnn:{self.cid}",
+                self.client,
+                method,
+                lambda timeout: self._tentativa(method, path, timeout, **kwargs)
             )
-            return response.json()
+        
+        if method != "GET" or not settings.SINGLE_FLIGHT_ENABLED or set(kwargs) - {"params"}:
+            return await executar()
+        # GETs idênticos em andamento compartilham a mesma resposta; cada um faz seu .json()
+        chave = (self.cid, path, normalizar_params(kwargs.get("params")))
+        return await get_cnn_single_flight().do(chave, executar)
     
-    async def get_pacientes(self, nome: str = "", email: str = "", telefone: str = "") -> Dict:
-        async with httpx.AsyncClient() as client:
-            params = {}
-            if nome:
-                params["nomeContem"] = nome
-            if email:
-                params["email"] = email
-            if telefone:
-                params["telefone"] = telefone
-                
-            response = await client.get(
-                f"{self.base_url}/paciente/lista",
-                params=params,
-                headers=self.headers
+    async def _tentativa(self, method: str, path: str, timeout, **kwargs) -> httpx.Response:
+        limitador = get_cnn_limiters().get(self.cid)
+        restante = tempo_restante()
+        if restante is not None and restante <= 0:
+            raise ErroUpstream(504, "Prazo da requisição esgotado", "cnn", codigo="prazo_esgotado")
+        try:
+            await limitador.acquire(timeout=restante)
+        except LimiteExcedido as e:
+            if restante is not None and tempo_restante() <= 0:
+                # A espera na fila consumiu o prazo da requisição
+                raise ErroUpstream(504, "Prazo da requisição esgotado", "cnn", codigo="prazo_esgotado")
+            raise ErroUpstream(
+                503, "Clínica nas Nuvens sobrecarregada para esta clínica", "cnn",
+                codigo="limite_local", retry_after=e.retry_after
             )
-            return response.json()
+        
+        inicio = time.monotonic()
+        try:
+            response = await self._enviar(method, path, timeout, **kwargs)
+        except httpx.TransportError:
+            limitador.registrar(None, time.monotonic() - inicio)
+            raise
+        else:
+            retry_after = retry_after_segundos(response.headers.get("Retry-After"))
+            limitador.registrar(response.status_code, time.monotonic() - inicio, retry_after)
+            return response
+        finally:
+            limitador.release()
     
-    async def get_convenios_paciente(self, id_paciente: int) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/convenio-paciente/lista",
-                params={"idPaciente": id_paciente},
-                headers=self.headers
-            )
-            return response.json()
+    async def _enviar(self, method: str, path: str, timeout, **kwargs) -> httpx.Response:
+        # Só a requisição HTTP, já com a vaga do limitador: é o que as métricas de transporte medem
+        return await self.client.request(
+            method,
+            f"{self.base_url}{path}",
+            headers=self.headers,
+            timeout=timeout,
+            **kwargs
+        )
+    
+    async def _listar_todas_paginas(self, path: str, params: Optional[Dict] = None) -> Dict:
+        # Catálogos são guardados completos; as páginas extras são buscadas em paralelo
+        params = dict(params or {})
+        response = await self._request("GET", path, params=params)
+        primeira = response.json()
+        total_paginas = primeira.get("totalPaginas", 1) if isinstance(primeira, dict) else 1
+        if not isinstance(primeira, dict) or not isinstance(primeira.get("lista"), list) or total_paginas <= 1:
+            return primeira
+        
+        async def pagina(numero: int) -> List:
+            resposta = await self._request("GET", path, params={**params, "pagina": numero})
+            return resposta.json().get("lista", [])
+        
+        restantes = await asyncio.gather(*(pagina(n) for n in range(1, total_paginas)))
+        lista = list(primeira["lista"])
+        for itens in restantes:
+            lista.extend(itens)
+        return {**primeira, "lista": lista, "totalPaginas": 1}
+    
+    async def get_paciente(self, cpf_cnpj: str) -> Dict:
+        # Paciente já conhecido é respondido pelo índice local, sem ida à CNN
+        if settings.PACIENTE_INDEX_ENABLED:
+            indice = get_patient_index()
+            pacientes, vencido = await indice.buscar_documento(self.cid, cpf_cnpj)
+            if pacientes:
+                if vencido:
+                    indice.revalidar(self.cid, f"doc:{cpf_cnpj}", lambda: self._buscar_paciente(cpf_cnpj))
+                return {"pagina": 0, "totalPaginas": 1, "lista": pacientes}
+        return await self._buscar_paciente(cpf_cnpj)
+    
+    async def _buscar_paciente(self, cpf_cnpj: str) -> Dict:
+        response = await self._request(
+            "GET",
+            "/paciente/lista",
+            params={"cpfCnpj": cpf_cnpj}
+        )
+        data = response.json()
+        if settings.PACIENTE_INDEX_ENABLED and isinstance(data, dict) and isinstance(data.get("lista"), list):
+            if data["lista"]:
+                await get_patient_index().registrar(self.cid, data["lista"])
+            else:
+                await get_patient_index().remover_documento(self.cid, cpf_cnpj)
+        return data
+    
+    async def get_pacientes(self, nome: str = "", email: str = "", telefone: str = "", bruto: bool = False) -> Union[Dict, bytes]:
+        # Busca só por telefone (identificação pelo WhatsApp) é atendida pelo índice local
+        if settings.PACIENTE_INDEX_ENABLED and telefone and not nome and not email:
+            indice = get_patient_index()
+            pacientes, vencido = await indice.buscar_telefone(self.cid, telefone)
+            if pacientes:
+                if vencido:
+                    indice.revalidar(self.cid, f"tel:{telefone}", lambda: self._buscar_pacientes(nome, email, telefone))
+                return {"pagina": 0, "totalPaginas": 1, "lista": pacientes}
+        return await self._buscar_pacientes(nome, email, telefone, bruto)
+    
+    async def _buscar_pacientes(self, nome: str = "", email: str = "", telefone: str = "", bruto: bool = False) -> Union[Dict, bytes]:
+        params = {}
+        if nome:
+            params["nomeContem"] = nome
+        if email:
+            params["email"] = email
+        if telefone:
+            params["telefone"] = telefone
+            
+        response = await self._request("GET", "/paciente/lista", params=params)
+        if not settings.PACIENTE_INDEX_ENABLED:
+            return response.content if bruto else response.json()
+        data = response.json()
+        if isinstance(data, dict) and isinstance(data.get("lista"), list):
+            await get_patient_index().registrar(self.cid, data["lista"])
+        # O índice precisa do parse, mas a resposta ainda pode sair com os bytes originais
+        return response.content if bruto else data
+    
+    async def get_convenios_paciente(self, id_paciente: int, bruto: bool = False) -> Union[Dict, bytes]:
+        response = await self._request(
+            "GET",
+            "/convenio-paciente/lista",
+            params={"idPaciente": id_paciente}
+        )
+        return response.content if bruto else response.json()
     
     async def criar_paciente(self, dados_paciente: Dict) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/paciente/novo",
-                json=dados_paciente,
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request("POST", "/paciente/novo", json=dados_paciente)
+        data = response.json()
+        # O novo paciente já pode ser identificado pelo índice local
+        if settings.PACIENTE_INDEX_ENABLED and isinstance(data, dict) and data.get("id") is not None:
+            await get_patient_index().registrar(self.cid, [{**dados_paciente, **data}])
+        return data
     
     async def associar_convenio(self, id_paciente: int, id_tipo_convenio: int) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/convenio-paciente/associar",
-                json={
-                    "idPaciente": id_paciente,
-                    "idTipoConvenio": id_tipo_convenio
-                },
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request(
+            "POST",
+            "/convenio-paciente/associar",
+            json={
+                "idPaciente": id_paciente,
+                "idTipoConvenio": id_tipo_convenio
+            }
+        )
+        return response.json()
     
     async def get_especialidades(self, nome: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/especialidade/lista",
-                params={
-                    "nomeContem": nome,
-                    "somenteAtendidasNaClinica": True
-                },
-                headers=self.headers
+        # O filtro por nome é aplicado localmente sobre a lista completa em cache
+        catalogo = await get_catalog_cache().get(
+            self.cid,
+            "especialidades",
+            None,
+            lambda: self._listar_todas_paginas(
+                "/especialidade/lista",
+                {"somenteAtendidasNaClinica": True}
             )
-            return response.json()
+        )
+        return catalogo.filtrar(nome)
     
     async def get_executores_agenda(
         self,
@@ -98,16 +223,14 @@ class CNNService:
             params["idEspecialidade"] = id_especialidade
         if id_tipo_convenio:
             params["idTipoConvenio"] = id_tipo_convenio
-        if nome:
-            params["nomeContem"] = nome
             
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/executor-agenda/lista",
-                params=params,
-                headers=self.headers
-            )
-            return response.json()
+        catalogo = await get_catalog_cache().get(
+            self.cid,
+            "executores",
+            (id_especialidade or None, id_tipo_convenio or None),
+            lambda: self._listar_todas_paginas("/executor-agenda/lista", params)
+        )
+        return catalogo.filtrar(nome)
     
     async def get_disponibilidade_executor(
         self,
@@ -116,27 +239,36 @@ class CNNService:
         data_inicio: str,
         data_fim: str
     ) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/executor-agenda/disponibilidade",
+        async def carregar(inicio: str, fim: str):
+            response = await self._request(
+                "GET",
+                "/executor-agenda/disponibilidade",
                 params={
                     "idExecutorAgenda": id_executor,
                     "codTipoAtendimento": cod_tipo_atendimento,
-                    "data": data_inicio,
-                    "dataFim": data_fim
-                },
-                headers=self.headers
+                    "data": inicio,
+                    "dataFim": fim
+                }
             )
             return response.json()
+        
+        return await get_disponibilidade_cache().get(
+            self.cid,
+            id_executor,
+            cod_tipo_atendimento,
+            data_inicio,
+            data_fim,
+            carregar
+        )
     
     async def criar_agendamento(self, dados_agendamento: Dict) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/agenda/novo",
-                json=dados_agendamento,
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request("POST", "/agenda/novo", json=dados_agendamento)
+        # O horário reservado deixa de estar disponível
+        if dados_agendamento.get("data"):
+            get_disponibilidade_cache().invalidar_dia(self.cid, dados_agendamento["data"])
+        else:
+            get_disponibilidade_cache().invalidar_clinica(self.cid)
+        return response.json()
     
     async def remarcar_agendamento(
         self,
@@ -146,110 +278,106 @@ class CNNService:
         novo_horario_final: str,
         motivo: str
     ) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/agenda/{id_agenda}/remarcar",
-                json={
-                    "novaData": nova_data,
-                    "novoHorarioInicial": novo_horario_inicial,
-                    "novoHorarioFinal": novo_horario_final,
-                    "motivo": motivo
-                },
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request(
+            "POST",
+            f"/agenda/{id_agenda}/remarcar",
+            json={
+                "novaData": nova_data,
+                "novoHorarioInicial": novo_horario_inicial,
+                "novoHorarioFinal": novo_horario_final,
+                "motivo": motivo
+            }
+        )
+        # A data original não é conhecida aqui: invalida toda a agenda da clínica
+        get_disponibilidade_cache().invalidar_clinica(self.cid)
+        return response.json()
     
     async def alterar_status_agendamento(self, id_agenda: int, status: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.put(
-                f"{self.base_url}/agenda/alteracao-status",
-                json={
-                    "idAgenda": id_agenda,
-                    "status": status
-                },
-                headers=self.headers
-            )
-            return response.json() 
+        response = await self._request(
+            "PUT",
+            "/agenda/alteracao-status",
+            json={
+                "idAgenda": id_agenda,
+                "status": status
+            }
+        )
+        # Cancelamentos liberam horários em datas que não conhecemos aqui
+        get_disponibilidade_cache().invalidar_clinica(self.cid)
+        return response.json()
     
     async def get_tipo_convenios(self) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/tipo-convenio/lista",
-                headers=self.headers
-            )
-            return response.json()
+        catalogo = await get_catalog_cache().get(
+            self.cid,
+            "tipos_convenio",
+            None,
+            lambda: self._listar_todas_paginas("/tipo-convenio/lista")
+        )
+        return catalogo.payload
     
     async def get_tipo_procedimentos(self, nome: str = "", somente_ativos: bool = True) -> Dict:
-        async with httpx.AsyncClient() as client:
-            params = {}
-            if nome:
-                params["nomeContem"] = nome
-            if somente_ativos is not None:
-                params["somenteAtivos"] = somente_ativos
-                
-            response = await client.get(
-                f"{self.base_url}/tipo-procedimento/lista",
-                params=params,
-                headers=self.headers
-            )
-            return response.json()
+        params = {}
+        if somente_ativos is not None:
+            params["somenteAtivos"] = somente_ativos
+            
+        catalogo = await get_catalog_cache().get(
+            self.cid,
+            "tipos_procedimento",
+            somente_ativos,
+            lambda: self._listar_todas_paginas("/tipo-procedimento/lista", params)
+        )
+        return catalogo.filtrar(nome)
     
     async def get_tipo_consultas(self, nome: str = "") -> Dict:
-        async with httpx.AsyncClient() as client:
-            params = {}
-            if nome:
-                params["nomeContem"] = nome
-                
-            response = await client.get(
-                f"{self.base_url}/tipo-consulta/lista",
-                params=params,
-                headers=self.headers
-            )
-            return response.json()
+        catalogo = await get_catalog_cache().get(
+            self.cid,
+            "tipos_consulta",
+            None,
+            lambda: self._listar_todas_paginas("/tipo-consulta/lista")
+        )
+        return catalogo.filtrar(nome)
     
     async def get_executor_by_id(self, id_executor: int) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/executor-agenda/{id_executor}",
-                headers=self.headers
-            )
+        async def carregar():
+            response = await self._request("GET", f"/executor-agenda/{id_executor}")
             return response.json()
+        
+        catalogo = await get_catalog_cache().get(self.cid, "executor", id_executor, carregar)
+        return catalogo.payload
     
     async def get_agendamentos(self, codigo_paciente: Optional[int] = None, 
                               data_inicial: Optional[str] = None, 
                               data_final: Optional[str] = None,
-                              data_por: str = "AGENDAMENTO") -> Dict:
-        async with httpx.AsyncClient() as client:
-            params = {"dataPor": data_por}
+                              data_por: str = "AGENDAMENTO",
+                              pagina: Optional[int] = None,
+                              bruto: bool = False) -> Union[Dict, bytes]:
+        params = {"dataPor": data_por}
+        if pagina:
+            params["pagina"] = pagina
+        
+        if codigo_paciente:
+            params["codigoPaciente"] = codigo_paciente
+        if data_inicial:
+            params["dataInicial"] = data_inicial
+        if data_final:
+            params["dataFinal"] = data_final
             
-            if codigo_paciente:
-                params["codigoPaciente"] = codigo_paciente
-            if data_inicial:
-                params["dataInicial"] = data_inicial
-            if data_final:
-                params["dataFinal"] = data_final
-                
-            response = await client.get(
-                f"{self.base_url}/agenda/lista",
-                params=params,
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request("GET", "/agenda/lista", params=params)
+        return response.content if bruto else response.json()
     
     async def get_valores_procedimento(self, 
                                       id_tipo_procedimento: int, 
                                       id_tipo_convenio: int,
                                       data_base: str,
-                                      hora_base: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/tipo-procedimento/valores-venda",
-                params={
-                    "idTipoProcedimento": id_tipo_procedimento,
-                    "idTipoConvenio": id_tipo_convenio,
-                    "dataBase": data_base,
-                    "horaBase": hora_base
-                },
-                headers=self.headers
-            )
-            return response.json()
\ No newline at end of file
+                                      hora_base: str,
+                                      bruto: bool = False) -> Union[Dict, bytes]:
+        response = await self._request(
+            "GET",
+            "/tipo-procedimento/valores-venda",
+            params={
+                "idTipoProcedimento": id_tipo_procedimento,
+                "idTipoConvenio": id_tipo_convenio,
+                "dataBase": data_base,
+                "horaBase": hora_base
+            }
+        )
+        return response.content if bruto else response.json()
\ No newline at end of file
@@ -0,0 +1,309 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from config import get_settings
+from models import Clinica, ContextoConversa
+from services.supabase_service import get_supabase_client, run_blocking
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Campos persistidos do ContextoConversa. A clínica não é gravada: ela é
+# reidratada a partir do cache de clínicas (e assim a api_key não vai para o banco).
+CAMPOS = ("paciente", "ultimo_agendamento", "etapa_atual", "dados_coletados")
+
+
+def serializar_contexto(contexto: ContextoConversa) -> Dict:
+    dados = contexto.model_dump(include=set(CAMPOS), exclude_none=True)
+    # Omite os valores padrão para manter as linhas pequenas
+    if dados.get("etapa_atual") == "inicio":
+        del dados["etapa_atual"]
+    if not dados.get("dados_coletados"):
+        dados.pop("dados_coletados", None)
+    return dados
+
+
+def desserializar_contexto(campos: Dict, clinica: Optional[Clinica]) -> ContextoConversa:
+    return ContextoConversa(clinica=clinica, **campos)
+
+
+class _Entrada:
+    __slots__ = ("campos", "sujos", "acesso")
+
+    def __init__(self, campos: Dict):
+        self.campos = campos
+        self.sujos: Set[str] = set()
+        self.acesso = time.time()
+
+
+class SQLiteConversationBackend:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversas ("
+            " chave TEXT PRIMARY KEY,"
+            " cnpj TEXT NOT NULL,"
+            " numero TEXT NOT NULL,"
+            " paciente TEXT,"
+            " ultimo_agendamento TEXT,"
+            " etapa_atual TEXT,"
+            " dados_coletados TEXT,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversas_updated_at ON conversas (updated_at)")
+
+    def _load(self, chave: str, desde: float) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(CAMPOS)} FROM conversas WHERE chave = ? AND updated_at > ?",
+                (chave, desde)
+            ).fetchone()
+        if row is None:
+            return None
+        return {campo: json.loads(valor) for campo, valor in zip(CAMPOS, row) if valor is not None}
+
+    def _upsert(self, linhas) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for chave, cnpj, numero, delta, updated_at in linhas:
+                    colunas = list(delta)
+                    valores = [json.dumps(delta[c], separators=(",", ":")) if delta[c] is not None else None for c in colunas]
+                    atualizacao = ", ".join(f"{c} = excluded.{c}" for c in colunas + ["updated_at"])
+                    self._conn.execute(
+                        f"INSERT INTO conversas (chave, cnpj, numero, {', '.join(colunas + ['updated_at'])}) "
+                        f"VALUES (?, ?, ?, {', '.join('?' for _ in colunas + ['updated_at'])}) "
+                        f"ON CONFLICT(chave) DO UPDATE SET {atualizacao}",
+                        [chave, cnpj, numero, *valores, updated_at]
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _purge(self, antes_de: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM conversas WHERE updated_at <= ?", (antes_de,))
+
+    async def load(self, chave: str, desde: float) -> Optional[Dict]:
+        return await asyncio.to_thread(self._load, chave, desde)
+
+    async def upsert(self, linhas) -> None:
+        await asyncio.to_thread(self._upsert, linhas)
+
+    async def purge(self, antes_de: float) -> None:
+        await asyncio.to_thread(self._purge, antes_de)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SupabaseConversationBackend:
+    # Tabela com as colunas: chave (PK), cnpj, numero, paciente, ultimo_agendamento,
+    # etapa_atual, dados_coletados (jsonb) e updated_at (double precision)
+    def __init__(self, table: str):
+        self.table = table
+
+    async def load(self, chave: str, desde: float) -> Optional[Dict]:
+        query = get_supabase_client().table(self.table).select(",".join(CAMPOS)).eq("chave", chave).gt("updated_at", desde)
+        response = await run_blocking(query.execute)
+        if not response.data:
+            return None
+        return {campo: valor for campo, valor in response.data[0].items() if valor is not None}
+
+    async def upsert(self, linhas) -> None:
+        # O PostgREST atualiza apenas as colunas enviadas, então cada linha leva só o delta
+        for chave, cnpj, numero, delta, updated_at in linhas:
+            query = get_supabase_client().table(self.table).upsert(
+                {"chave": chave, "cnpj": cnpj, "numero": numero, "updated_at": updated_at, **delta}
+            )
+            await run_blocking(query.execute)
+
+    async def purge(self, antes_de: float) -> None:
+        query = get_supabase_client().table(self.table).delete().lte("updated_at", antes_de)
+        await run_blocking(query.execute)
+
+    async def close(self) -> None:
+        pass
+
+
+class ConversationStore:
+    """
+    Contexto de conversa por (clínica, número) com camada em memória write-behind.
+
+    As leituras são servidas da memória; só os campos alterados em cada turno
+    são gravados no backend, em lote, pelo loop de flush.
+    """
+
+    def __init__(self, backend=None, ttl: float = 86400.0, flush_interval: float = 2.0, max_entries: int = 10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+        self._entradas: "OrderedDict[Tuple[str, str], _Entrada]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    @staticmethod
+    def _chave(cnpj: str, numero: str) -> str:
+        return f"{cnpj}:{numero}"
+
+    async def start(self) -> None:
+        if self.backend is not None:
+            self._task = asyncio.create_task(self._flush_loop(), name="conversation-flush")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self.backend is not None:
+            await self.backend.close()
+
+    async def load(self, cnpj: str, numero: str, clinica: Optional[Clinica] = None) -> ContextoConversa:
+        chave = (cnpj, numero)
+        agora = time.time()
+        entrada = self._entradas.get(chave)
+        if entrada is not None and entrada.acesso <= agora - self.ttl:
+            # Conversa ociosa além do TTL recomeça do zero
+            entrada = None
+            del self._entradas[chave]
+
+        if entrada is None:
+            self.misses += 1
+            campos = None
+            if self.backend is not None:
+                campos = await self.backend.load(self._chave(cnpj, numero), agora - self.ttl)
+            entrada = _Entrada(campos or {})
+            self._entradas[chave] = entrada
+            self._evict()
+        else:
+            self.hits += 1
+
+        entrada.acesso = agora
+        self._entradas.move_to_end(chave)
+        return desserializar_contexto(entrada.campos, clinica)
+
+    async def save(self, cnpj: str, numero: str, contexto: ContextoConversa) -> None:
+        chave = (cnpj, numero)
+        novos = serializar_contexto(contexto)
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            entrada = _Entrada({})
+            self._entradas[chave] = entrada
+        # Apenas os campos que mudaram neste turno entram no delta
+        for campo in CAMPOS:
+            if novos.get(campo) != entrada.campos.get(campo):
+                entrada.sujos.add(campo)
+        entrada.campos = novos
+        entrada.acesso = time.time()
+        self._entradas.move_to_end(chave)
+        self._evict()
+
+    def _evict(self) -> None:
+        # Só descarta entradas já persistidas (ou sem backend)
+        excesso = len(self._entradas) - self.max_entries
+        if excesso <= 0:
+            return
+        for chave in list(self._entradas):
+            if excesso <= 0:
+                break
+            if not self._entradas[chave].sujos or self.backend is None:
+                del self._entradas[chave]
+                excesso -= 1
+
+    async def flush(self) -> None:
+        if self.backend is None:
+            return
+        linhas = []
+        pendentes = []
+        for (cnpj, numero), entrada in self._entradas.items():
+            if not entrada.sujos:
+                continue
+            delta = {campo: entrada.campos.get(campo) for campo in entrada.sujos}
+            linhas.append((self._chave(cnpj, numero), cnpj, numero, delta, entrada.acesso))
+            pendentes.append((entrada, set(entrada.sujos)))
+            entrada.sujos.clear()
+        if not linhas:
+            return
+        try:
+            await self.backend.upsert(linhas)
+            self.flushes += 1
+        except Exception:
+            # Remarca os campos para a próxima tentativa
+            for entrada, campos in pendentes:
+                entrada.sujos.update(campos)
+            raise
+
+    async def _flush_loop(self) -> None:
+        ultimo_purge = time.time()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                agora = time.time()
+                if agora - ultimo_purge >= 60:
+                    ultimo_purge = agora
+                    limite = agora - self.ttl
+                    for chave in [c for c, e in self._entradas.items() if e.acesso <= limite and not e.sujos]:
+                        del self._entradas[chave]
+                    await self.backend.purge(limite)
+            except Exception:
+                logger.exception("Falha ao persistir contextos de conversa")
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entradas),
+            "dirty": sum(1 for e in self._entradas.values() if e.sujos),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "flushes": self.flushes
+        }
+
+
+_store: Optional[ConversationStore] = None
+
+
+def get_conversation_store() -> ConversationStore:
+    global _store
+    if _store is None:
+        backend_nome = settings.CONVERSA_BACKEND.lower()
+        if backend_nome == "supabase":
+            backend = SupabaseConversationBackend(settings.CONVERSA_SUPABASE_TABLE)
+        elif backend_nome == "sqlite":
+            backend = SQLiteConversationBackend(settings.CONVERSA_SQLITE_PATH)
+        else:
+            backend = None
+        _store = ConversationStore(
+            backend,
+            ttl=settings.CONVERSA_TTL,
+            flush_interval=settings.CONVERSA_FLUSH_INTERVAL,
+            max_entries=settings.CONVERSA_CACHE_MAX_SIZE
+        )
+    return _store
+
+
+async def init_conversation_store() -> ConversationStore:
+    store = get_conversation_store()
+    await store.start()
+    return store
+
+
+async def close_conversation_store() -> None:
+    global _store
+    if _store is not None:
+        await _store.stop()
+        _store = None
@@ -0,0 +1,208 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from config import get_settings
+from models import RegistroHorario
+
+settings = get_settings()
+
+# Faixas maiores que isso vão direto ao upstream, sem cache
+MAX_DIAS_CACHEAVEIS = 62
+
+
+def _dias(data_inicio: str, data_fim: str) -> Optional[List[date]]:
+    try:
+        inicio = date.fromisoformat(data_inicio[:10])
+        fim = date.fromisoformat(data_fim[:10])
+    except (TypeError, ValueError):
+        return None
+    if fim < inicio or (fim - inicio).days >= MAX_DIAS_CACHEAVEIS:
+        return None
+    return [inicio + timedelta(days=n) for n in range((fim - inicio).days + 1)]
+
+
+def _intervalos(dias: List[date]) -> List[Tuple[date, date]]:
+    # Agrupa dias faltantes consecutivos para buscar cada trecho numa única chamada
+    intervalos = []
+    for dia in dias:
+        if intervalos and intervalos[-1][1] + timedelta(days=1) == dia:
+            intervalos[-1] = (intervalos[-1][0], dia)
+        else:
+            intervalos.append((dia, dia))
+    return intervalos
+
+
+def _separar(payload: Any) -> Optional[Tuple[List[Dict], Optional[Dict]]]:
+    # A CNN devolve uma lista de horários; aceita também o envelope {"lista": [...]}
+    if isinstance(payload, list):
+        return payload, None
+    if isinstance(payload, dict) and isinstance(payload.get("lista"), list):
+        return payload["lista"], {k: v for k, v in payload.items() if k != "lista"}
+    return None
+
+
+def _agrupar_por_dia(horarios: List[Dict]) -> Optional[Dict[date, List[RegistroHorario]]]:
+    # Os horários ficam em cache como registros compactos, não como dicts
+    por_dia: Dict[date, List[RegistroHorario]] = {}
+    for horario in horarios:
+        try:
+            registro = RegistroHorario.from_cnn(horario)
+        except (AttributeError, ValueError):
+            return None
+        por_dia.setdefault(date.fromisoformat(registro.data[:10]), []).append(registro)
+    return por_dia
+
+
+class DisponibilidadeCache:
+    """
+    Cache de curta duração dos horários disponíveis, uma entrada por dia.
+
+    Chave: (clínica, executor, tipo de atendimento, dia). Faixas sobrepostas
+    reaproveitam os dias já buscados e só os dias faltantes vão ao upstream.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (cid, executor, tipo, dia) -> (expira_em, horarios, envelope)
+        self._entradas: "OrderedDict[Tuple[str, int, int, date], Tuple[float, Tuple[RegistroHorario, ...], Optional[Dict]]]" = OrderedDict()
+        self._por_dia: Dict[Tuple[str, date], Set[Tuple[str, int, int, date]]] = {}
+        self._geracao: Dict[str, int] = {}
+        self.day_hits = 0
+        self.day_misses = 0
+        self.upstream_calls = 0
+        self.requests = 0
+        self.requests_from_cache = 0
+
+    def _lookup(self, chave) -> Optional[Tuple[Tuple[RegistroHorario, ...], Optional[Dict]]]:
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            return None
+        if entrada[0] <= time.monotonic():
+            self._remover(chave)
+            return None
+        self._entradas.move_to_end(chave)
+        return entrada[1], entrada[2]
+
+    def _guardar(self, chave, horarios: Tuple[RegistroHorario, ...], envelope: Optional[Dict]) -> None:
+        self._entradas[chave] = (time.monotonic() + self.ttl, horarios, envelope)
+        self._entradas.move_to_end(chave)
+        self._por_dia.setdefault((chave[0], chave[3]), set()).add(chave)
+        while len(self._entradas) > self.max_entries:
+            self._remover(next(iter(self._entradas)))
+
+    def _remover(self, chave) -> None:
+        self._entradas.pop(chave, None)
+        chaves_dia = self._por_dia.get((chave[0], chave[3]))
+        if chaves_dia is not None:
+            chaves_dia.discard(chave)
+            if not chaves_dia:
+                del self._por_dia[(chave[0], chave[3])]
+
+    async def get(
+        self,
+        cid: str,
+        id_executor: int,
+        cod_tipo_atendimento: int,
+        data_inicio: str,
+        data_fim: str,
+        loader: Callable[[str, str], Awaitable[Any]]
+    ) -> Any:
+        self.requests += 1
+        dias = _dias(data_inicio, data_fim)
+        if dias is None:
+            self.upstream_calls += 1
+            return await loader(data_inicio, data_fim)
+
+        encontrados: Dict[date, Tuple[Tuple[RegistroHorario, ...], Optional[Dict]]] = {}
+        faltantes = []
+        for dia in dias:
+            valor = self._lookup((cid, id_executor, cod_tipo_atendimento, dia))
+            if valor is None:
+                faltantes.append(dia)
+            else:
+                encontrados[dia] = valor
+        self.day_hits += len(encontrados)
+        self.day_misses += len(faltantes)
+
+        if not faltantes:
+            self.requests_from_cache += 1
+        else:
+            geracao = self._geracao.get(cid, 0)
+            intervalos = _intervalos(faltantes)
+            self.upstream_calls += len(intervalos)
+            payloads = await asyncio.gather(*(
+                loader(inicio.isoformat(), fim.isoformat()) for inicio, fim in intervalos
+            ))
+            separados = [_separar(payload) for payload in payloads]
+            agrupados = [_agrupar_por_dia(s[0]) if s is not None else None for s in separados]
+            if any(a is None for a in agrupados):
+                # Formato inesperado (ex.: erro do upstream): devolve sem cachear
+                if len(payloads) == 1 and not encontrados:
+                    return payloads[0]
+                self.upstream_calls += 1
+                return await loader(data_inicio, data_fim)
+
+            for (inicio, fim), (_, envelope), por_dia in zip(intervalos, separados, agrupados):
+                dia = inicio
+                while dia <= fim:
+                    valor = (tuple(por_dia.get(dia, ())), envelope)
+                    encontrados[dia] = valor
+                    # Uma invalidação durante a busca descarta o resultado
+                    if self._geracao.get(cid, 0) == geracao:
+                        self._guardar((cid, id_executor, cod_tipo_atendimento, dia), *valor)
+                    dia += timedelta(days=1)
+
+        horarios = []
+        envelope = None
+        for dia in dias:
+            itens, envelope_dia = encontrados[dia]
+            horarios.extend(item.para_cnn() for item in itens)
+            envelope = envelope or envelope_dia
+        if envelope is not None:
+            return {**envelope, "lista": horarios}
+        return horarios
+
+    def invalidar_dia(self, cid: str, dia: str) -> None:
+        try:
+            data = date.fromisoformat(str(dia)[:10])
+        except ValueError:
+            self.invalidar_clinica(cid)
+            return
+        self._geracao[cid] = self._geracao.get(cid, 0) + 1
+        for chave in list(self._por_dia.get((cid, data), ())):
+            self._remover(chave)
+
+    def invalidar_clinica(self, cid: str) -> None:
+        self._geracao[cid] = self._geracao.get(cid, 0) + 1
+        for chave in [c for c in self._entradas if c[0] == cid]:
+            self._remover(chave)
+
+    def stats(self) -> Dict:
+        total = self.day_hits + self.day_misses
+        return {
+            "entries": len(self._entradas),
+            "day_hits": self.day_hits,
+            "day_misses": self.day_misses,
+            "hit_ratio": self.day_hits / total if total else 0.0,
+            "requests": self.requests,
+            "requests_from_cache": self.requests_from_cache,
+            "upstream_calls": self.upstream_calls,
+            # Requisições atendidas sem nenhuma chamada ao upstream
+            "upstream_calls_saved": self.requests_from_cache
+        }
+
+
+_cache: Optional[DisponibilidadeCache] = None
+
+
+def get_disponibilidade_cache() -> DisponibilidadeCache:
+    global _cache
+    if _cache is None:
+        _cache = DisponibilidadeCache(
+            ttl=settings.DISPONIBILIDADE_TTL,
+            max_entries=settings.DISPONIBILIDADE_MAX_ENTRIES
+        )
+    return _cache
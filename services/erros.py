@@ -0,0 +1,44 @@
+from typing import Dict, Optional
+from fastapi import HTTPException
+
+
+class ErroUpstream(HTTPException):
+    """
+    Falha de uma API externa, com o status que o cliente deve receber.
+
+    Herda de HTTPException para atravessar o ``except HTTPException: raise``
+    das rotas em vez de virar um 500 genérico. O ``detail`` é estruturado:
+    ``{"codigo", "mensagem", "upstream"}`` (+ ``retry_after``/``upstream_status``).
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        mensagem: str,
+        upstream: str,
+        codigo: str = "erro_upstream",
+        retry_after: Optional[float] = None,
+        upstream_status: Optional[int] = None
+    ):
+        detail: Dict = {"codigo": codigo, "mensagem": mensagem, "upstream": upstream}
+        headers: Dict[str, str] = {}
+        if retry_after is not None:
+            detail["retry_after"] = round(retry_after, 3)
+            headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+        if upstream_status is not None:
+            detail["upstream_status"] = upstream_status
+        super().__init__(status_code=status_code, detail=detail, headers=headers or None)
+        self.codigo = codigo
+        self.upstream = upstream
+        self.retry_after = retry_after
+        self.upstream_status = upstream_status
+
+
+def retry_after_segundos(valor: Optional[str]) -> Optional[float]:
+    # Só o formato em segundos é usado pelas APIs integradas
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        return None
@@ -1,58 +1,75 @@
 import httpx
 from typing import Dict, Optional
 from config import get_settings
+from services.http_clients import get_http_clients
+from services.resilience import chamar
 
 settings = get_settings()
 
 class EvolutionService:
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.base_url = settings.EVOLUTION_API_URL
+        self.client = client or get_http_clients().get(self.base_url)
+        # Um circuit breaker por host do upstream
+        self.circuito = f"evolution:{httpx.URL(self.base_url).host}"
         self.headers = {
             "accept": "application/json",
             "apikey": settings.EVOLUTION_API_KEY
         }
     
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        return await chamar(
+            "evolution",
+            self.circuito,
+            self.client,
+            method,
+            lambda timeout: self._enviar(method, path, timeout, **kwargs)
+        )
+    
+    async def _enviar(self, method: str, path: str, timeout, **kwargs) -> httpx.Response:
+        # Uma tentativa: é a requisição HTTP medida pelas métricas de transporte
+        return await self.client.request(
+            method,
+            f"{self.base_url}{path}",
+            headers=self.headers,
+            timeout=timeout,
+            **kwargs
+        )
+    
     async def send_message(self, number: str, message: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/message/send",
-                json={
-                    "number": number,
-                    "text": message
-                },
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request(
+            "POST",
+            "/message/send",
+            json={
+                "number": number,
+                "text": message
+            }
+        )
+        return response.json()
     
     async def send_file(self, number: str, file_url: str, caption: Optional[str] = None) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/message/send",
-                json={
-                    "number": number,
-                    "file": file_url,
-                    "caption": caption
-                },
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request(
+            "POST",
+            "/message/send",
+            json={
+                "number": number,
+                "file": file_url,
+                "caption": caption
+            }
+        )
+        return response.json()
     
     async def get_message_status(self, message_id: str) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/message/status/{message_id}",
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request("GET", f"/message/status/{message_id}")
+        return response.json()
     
     async def get_chat_history(self, number: str, limit: int = 50) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/chat/history",
-                params={
-                    "number": number,
-                    "limit": limit
-                },
-                headers=self.headers
-            )
-            return response.json() 
\ No newline at end of file
+        response = await self._request(
+            "GET",
+            "/chat/history",
+            params={
+                "number": number,
+                "limit": limit
+            }
+        )
+        return response.json()
\ No newline at end of file
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class Chamada:
+    """Uma chamada independente dentro de um fan-out."""
+
+    __slots__ = ("factory", "timeout", "opcional")
+
+    def __init__(self, factory: Callable[[], Awaitable[Any]], timeout: Optional[float] = None, opcional: bool = False):
+        self.factory = factory
+        self.timeout = timeout
+        # Chamadas opcionais podem falhar sem derrubar o resultado (resultado parcial)
+        self.opcional = opcional
+
+
+class ResultadoFanout:
+    __slots__ = ("valores", "erros")
+
+    def __init__(self):
+        self.valores: Dict[str, Any] = {}
+        self.erros: Dict[str, str] = {}
+
+    @property
+    def parcial(self) -> bool:
+        return bool(self.erros)
+
+    def __getitem__(self, nome: str) -> Any:
+        return self.valores.get(nome)
+
+
+async def _executar(chamada: Chamada, timeout_padrao: Optional[float]) -> Any:
+    timeout = chamada.timeout if chamada.timeout is not None else timeout_padrao
+    if timeout is None:
+        return await chamada.factory()
+    return await asyncio.wait_for(chamada.factory(), timeout)
+
+
+async def reunir(chamadas: Dict[str, Chamada], timeout: Optional[float] = None) -> ResultadoFanout:
+    """
+    Executa as chamadas em paralelo; a latência total é a da mais lenta.
+
+    Se uma chamada obrigatória falhar, as demais são canceladas e o erro é
+    propagado. Falhas e timeouts das opcionais ficam em ``erros``.
+    """
+    resultado = ResultadoFanout()
+    tarefas = {
+        nome: asyncio.ensure_future(_executar(chamada, timeout))
+        for nome, chamada in chamadas.items()
+    }
+    try:
+        await asyncio.wait(
+            [t for n, t in tarefas.items() if not chamadas[n].opcional] or list(tarefas.values()),
+            return_when=asyncio.FIRST_EXCEPTION
+        )
+        for nome, tarefa in tarefas.items():
+            if not chamadas[nome].opcional and tarefa.done() and tarefa.exception() is not None:
+                raise tarefa.exception()
+        # As obrigatórias terminaram: aguarda as opcionais (limitadas pelo próprio timeout)
+        await asyncio.wait(list(tarefas.values()))
+    finally:
+        for tarefa in tarefas.values():
+            if not tarefa.done():
+                tarefa.cancel()
+            elif not tarefa.cancelled():
+                # Marca a exceção como consumida mesmo quando o fan-out é abortado
+                tarefa.exception()
+
+    for nome, tarefa in tarefas.items():
+        if tarefa.cancelled():
+            resultado.erros[nome] = "cancelada"
+        elif tarefa.exception() is not None:
+            erro = tarefa.exception()
+            resultado.erros[nome] = "timeout" if isinstance(erro, asyncio.TimeoutError) else str(erro) or type(erro).__name__
+        else:
+            resultado.valores[nome] = tarefa.result()
+    return resultado
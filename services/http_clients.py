@@ -0,0 +1,84 @@
+import httpx
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+from config import get_settings
+
+try:
+    import h2  # noqa: F401
+    HTTP2_DISPONIVEL = True
+except ImportError:  # pragma: no cover - depende do extra httpx[http2]
+    HTTP2_DISPONIVEL = False
+
+
+class HTTPClientRegistry:
+    """Mantém um httpx.AsyncClient (pool keep-alive) por host de upstream."""
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_settings()
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def _build_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=self.settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=self.settings.HTTP_KEEPALIVE_EXPIRY
+        )
+
+    def _build_timeout(self, read_timeout: Optional[float] = None) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.settings.HTTP_CONNECT_TIMEOUT,
+            read=read_timeout or self.settings.HTTP_READ_TIMEOUT,
+            write=self.settings.HTTP_WRITE_TIMEOUT,
+            pool=self.settings.HTTP_POOL_TIMEOUT
+        )
+
+    def get(self, url: str, read_timeout: Optional[float] = None) -> httpx.AsyncClient:
+        key = self._host_key(url)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=self.settings.HTTP2_ENABLED and HTTP2_DISPONIVEL,
+                limits=self._build_limits(),
+                timeout=self._build_timeout(read_timeout)
+            )
+            self._clients[key] = client
+        return client
+
+    def hosts(self) -> Dict[str, httpx.AsyncClient]:
+        return dict(self._clients)
+
+    async def aclose(self) -> None:
+        # Fecha os pools drenando as conexões keep-alive
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+_registry: Optional[HTTPClientRegistry] = None
+
+
+def init_http_clients(settings=None) -> HTTPClientRegistry:
+    global _registry
+    _registry = HTTPClientRegistry(settings)
+    return _registry
+
+
+def get_http_clients() -> HTTPClientRegistry:
+    # Scripts fora do lifespan (ex.: test_patient.py) recebem um registro sob demanda
+    global _registry
+    if _registry is None:
+        _registry = HTTPClientRegistry()
+    return _registry
+
+
+async def close_http_clients() -> None:
+    global _registry
+    if _registry is not None:
+        await _registry.aclose()
+        _registry = None
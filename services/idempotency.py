@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from fastapi import HTTPException
+from config import get_settings
+from services.erros import ErroUpstream
+from services.resilience import CODIGOS_NAO_ENVIADA
+
+settings = get_settings()
+
+PENDENTE = "pending"
+CONCLUIDO = "done"
+# A operação falhou sem saber se a CNN a executou; ``response`` guarda o erro devolvido
+INCERTO = "unknown"
+
+
+class IdempotencyRecord:
+    __slots__ = ("status", "fingerprint", "response")
+
+    def __init__(self, status: str, fingerprint: Optional[str] = None, response: Any = None):
+        self.status = status
+        self.fingerprint = fingerprint
+        self.response = response
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"status": self.status, "fingerprint": self.fingerprint, "response": self.response},
+            separators=(",", ":")
+        )
+
+    @classmethod
+    def from_json(cls, raw: str) -> "IdempotencyRecord":
+        data = json.loads(raw)
+        return cls(data["status"], data.get("fingerprint"), data.get("response"))
+
+
+def fingerprint(payload: Any) -> str:
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def extrair_id_mensagem(payload: Dict) -> Optional[str]:
+    # Formatos aceitos: {"id"}, {"messageId"}, {"key": {"id"}} e {"data": {"key": {"id"}}}
+    for origem in (payload, payload.get("data") if isinstance(payload.get("data"), dict) else None):
+        if not origem:
+            continue
+        for campo in ("id", "messageId"):
+            if origem.get(campo):
+                return str(origem[campo])
+        chave = origem.get("key")
+        if isinstance(chave, dict) and chave.get("id"):
+            return str(chave["id"])
+    return None
+
+
+class MemoryIdempotencyStore:
+    """Janela de idempotência em memória, limitada por TTL e número de entradas."""
+
+    def __init__(self, ttl: float, pending_ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.max_entries = max_entries
+        # chave -> (expira_em, IdempotencyRecord)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _get(self, key: str) -> Optional[IdempotencyRecord]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def _set(self, key: str, record: IdempotencyRecord, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, record)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def reserve(self, key: str, fingerprint: Optional[str] = None) -> Optional[IdempotencyRecord]:
+        existente = self._get(key)
+        if existente is not None:
+            return existente
+        self._set(key, IdempotencyRecord(PENDENTE, fingerprint), self.pending_ttl)
+        return None
+
+    async def complete(self, key: str, response: Any = None, status: str = CONCLUIDO) -> None:
+        atual = self._get(key)
+        self._set(key, IdempotencyRecord(status, atual.fingerprint if atual else None, response), self.ttl)
+
+    async def release(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    async def close(self) -> None:
+        self._entries.clear()
+
+
+class SQLiteIdempotencyStore:
+    """Janela de idempotência persistida em SQLite (sobrevive a reinícios)."""
+
+    def __init__(self, path: str, ttl: float, pending_ttl: float):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            " key TEXT PRIMARY KEY,"
+            " record TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._reservas = 0
+
+    def _reserve(self, key: str, record: IdempotencyRecord) -> Optional[IdempotencyRecord]:
+        agora = time.time()
+        with self._lock:
+            self._reservas += 1
+            if self._reservas % 1000 == 0:
+                self._conn.execute("DELETE FROM idempotency WHERE expires_at <= ?", (agora,))
+            self._conn.execute("DELETE FROM idempotency WHERE key = ? AND expires_at <= ?", (key, agora))
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO idempotency (key, record, expires_at) VALUES (?, ?, ?)",
+                (key, record.to_json(), agora + self.pending_ttl)
+            )
+            if cursor.rowcount == 1:
+                return None
+            row = self._conn.execute("SELECT record FROM idempotency WHERE key = ?", (key,)).fetchone()
+        return IdempotencyRecord.from_json(row[0]) if row else None
+
+    def _complete(self, key: str, response: Any, status: str) -> None:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM idempotency WHERE key = ?", (key,)).fetchone()
+            anterior = IdempotencyRecord.from_json(row[0]) if row else None
+            record = IdempotencyRecord(status, anterior.fingerprint if anterior else None, response)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency (key, record, expires_at) VALUES (?, ?, ?)",
+                (key, record.to_json(), time.time() + self.ttl)
+            )
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+    async def reserve(self, key: str, fingerprint: Optional[str] = None) -> Optional[IdempotencyRecord]:
+        return await asyncio.to_thread(self._reserve, key, IdempotencyRecord(PENDENTE, fingerprint))
+
+    async def complete(self, key: str, response: Any = None, status: str = CONCLUIDO) -> None:
+        await asyncio.to_thread(self._complete, key, response, status)
+
+    async def release(self, key: str) -> None:
+        await asyncio.to_thread(self._release, key)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisIdempotencyStore:
+    """Janela de idempotência em Redis (ou servidor compatível), compartilhada entre processos."""
+
+    def __init__(self, url: str, ttl: float, pending_ttl: float, prefix: str = "idempotency:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("IDEMPOTENCY_BACKEND=redis requer o pacote 'redis'") from e
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.prefix = prefix
+
+    async def reserve(self, key: str, fingerprint: Optional[str] = None) -> Optional[IdempotencyRecord]:
+        chave = self.prefix + key
+        record = IdempotencyRecord(PENDENTE, fingerprint)
+        if await self._redis.set(chave, record.to_json(), nx=True, px=int(self.pending_ttl * 1000)):
+            return None
+        raw = await self._redis.get(chave)
+        return IdempotencyRecord.from_json(raw) if raw else None
+
+    async def complete(self, key: str, response: Any = None, status: str = CONCLUIDO) -> None:
+        chave = self.prefix + key
+        raw = await self._redis.get(chave)
+        anterior = IdempotencyRecord.from_json(raw) if raw else None
+        record = IdempotencyRecord(status, anterior.fingerprint if anterior else None, response)
+        await self._redis.set(chave, record.to_json(), px=int(self.ttl * 1000))
+
+    async def release(self, key: str) -> None:
+        await self._redis.delete(self.prefix + key)
+
+    async def close(self) -> None:
+        await self._redis.close()
+
+
+_store = None
+
+
+def get_idempotency_store():
+    global _store
+    if _store is None:
+        backend = settings.IDEMPOTENCY_BACKEND.lower()
+        if backend == "sqlite":
+            _store = SQLiteIdempotencyStore(
+                settings.IDEMPOTENCY_SQLITE_PATH,
+                ttl=settings.IDEMPOTENCY_TTL,
+                pending_ttl=settings.IDEMPOTENCY_PENDING_TTL
+            )
+        elif backend == "redis":
+            _store = RedisIdempotencyStore(
+                settings.IDEMPOTENCY_REDIS_URL,
+                ttl=settings.IDEMPOTENCY_TTL,
+                pending_ttl=settings.IDEMPOTENCY_PENDING_TTL
+            )
+        else:
+            _store = MemoryIdempotencyStore(
+                ttl=settings.IDEMPOTENCY_TTL,
+                pending_ttl=settings.IDEMPOTENCY_PENDING_TTL,
+                max_entries=settings.IDEMPOTENCY_MAX_ENTRIES
+            )
+    return _store
+
+
+async def executar_idempotente(escopo: str, chave: Optional[str], payload: Dict, operacao):
+    # Sem Idempotency-Key a operação roda normalmente
+    if not chave:
+        return await operacao()
+    
+    store = get_idempotency_store()
+    chave_completa = f"{escopo}:{chave}"
+    impressao = fingerprint(payload)
+    existente = await store.reserve(chave_completa, impressao)
+    if existente is not None:
+        if existente.fingerprint and existente.fingerprint != impressao:
+            raise HTTPException(status_code=422, detail="Idempotency-Key já usada com outro conteúdo")
+        if existente.status == CONCLUIDO:
+            return existente.response
+        if existente.status == INCERTO:
+            # Repete o erro original: outra tentativa poderia duplicar o registro
+            raise HTTPException(status_code=existente.response["status"], detail=existente.response["detail"])
+        raise HTTPException(status_code=409, detail="Requisição com esta Idempotency-Key em processamento")
+    
+    try:
+        resultado = await operacao()
+    except BaseException as e:
+        if _nao_executada(e):
+            # Libera a chave para que o cliente possa tentar novamente
+            await store.release(chave_completa)
+        else:
+            erro = e if isinstance(e, HTTPException) else HTTPException(
+                status_code=500, detail="Falha sem confirmação de que a operação não foi executada"
+            )
+            await store.complete(chave_completa, {"status": erro.status_code, "detail": erro.detail}, INCERTO)
+        raise
+    await store.complete(chave_completa, resultado)
+    return resultado
+
+
+def _nao_executada(erro: BaseException) -> bool:
+    """
+    Só erros que certamente aconteceram antes da escrita na CNN liberam a
+    Idempotency-Key. Timeout ou conexão perdida com a requisição já enviada
+    (e erros inesperados) deixam o resultado incerto.
+    """
+    if isinstance(erro, ErroUpstream):
+        # 4xx/429: a CNN recusou a requisição
+        return erro.codigo in CODIGOS_NAO_ENVIADA or erro.status_code < 500
+    # Validação local, antes de chamar a CNN
+    return isinstance(erro, HTTPException)
+
+
+async def close_idempotency_store() -> None:
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
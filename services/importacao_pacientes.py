@@ -0,0 +1,371 @@
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Set, TextIO, Tuple
+from fastapi import HTTPException
+from pydantic import ValidationError
+from config import get_settings
+from models import Paciente
+from services.cnn_api import CNNService
+from services.resilience import prazo
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Origem usada quando a clínica não tem uma origem padrão cadastrada (ver API_GUIDE)
+ID_ORIGEM_PADRAO = 69210
+
+# Nomes de coluna aceitos -> campo do models.Paciente
+ALIASES = {
+    "cpf": "cpf_cnpj",
+    "cpfcnpj": "cpf_cnpj",
+    "cpf_cnpj": "cpf_cnpj",
+    "datanascimento": "data_nascimento",
+    "data_nascimento": "data_nascimento",
+    "telefone": "telefone_celular",
+    "telefonecelular": "telefone_celular",
+    "telefone_celular": "telefone_celular",
+    "celular": "telefone_celular",
+    "nome": "nome",
+    "email": "email",
+}
+COLUNAS_CONVENIO = ("convenios", "id_tipo_convenio", "convenio")
+
+Linha = Tuple[int, Optional[Dict], Optional[str]]
+
+# Resultados que não contam como concluídos ao retomar pelo checkpoint
+STATUS_RETENTAVEIS = frozenset({"erro", "parcial"})
+
+
+async def pedacos_arquivo(arquivo: BinaryIO, tamanho: int = 65536) -> AsyncIterator[bytes]:
+    # Leituras em thread: acima de 1 MB o corpo da importação está em disco
+    try:
+        while True:
+            pedaco = await asyncio.to_thread(arquivo.read, tamanho)
+            if not pedaco:
+                return
+            yield pedaco
+    finally:
+        arquivo.close()
+
+
+async def _linhas_texto(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Decodifica aos pedaços: o arquivo nunca é carregado inteiro em memória
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    resto = ""
+    async for chunk in chunks:
+        resto += decoder.decode(chunk)
+        *linhas, resto = resto.split("\n")
+        for linha in linhas:
+            yield linha.rstrip("\r")
+    resto += decoder.decode(b"", final=True)
+    if resto.strip():
+        yield resto.rstrip("\r")
+
+
+async def ler_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Linha]:
+    numero = 0
+    async for texto in _linhas_texto(chunks):
+        numero += 1
+        if not texto.strip():
+            continue
+        try:
+            dados = json.loads(texto)
+        except ValueError as e:
+            yield numero, None, f"JSON inválido: {e}"
+            continue
+        if not isinstance(dados, dict):
+            yield numero, None, "Cada linha deve ser um objeto JSON"
+            continue
+        yield numero, dados, None
+
+
+async def ler_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Linha]:
+    cabecalho: Optional[List[str]] = None
+    delimitador = ","
+    registro = ""
+    numero = 0
+    inicio_registro = 0
+    async for texto in _linhas_texto(chunks):
+        numero += 1
+        registro = f"{registro}\n{texto}" if registro else texto
+        if not registro:
+            continue
+        if registro.count('"') % 2:
+            # Campo entre aspas com quebra de linha: junta com a próxima linha física
+            inicio_registro = inicio_registro or numero
+            continue
+        linha_inicial = inicio_registro or numero
+        inicio_registro = 0
+        if cabecalho is None:
+            if ";" in registro and "," not in registro:
+                delimitador = ";"
+            cabecalho = [c.strip().lower() for c in next(csv.reader([registro], delimiter=delimitador))]
+            registro = ""
+            continue
+        valores = next(csv.reader([registro], delimiter=delimitador), [])
+        registro = ""
+        if not any(v.strip() for v in valores):
+            continue
+        if len(valores) != len(cabecalho):
+            yield linha_inicial, None, f"Esperadas {len(cabecalho)} colunas, encontradas {len(valores)}"
+            continue
+        yield linha_inicial, {c: v.strip() for c, v in zip(cabecalho, valores) if v.strip() != ""}, None
+    if registro:
+        yield inicio_registro or numero, None, "Aspas não fechadas no fim do arquivo"
+
+
+def _convenios(dados: Dict) -> List[int]:
+    ids: List[int] = []
+    for coluna in COLUNAS_CONVENIO:
+        valor = dados.pop(coluna, None)
+        if valor is None:
+            continue
+        itens = valor if isinstance(valor, list) else str(valor).replace(",", ";").split(";")
+        for item in itens:
+            if isinstance(item, dict):
+                item = item.get("idTipoConvenio") or item.get("id_tipo_convenio")
+            if str(item).strip():
+                ids.append(int(str(item).strip()))
+    return list(dict.fromkeys(ids))
+
+
+def validar_linha(dados: Dict) -> Tuple[Paciente, List[int]]:
+    """Normaliza os nomes de coluna e valida contra ``models.Paciente``."""
+    normalizados: Dict = {}
+    for chave, valor in dados.items():
+        chave_normalizada = chave.strip().lower()
+        normalizados[ALIASES.get(chave_normalizada, chave_normalizada)] = valor
+    try:
+        convenios = _convenios(normalizados)
+    except ValueError:
+        raise ValueError("IDs de convênio devem ser numéricos")
+    for campo in ("cpf_cnpj", "telefone_celular"):
+        if normalizados.get(campo) is not None:
+            normalizados[campo] = "".join(c for c in str(normalizados[campo]) if c.isdigit())
+    return Paciente(**normalizados), convenios
+
+
+def payload_cnn(paciente: Paciente, id_origem: int) -> Dict:
+    contato = {"telefoneCelular": paciente.telefone_celular}
+    email = getattr(paciente, "email", None)
+    if email:
+        contato["email"] = email
+    return {
+        "nome": paciente.nome,
+        "cpfcnpj": paciente.cpf_cnpj,
+        "dataNascimento": paciente.data_nascimento,
+        "idOrigem": id_origem,
+        "contato": contato
+    }
+
+
+def _erro(e: Exception) -> str:
+    if isinstance(e, HTTPException):
+        detail = e.detail
+        return detail.get("mensagem", str(detail)) if isinstance(detail, dict) else str(detail)
+    return str(e) or type(e).__name__
+
+
+class TravasPorDocumento:
+    """
+    Linhas com o mesmo CPF/CNPJ rodam uma de cada vez: a segunda encontra o
+    paciente criado pela primeira em vez de criá-lo de novo.
+    """
+
+    def __init__(self):
+        self._travas: Dict[str, asyncio.Lock] = {}
+        self._usos: Counter = Counter()
+
+    @asynccontextmanager
+    async def travar(self, documento: str):
+        trava = self._travas.setdefault(documento, asyncio.Lock())
+        self._usos[documento] += 1
+        try:
+            async with trava:
+                yield
+        finally:
+            self._usos[documento] -= 1
+            if not self._usos[documento]:
+                del self._usos[documento]
+                del self._travas[documento]
+
+
+async def importar_linha(
+    cnn_service: CNNService,
+    numero: int,
+    dados: Dict,
+    id_origem: int,
+    travas: Optional[TravasPorDocumento] = None
+) -> Dict:
+    try:
+        paciente, convenios = validar_linha(dict(dados))
+    except ValidationError as e:
+        campos = ", ".join(".".join(str(p) for p in erro["loc"]) for erro in e.errors())
+        return {"linha": numero, "status": "invalido", "erro": f"Campos inválidos ou ausentes: {campos}"}
+    except ValueError as e:
+        return {"linha": numero, "status": "invalido", "erro": str(e)}
+
+    if travas is None:
+        return await _importar_paciente(cnn_service, numero, paciente, convenios, id_origem)
+    async with travas.travar(paciente.cpf_cnpj):
+        return await _importar_paciente(cnn_service, numero, paciente, convenios, id_origem)
+
+
+async def _importar_paciente(
+    cnn_service: CNNService,
+    numero: int,
+    paciente: Paciente,
+    convenios: List[int],
+    id_origem: int
+) -> Dict:
+    resultado = {"linha": numero, "cpf_cnpj": paciente.cpf_cnpj}
+    existentes = (await cnn_service.get_paciente(paciente.cpf_cnpj) or {}).get("lista") or []
+    if existentes:
+        id_paciente = existentes[0].get("id")
+        resultado["status"] = "existente"
+        # Só associa os convênios que o paciente ainda não tem
+        if convenios:
+            atuais = (await cnn_service.get_convenios_paciente(id_paciente) or {}).get("lista") or []
+            ja_associados: Set[int] = {c.get("idTipoConvenio") for c in atuais if isinstance(c, dict)}
+            convenios = [c for c in convenios if c not in ja_associados]
+    else:
+        criado = await cnn_service.criar_paciente(payload_cnn(paciente, id_origem))
+        id_paciente = criado.get("id") if isinstance(criado, dict) else None
+        if id_paciente is None:
+            return {**resultado, "status": "erro", "erro": "A CNN não retornou o ID do paciente criado"}
+        resultado["status"] = "criado"
+    resultado["id_paciente"] = id_paciente
+
+    if convenios:
+        respostas = await asyncio.gather(
+            *(cnn_service.associar_convenio(id_paciente, c) for c in convenios),
+            return_exceptions=True
+        )
+        resultado["convenios_associados"] = [c for c, r in zip(convenios, respostas) if not isinstance(r, Exception)]
+        falhas = {str(c): _erro(r) for c, r in zip(convenios, respostas) if isinstance(r, Exception)}
+        if falhas:
+            resultado["status"] = "parcial"
+            resultado["erro"] = falhas
+    return resultado
+
+
+def ler_checkpoint(caminho: Optional[str]) -> Set[int]:
+    """Linhas já concluídas numa execução anterior (erros e parciais são tentados de novo)."""
+    if not caminho or not os.path.exists(caminho):
+        return set()
+    status: Dict[int, str] = {}
+    with open(caminho, encoding="utf-8") as arquivo:
+        for texto in arquivo:
+            try:
+                registro = json.loads(texto)
+            except ValueError:
+                # Última linha cortada por uma interrupção
+                continue
+            # Vale o resultado da execução mais recente de cada linha
+            status[registro["linha"]] = registro.get("status")
+    return {linha for linha, s in status.items() if s not in STATUS_RETENTAVEIS}
+
+
+def _gravar_checkpoint(arquivo: TextIO, resultados: List[Dict]) -> None:
+    arquivo.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in resultados))
+    arquivo.flush()
+
+
+async def importar_pacientes(
+    cnn_service: CNNService,
+    linhas: AsyncIterator[Linha],
+    concorrencia: int = 8,
+    checkpoint: Optional[str] = None,
+    id_origem: Optional[int] = None
+) -> AsyncIterator[Dict]:
+    """
+    Importa os pacientes das ``linhas`` com até ``concorrencia`` em paralelo.
+
+    Gera um resultado por linha, na ordem em que terminam, e um ``{"resumo": ...}``
+    no fim. Cada resultado é gravado no ``checkpoint`` antes de ser entregue; ao
+    repetir a importação com o mesmo arquivo, as linhas já concluídas são
+    puladas. O checkpoint é lido e gravado fora do event loop, em lotes.
+    """
+    id_origem = id_origem or ID_ORIGEM_PADRAO
+    concluidas = await asyncio.to_thread(ler_checkpoint, checkpoint)
+    travas = TravasPorDocumento()
+    limite = asyncio.Semaphore(concorrencia)
+    resultados: asyncio.Queue = asyncio.Queue()
+    contagem: Counter = Counter()
+    inicio = time.monotonic()
+
+    async def processar(numero: int, dados: Optional[Dict], erro: Optional[str]) -> None:
+        try:
+            if dados is None:
+                resultado = {"linha": numero, "status": "invalido", "erro": erro}
+            else:
+                # Cada linha tem o seu prazo: a importação inteira pode levar horas
+                with prazo(settings.IMPORTACAO_PRAZO_LINHA):
+                    resultado = await importar_linha(cnn_service, numero, dados, id_origem, travas)
+        except Exception as e:
+            resultado = {"linha": numero, "status": "erro", "erro": _erro(e)}
+        finally:
+            limite.release()
+        await resultados.put(resultado)
+
+    async def produzir() -> None:
+        tarefas: Set[asyncio.Task] = set()
+        try:
+            async for numero, dados, erro in linhas:
+                if numero in concluidas:
+                    contagem["pulada"] += 1
+                    continue
+                # Lê a próxima linha só quando há vaga: memória constante
+                await limite.acquire()
+                tarefa = asyncio.create_task(processar(numero, dados, erro))
+                tarefas.add(tarefa)
+                tarefa.add_done_callback(tarefas.discard)
+            await asyncio.gather(*tarefas)
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+            await resultados.put(None)
+
+    produtor = asyncio.create_task(produzir())
+    arquivo = await asyncio.to_thread(open, checkpoint, "a", encoding="utf-8") if checkpoint else None
+    try:
+        terminou = False
+        while not terminou:
+            # Os resultados já prontos vão juntos para o checkpoint: uma escrita por lote
+            lote = [await resultados.get()]
+            while not resultados.empty():
+                lote.append(resultados.get_nowait())
+            if lote[-1] is None:
+                lote.pop()
+                terminou = True
+            if arquivo is not None and lote:
+                await asyncio.to_thread(_gravar_checkpoint, arquivo, lote)
+            for resultado in lote:
+                contagem[resultado["status"]] += 1
+                yield resultado
+        # Propaga erros de leitura do arquivo
+        await produtor
+    finally:
+        if not produtor.done():
+            produtor.cancel()
+            await asyncio.gather(produtor, return_exceptions=True)
+        if arquivo is not None:
+            await asyncio.to_thread(arquivo.close)
+
+    segundos = time.monotonic() - inicio
+    processadas = sum(n for status, n in contagem.items() if status != "pulada")
+    yield {
+        "resumo": {
+            **contagem,
+            "linhas": processadas,
+            "segundos": round(segundos, 3),
+            "linhas_por_segundo": round(processadas / segundos, 2) if segundos > 0 else None
+        }
+    }
@@ -1,17 +1,69 @@
+import re
+import time
 import httpx
 from typing import Dict, List, Optional
 from config import get_settings
+from services.http_clients import get_http_clients
+from services.resilience import chamar
 
 settings = get_settings()
 
+
+class _ToolsEmCache:
+    __slots__ = ("etag", "dados", "expira_em")
+
+    def __init__(self, etag: Optional[str], dados: Dict, expira_em: float):
+        self.etag = etag
+        self.dados = dados
+        self.expira_em = expira_em
+
+
+# Lista de tools por URL do MCP Server (compartilhada entre as instâncias do serviço)
+_tools_em_cache: Dict[str, _ToolsEmCache] = {}
+
+
+def _max_age(cache_control: str) -> float:
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0.0
+    encontrado = re.search(r"max-age=(\d+)", cache_control)
+    return float(encontrado.group(1)) if encontrado else 0.0
+
+
 class MCPService:
-    def __init__(self):
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         self.base_url = settings.MCP_SERVER_URL
+        # Chamadas ao MCP passam por LLM e podem demorar mais que as demais
+        self.client = client or get_http_clients().get(
+            self.base_url,
+            read_timeout=settings.MCP_READ_TIMEOUT
+        )
+        # Um circuit breaker por host do upstream
+        self.circuito = f"mcp:{httpx.URL(self.base_url).host}"
         self.headers = {
             "accept": "application/json",
             "Authorization": f"Bearer {settings.MCP_API_KEY}"
         }
     
+    async def _request(self, method: str, path: str, headers: Optional[Dict] = None, **kwargs) -> httpx.Response:
+        headers = {**self.headers, **headers} if headers else self.headers
+        return await chamar(
+            "mcp",
+            self.circuito,
+            self.client,
+            method,
+            lambda timeout: self._enviar(method, path, headers, timeout, **kwargs)
+        )
+    
+    async def _enviar(self, method: str, path: str, headers: Dict, timeout, **kwargs) -> httpx.Response:
+        # Uma tentativa: é a requisição HTTP medida pelas métricas de transporte
+        return await self.client.request(
+            method,
+            f"{self.base_url}{path}",
+            headers=headers,
+            timeout=timeout,
+            **kwargs
+        )
+    
     async def process_message(
         self,
         message: str,
@@ -24,21 +76,25 @@ class MCPService:
             "tools": tools or []
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/process",
-                json=payload,
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request("POST", "/process", json=payload)
+        return response.json()
     
     async def get_available_tools(self) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/tools",
-                headers=self.headers
-            )
-            return response.json()
+        # Dentro do max-age a lista em cache vale sem ir ao servidor; depois
+        # disso é revalidada pelo ETag (304 não traz corpo)
+        cache = _tools_em_cache.get(self.base_url)
+        agora = time.monotonic()
+        if cache is not None and agora < cache.expira_em:
+            return cache.dados
+        headers = {"If-None-Match": cache.etag} if cache is not None and cache.etag else None
+        response = await self._request("GET", "/tools", headers=headers)
+        expira_em = agora + _max_age(response.headers.get("cache-control", ""))
+        if response.status_code == 304 and cache is not None:
+            cache.expira_em = expira_em
+            return cache.dados
+        dados = response.json()
+        _tools_em_cache[self.base_url] = _ToolsEmCache(response.headers.get("etag"), dados, expira_em)
+        return dados
     
     async def execute_tool(
         self,
@@ -52,19 +108,9 @@ class MCPService:
             "context": context or {}
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/execute",
-                json=payload,
-                headers=self.headers
-            )
-            return response.json()
+        response = await self._request("POST", "/execute", json=payload)
+        return response.json()
     
     async def update_context(self, context: Dict) -> Dict:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/context",
-                json=context,
-                headers=self.headers
-            )
-            return response.json() 
\ No newline at end of file
+        response = await self._request("POST", "/context", json=context)
+        return response.json()
\ No newline at end of file
@@ -0,0 +1,372 @@
+import asyncio
+import functools
+import inspect
+import logging
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Clínica das chamadas feitas no contexto atual (rótulo das métricas de upstream)
+clinica_atual: ContextVar[str] = ContextVar("clinica_metricas", default="")
+# Operação pública do serviço em andamento, para rotular as respostas HTTP dela
+operacao_atual: ContextVar[str] = ContextVar("operacao_metricas", default="")
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_LAG = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+@contextmanager
+def metricas_da_clinica(cnpj: Optional[str]) -> Iterator[None]:
+    token = clinica_atual.set(cnpj or "")
+    try:
+        yield
+    finally:
+        clinica_atual.reset(token)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos(nomes: Sequence[str], valores: Sequence, extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor: float) -> str:
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class Contador:
+    __slots__ = ("nome", "ajuda", "rotulos", "_valores")
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores: Dict[Tuple, float] = {}
+
+    def inc(self, *valores, quantidade: float = 1.0) -> None:
+        self._valores[valores] = self._valores.get(valores, 0.0) + quantidade
+
+    def exportar(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        for valores, total in self._valores.items():
+            linhas.append(f"{self.nome}{_rotulos(self.rotulos, valores)} {_numero(total)}")
+        return linhas
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus (``_bucket``/``_sum``/``_count``)."""
+
+    __slots__ = ("nome", "ajuda", "rotulos", "buckets", "_series")
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = (), buckets: Sequence[float] = BUCKETS_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(sorted(buckets))
+        # rótulos -> [contagem por bucket..., soma, total]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, valor: float, *valores) -> None:
+        serie = self._series.get(valores)
+        if serie is None:
+            serie = self._series[valores] = [0] * len(self.buckets) + [0.0, 0]
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[i] += 1
+                break
+        serie[-2] += valor
+        serie[-1] += 1
+
+    def exportar(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for valores, serie in self._series.items():
+            acumulado = 0
+            for limite, quantidade in zip(self.buckets, serie):
+                acumulado += quantidade
+                rotulos = _rotulos(self.rotulos, valores, 'le="%s"' % _numero(limite))
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            rotulos = _rotulos(self.rotulos, valores, 'le="+Inf"')
+            linhas.append(f"{self.nome}_bucket{rotulos} {serie[-1]}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, valores)} {_numero(serie[-2])}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, valores)} {serie[-1]}")
+        return linhas
+
+
+def _gauge(nome: str, ajuda: str, rotulos: Sequence[str], amostras: List[Tuple[Tuple, float]]) -> List[str]:
+    linhas = [f"# HELP {nome} {ajuda}", f"# TYPE {nome} gauge"]
+    for valores, valor in amostras:
+        linhas.append(f"{nome}{_rotulos(rotulos, valores)} {_numero(valor)}")
+    return linhas
+
+
+class Metricas:
+    """
+    Métricas do processo no formato texto do Prometheus.
+
+    Contadores e histogramas são atualizados no caminho da requisição (só
+    operações em dicionário, sem lock: tudo roda no event loop). Pools, caches
+    e filas são lidos dos ``stats()`` existentes apenas quando ``/metrics`` é
+    consultado.
+    """
+
+    def __init__(self):
+        self.requisicoes = Histograma(
+            "http_request_duration_seconds", "Latência das rotas da API", ("method", "route", "status")
+        )
+        self.upstream = Histograma(
+            "upstream_operation_duration_seconds",
+            "Latência das operações dos serviços externos, como vistas pelo chamador (inclui caches e retentativas)",
+            ("upstream", "operation", "clinic")
+        )
+        self.upstream_resultados = Contador(
+            "upstream_operations_total", "Operações dos serviços externos por resultado",
+            ("upstream", "operation", "clinic", "result")
+        )
+        self.upstream_erros = Contador(
+            "upstream_errors_total", "Falhas das operações dos serviços externos por código",
+            ("upstream", "operation", "clinic", "code")
+        )
+        self.upstream_http = Histograma(
+            "upstream_http_duration_seconds", "Latência das requisições HTTP aos serviços externos",
+            ("upstream", "operation", "clinic")
+        )
+        self.upstream_status = Contador(
+            "upstream_http_responses_total", "Respostas HTTP dos serviços externos por status",
+            ("upstream", "operation", "clinic", "status")
+        )
+        self.fila_espera = Histograma(
+            "queue_wait_seconds", "Tempo entre o enfileiramento e o início do processamento", ("queue",)
+        )
+        self.fila_processamento = Histograma(
+            "queue_processing_seconds", "Tempo de processamento de cada item da fila", ("queue",)
+        )
+        self.lag = Histograma("event_loop_lag_seconds", "Atraso do event loop", buckets=BUCKETS_LAG)
+        self.lag_atual = 0.0
+        self._lag_task: Optional[asyncio.Task] = None
+
+    # Atraso do event loop
+
+    async def _medir_lag(self, intervalo: float) -> None:
+        while True:
+            inicio = time.monotonic()
+            await asyncio.sleep(intervalo)
+            self.lag_atual = max(0.0, time.monotonic() - inicio - intervalo)
+            self.lag.observe(self.lag_atual)
+
+    def start(self, intervalo: float = 0.5) -> None:
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._medir_lag(intervalo), name="metricas-lag")
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            await asyncio.gather(self._lag_task, return_exceptions=True)
+            self._lag_task = None
+
+    # Exportação
+
+    def _pools(self) -> List[str]:
+        from services.http_clients import get_http_clients
+        from services import supabase_service
+
+        conexoes: List[Tuple[Tuple, float]] = []
+        maximo: List[Tuple[Tuple, float]] = []
+        try:
+            registro = get_http_clients()
+        except Exception:
+            registro = None
+        for host, client in (registro.hosts() if registro is not None else {}).items():
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            lista = getattr(pool, "connections", None)
+            if lista is None:
+                continue
+            ociosas = sum(1 for c in lista if c.is_idle())
+            conexoes.append(((host, "active"), len(lista) - ociosas))
+            conexoes.append(((host, "idle"), ociosas))
+            maximo.append(((host,), getattr(pool, "_max_connections", 0) or 0))
+
+        linhas = _gauge("http_pool_connections", "Conexões abertas por pool HTTP", ("host", "state"), conexoes)
+        linhas += _gauge("http_pool_max_connections", "Limite de conexões por pool HTTP", ("host",), maximo)
+        semaforo = supabase_service._semaphore
+        if semaforo is not None:
+            total = get_settings().SUPABASE_MAX_WORKERS
+            linhas += _gauge(
+                "supabase_workers_busy", "Threads do Supabase em uso", (),
+                [((), max(0, total - semaforo._value))]
+            )
+            linhas += _gauge("supabase_workers_max", "Threads do Supabase disponíveis", (), [((), total)])
+        return linhas
+
+    @staticmethod
+    def _caches() -> List[str]:
+        from services.catalog_cache import get_catalog_cache
+        from services.clinica_cache import get_clinica_cache
+        from services.conversation_store import get_conversation_store
+        from services.disponibilidade_cache import get_disponibilidade_cache
+        from services.patient_index import get_patient_index
+        from services.single_flight import get_cnn_single_flight
+
+        fontes: Dict[str, Callable[[], Dict]] = {
+            "clinica": lambda: get_clinica_cache().stats(),
+            "catalogo": lambda: get_catalog_cache().stats(),
+            "disponibilidade": lambda: get_disponibilidade_cache().stats(),
+            "conversas": lambda: get_conversation_store().stats(),
+            "pacientes": lambda: get_patient_index().stats(),
+        }
+        razoes: List[Tuple[Tuple, float]] = []
+        eventos: List[Tuple[Tuple, float]] = []
+        for nome, fonte in fontes.items():
+            try:
+                stats = fonte()
+            except Exception:
+                continue
+            razoes.append(((nome,), stats.get("hit_ratio", 0.0)))
+            for chave, valor in stats.items():
+                if chave.endswith(("hits", "misses")) and isinstance(valor, (int, float)):
+                    eventos.append(((nome, chave), valor))
+        single_flight = get_cnn_single_flight().stats()
+        razoes.append((("single_flight",), single_flight["collapse_ratio"]))
+        linhas = _gauge("cache_hit_ratio", "Proporção de acertos por cache", ("cache",), razoes)
+        linhas += _gauge("cache_events", "Acertos e faltas acumulados por cache", ("cache", "event"), eventos)
+        return linhas
+
+    @staticmethod
+    def _filas() -> List[str]:
+        from services.outbound_dispatcher import get_outbound_dispatcher
+        from services.webhook_queue import get_webhook_queue
+
+        amostras: List[Tuple[Tuple, float]] = []
+        for nome, fila in (("webhook", get_webhook_queue()), ("whatsapp_envio", get_outbound_dispatcher())):
+            if fila is not None:
+                amostras.append(((nome,), fila.stats()["depth"]))
+        return _gauge("queue_depth", "Itens aguardando por fila", ("queue",), amostras)
+
+    def exportar(self) -> str:
+        linhas: List[str] = []
+        for metrica in (
+            self.requisicoes, self.upstream, self.upstream_resultados, self.upstream_erros,
+            self.upstream_http, self.upstream_status, self.fila_espera, self.fila_processamento, self.lag
+        ):
+            linhas += metrica.exportar()
+        linhas += _gauge("event_loop_lag_last_seconds", "Último atraso medido do event loop", (), [((), self.lag_atual)])
+        for secao in (self._pools, self._caches, self._filas):
+            try:
+                linhas += secao()
+            except Exception:
+                logger.exception("Falha ao coletar métricas (%s)", secao.__name__)
+        return "\n".join(linhas) + "\n"
+
+
+_metricas: Optional[Metricas] = None
+
+
+def get_metricas() -> Metricas:
+    global _metricas
+    if _metricas is None:
+        _metricas = Metricas()
+    return _metricas
+
+
+async def close_metricas() -> None:
+    if _metricas is not None:
+        await _metricas.stop()
+
+
+def _resultado(erro: BaseException) -> Tuple[str, str]:
+    # (resultado, código): status HTTP para erros de upstream/rota, nome da exceção nos demais
+    if isinstance(erro, HTTPException):
+        detail = erro.detail
+        codigo = detail.get("codigo") if isinstance(detail, dict) else None
+        return str(erro.status_code), codigo or str(erro.status_code)
+    if isinstance(erro, asyncio.CancelledError):
+        return "cancelled", "cancelled"
+    return "error", type(erro).__name__
+
+
+def _envolver_operacao(upstream: str, nome: str, funcao):
+    @functools.wraps(funcao)
+    async def operacao(self, *args, **kwargs):
+        metricas = get_metricas()
+        clinica = clinica_atual.get()
+        token = operacao_atual.set(nome)
+        inicio = time.perf_counter()
+        resultado = "ok"
+        try:
+            return await funcao(self, *args, **kwargs)
+        except BaseException as e:
+            resultado, codigo = _resultado(e)
+            metricas.upstream_erros.inc(upstream, nome, clinica, codigo)
+            raise
+        finally:
+            operacao_atual.reset(token)
+            metricas.upstream.observe(time.perf_counter() - inicio, upstream, nome, clinica)
+            metricas.upstream_resultados.inc(upstream, nome, clinica, resultado)
+    return operacao
+
+
+def _envolver_transporte(upstream: str, funcao):
+    @functools.wraps(funcao)
+    async def transporte(self, *args, **kwargs):
+        metricas = get_metricas()
+        rotulos = (upstream, operacao_atual.get() or funcao.__name__, clinica_atual.get())
+        inicio = time.perf_counter()
+        status = "error"
+        try:
+            resposta = await funcao(self, *args, **kwargs)
+            status = str(getattr(resposta, "status_code", "ok"))
+            return resposta
+        except BaseException as e:
+            detail = getattr(e, "detail", None)
+            upstream_status = detail.get("upstream_status") if isinstance(detail, dict) else None
+            status = str(upstream_status) if upstream_status else _resultado(e)[1]
+            raise
+        finally:
+            metricas.upstream_http.observe(time.perf_counter() - inicio, *rotulos)
+            metricas.upstream_status.inc(*rotulos, status)
+    return transporte
+
+
+def instrumentar(cls: type, upstream: str, transporte: Optional[str] = None) -> type:
+    """
+    Envolve os métodos assíncronos públicos de ``cls`` com métricas de latência
+    e resultado por operação e clínica; ``transporte`` é o método que faz uma
+    única requisição HTTP (``_enviar``, chamado a cada tentativa, depois do
+    single-flight e do limitador; ``_execute`` no Supabase), cujas respostas
+    são contadas por status e atribuídas à operação pública em andamento.
+    """
+    if cls.__dict__.get("_instrumentado"):
+        return cls
+    for nome, valor in list(cls.__dict__.items()):
+        if not inspect.iscoroutinefunction(valor):
+            continue
+        if nome == transporte:
+            setattr(cls, nome, _envolver_transporte(upstream, valor))
+        elif not nome.startswith("_"):
+            setattr(cls, nome, _envolver_operacao(upstream, nome, valor))
+    cls._instrumentado = True
+    return cls
+
+
+def instrumentar_servicos() -> None:
+    from services.cnn_api import CNNService
+    from services.evolution_service import EvolutionService
+    from services.mcp_service import MCPService
+    from services.supabase_service import SupabaseService
+
+    instrumentar(CNNService, "cnn", transporte="_enviar")
+    instrumentar(EvolutionService, "evolution", transporte="_enviar")
+    instrumentar(MCPService, "mcp", transporte="_enviar")
+    instrumentar(SupabaseService, "supabase", transporte="_execute")
@@ -0,0 +1,371 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from config import get_settings
+from services.erros import ErroUpstream
+from services.evolution_service import EvolutionService
+from services.rate_limiter import TokenBucket, prioridade_baixa
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Classes de prioridade: menor sai primeiro
+INTERATIVA = 0
+CONFIRMACAO = 1
+LEMBRETE = 2
+NOMES_PRIORIDADE = {INTERATIVA: "interativa", CONFIRMACAO: "confirmacao", LEMBRETE: "lembrete"}
+
+# Falhas em que a mensagem com certeza não foi aceita pela Evolution API (além
+# do 503). ``conexao_upstream``/``timeout_upstream`` ficam de fora: a requisição
+# pode ter sido entregue e um reenvio duplicaria a mensagem para o paciente
+CODIGOS_RETENTAVEIS = frozenset({"limite_upstream", "circuito_aberto", "conexao_recusada", "timeout_conexao"})
+
+# Status a partir dos quais a mensagem deixa de ser acompanhada
+STATUS_FINAIS = frozenset({"DELIVERY_ACK", "DELIVERED", "READ", "PLAYED", "ERROR", "FAILED"})
+
+
+class FilaCheia(Exception):
+    pass
+
+
+class _Envio:
+    __slots__ = (
+        "numero", "texto", "arquivo", "legenda", "prioridade",
+        "tentativas", "enfileirado_em", "resultado"
+    )
+
+    def __init__(self, numero, texto, arquivo, legenda, prioridade):
+        self.numero = numero
+        self.texto = texto
+        self.arquivo = arquivo
+        self.legenda = legenda
+        self.prioridade = prioridade
+        self.tentativas = 0
+        self.enfileirado_em = time.monotonic()
+        self.resultado: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _Acompanhamento:
+    __slots__ = ("status", "desde")
+
+    def __init__(self, status: Optional[str]):
+        self.status = status
+        self.desde = time.monotonic()
+
+
+def _id_mensagem(resposta) -> Optional[str]:
+    if not isinstance(resposta, dict):
+        return None
+    chave = resposta.get("key")
+    if isinstance(chave, dict) and chave.get("id"):
+        return str(chave["id"])
+    valor = resposta.get("id") or resposta.get("messageId")
+    return str(valor) if valor else None
+
+
+def _status(resposta) -> Optional[str]:
+    if not isinstance(resposta, dict):
+        return None
+    dados = resposta.get("data") if isinstance(resposta.get("data"), dict) else resposta
+    status = dados.get("status")
+    return str(status).upper() if status is not None else None
+
+
+class OutboundDispatcher:
+    """
+    Fila de envio de mensagens do WhatsApp pela Evolution API.
+
+    As mensagens de um mesmo número saem uma de cada vez e na ordem em que
+    foram enfileiradas; entre números diferentes sai primeiro a de maior
+    prioridade (resposta interativa > confirmação > lembrete). Um número com
+    uma mensagem interativa atrás de um lembrete herda a prioridade dela, para
+    que a resposta não fique presa atrás da campanha.
+
+    Os envios respeitam um limite global e um da instância da Evolution API
+    configurada (``EVOLUTION_API_URL``, que é quem envia todas as mensagens), e
+    falhas em que a mensagem não foi aceita são tentadas de novo com backoff. O status das
+    mensagens enviadas é consultado em lotes periódicos.
+    """
+
+    def __init__(self, evolution: Optional[EvolutionService] = None):
+        self.evolution = evolution or EvolutionService()
+        self.max_fila = settings.EVOLUTION_SEND_MAX_QUEUE
+        self._global = TokenBucket(settings.EVOLUTION_SEND_RATE, settings.EVOLUTION_SEND_BURST)
+        self._instancia = TokenBucket(settings.EVOLUTION_INSTANCE_RATE, settings.EVOLUTION_INSTANCE_BURST)
+        self._por_numero: Dict[str, Deque[_Envio]] = {}
+        # (prioridade, ordem, numero); entradas antigas de um número são descartadas ao sair
+        self._prontos: List[Tuple[int, int, str]] = []
+        self._agendado: Dict[str, int] = {}
+        self._ocupados: set = set()
+        self._ordem = itertools.count()
+        self._sinal = asyncio.Event()
+        self._acompanhando: Dict[str, _Acompanhamento] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._aberto = False
+        self._depth = 0
+        self._ativos = 0
+        self.enviadas: Counter = Counter()
+        self.falhas: Counter = Counter()
+        self.retentativas = 0
+        self.rejeitadas = 0
+        self.status: Counter = Counter()
+        self.espera_max: Counter = Counter()
+
+    async def start(self) -> None:
+        self._aberto = True
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"whatsapp-envio-{i}")
+            for i in range(settings.EVOLUTION_SEND_WORKERS)
+        ]
+        self._tasks.append(asyncio.create_task(self._acompanhar_status(), name="whatsapp-status"))
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        self._aberto = False
+        if self._depth or self._ativos:
+            try:
+                await asyncio.wait_for(self._drenada(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Envio do WhatsApp encerrado com %s mensagens pendentes", self._depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for fila in self._por_numero.values():
+            for envio in fila:
+                if not envio.resultado.done():
+                    envio.resultado.cancel()
+        self._por_numero.clear()
+
+    async def _drenada(self) -> None:
+        while self._depth or self._ativos:
+            await asyncio.sleep(0.05)
+
+    def enviar(
+        self,
+        numero: str,
+        texto: Optional[str] = None,
+        prioridade: int = INTERATIVA,
+        arquivo: Optional[str] = None,
+        legenda: Optional[str] = None
+    ) -> asyncio.Future:
+        """
+        Enfileira a mensagem e retorna um future com a resposta da Evolution API.
+
+        Acima de 90% da capacidade só respostas interativas são aceitas, para
+        que uma campanha não impeça o atendimento; com a fila cheia levanta
+        ``FilaCheia``.
+        """
+        limite = self.max_fila if prioridade == INTERATIVA else self.max_fila * 9 // 10
+        if not self._aberto or self._depth >= limite:
+            self.rejeitadas += 1
+            raise FilaCheia("Fila de envio do WhatsApp cheia")
+
+        envio = _Envio(numero, texto, arquivo, legenda, prioridade)
+        self._depth += 1
+        fila = self._por_numero.setdefault(numero, deque())
+        fila.append(envio)
+        if numero not in self._ocupados:
+            self._agendar(numero)
+        return envio.resultado
+
+    def _agendar(self, numero: str) -> None:
+        fila = self._por_numero.get(numero)
+        if not fila:
+            self._por_numero.pop(numero, None)
+            self._agendado.pop(numero, None)
+            return
+        prioridade = min(envio.prioridade for envio in fila)
+        atual = self._agendado.get(numero)
+        if atual is not None and atual <= prioridade:
+            return
+        self._agendado[numero] = prioridade
+        heapq.heappush(self._prontos, (prioridade, next(self._ordem), numero))
+        self._sinal.set()
+
+    def _proximo(self) -> Optional[_Envio]:
+        while self._prontos:
+            prioridade, _, numero = heapq.heappop(self._prontos)
+            if self._agendado.get(numero) != prioridade or numero in self._ocupados:
+                continue
+            del self._agendado[numero]
+            self._ocupados.add(numero)
+            envio = self._por_numero[numero].popleft()
+            self._depth -= 1
+            return envio
+        self._sinal.clear()
+        return None
+
+    @staticmethod
+    async def _token(bucket: TokenBucket) -> None:
+        while True:
+            espera = bucket.reservar()
+            if not espera:
+                return
+            await asyncio.sleep(espera)
+
+    async def _worker(self) -> None:
+        while True:
+            # Os tokens só são pedidos com uma mensagem em mãos: worker ocioso não gasta limite
+            envio = self._proximo()
+            while envio is None:
+                await self._sinal.wait()
+                envio = self._proximo()
+            self._ativos += 1
+            try:
+                try:
+                    await self._token(self._global)
+                    await self._token(self._instancia)
+                except asyncio.CancelledError:
+                    self._devolver(envio, 0.0)
+                    raise
+                nome = NOMES_PRIORIDADE.get(envio.prioridade, str(envio.prioridade))
+                self.espera_max[nome] = max(self.espera_max[nome], time.monotonic() - envio.enfileirado_em)
+                await self._enviar(envio)
+            finally:
+                self._ativos -= 1
+
+    async def _enviar(self, envio: _Envio) -> None:
+        nome = NOMES_PRIORIDADE.get(envio.prioridade, str(envio.prioridade))
+        envio.tentativas += 1
+        try:
+            if envio.arquivo:
+                resposta = await self.evolution.send_file(envio.numero, envio.arquivo, envio.legenda)
+            else:
+                resposta = await self.evolution.send_message(envio.numero, envio.texto)
+        except asyncio.CancelledError:
+            self._devolver(envio, 0.0)
+            raise
+        except Exception as e:
+            if self._retentar(envio, e):
+                return
+            self.falhas[nome] += 1
+            logger.warning("Falha ao enviar mensagem para %s: %s", envio.numero, e)
+            if not envio.resultado.done():
+                envio.resultado.set_exception(e)
+            self._liberar(envio.numero)
+            return
+
+        self.enviadas[nome] += 1
+        id_mensagem = _id_mensagem(resposta)
+        if id_mensagem:
+            self._acompanhando[id_mensagem] = _Acompanhamento(_status(resposta))
+        if not envio.resultado.done():
+            envio.resultado.set_result(resposta)
+        self._liberar(envio.numero)
+
+    def _retentar(self, envio: _Envio, erro: Exception) -> bool:
+        if not isinstance(erro, ErroUpstream) or envio.tentativas >= settings.EVOLUTION_SEND_MAX_ATTEMPTS:
+            return False
+        if erro.codigo not in CODIGOS_RETENTAVEIS and erro.upstream_status != 503:
+            return False
+        if erro.retry_after:
+            # A instância inteira espera o Retry-After, não só esta mensagem
+            self._instancia.pausar(erro.retry_after)
+        espera = erro.retry_after or random.uniform(0, min(
+            settings.RETRY_MAX_DELAY * 4, settings.RETRY_BASE_DELAY * 2 ** envio.tentativas
+        ))
+        self.retentativas += 1
+        self._devolver(envio, espera)
+        return True
+
+    def _devolver(self, envio: _Envio, espera: float) -> None:
+        # Volta para a frente da fila do número: as seguintes continuam atrás dela
+        self._por_numero.setdefault(envio.numero, deque()).appendleft(envio)
+        self._depth += 1
+        if espera > 0:
+            asyncio.get_running_loop().call_later(espera, self._liberar, envio.numero)
+        else:
+            self._liberar(envio.numero)
+
+    def _liberar(self, numero: str) -> None:
+        self._ocupados.discard(numero)
+        self._agendar(numero)
+
+    async def _acompanhar_status(self) -> None:
+        while True:
+            await asyncio.sleep(settings.EVOLUTION_STATUS_INTERVAL)
+            try:
+                await self._consultar_status()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Falha ao consultar status das mensagens do WhatsApp")
+
+    async def _consultar_status(self) -> None:
+        agora = time.monotonic()
+        for id_mensagem, item in list(self._acompanhando.items()):
+            if agora - item.desde > settings.EVOLUTION_STATUS_TTL:
+                self.status["EXPIRADO"] += 1
+                del self._acompanhando[id_mensagem]
+        # Não há consulta em lote na Evolution API: cada rodada consulta um
+        # lote com concorrência limitada, em vez de um polling por mensagem
+        lote = list(itertools.islice(self._acompanhando, settings.EVOLUTION_STATUS_BATCH))
+        if not lote:
+            return
+        limite = asyncio.Semaphore(settings.EVOLUTION_STATUS_CONCURRENCY)
+
+        async def consultar(id_mensagem: str):
+            async with limite:
+                return await self.evolution.get_message_status(id_mensagem)
+
+        with prioridade_baixa():
+            respostas = await asyncio.gather(*(consultar(i) for i in lote), return_exceptions=True)
+        for id_mensagem, resposta in zip(lote, respostas):
+            item = self._acompanhando.pop(id_mensagem, None)
+            if item is None or isinstance(resposta, Exception):
+                if item is not None:
+                    self._acompanhando[id_mensagem] = item
+                continue
+            status = _status(resposta)
+            item.status = status or item.status
+            if status in STATUS_FINAIS:
+                self.status[status] += 1
+            else:
+                # Reinsere no fim: a próxima rodada começa pelas ainda não consultadas
+                self._acompanhando[id_mensagem] = item
+
+    def stats(self) -> Dict:
+        pendentes: Counter = Counter()
+        for fila in self._por_numero.values():
+            for envio in fila:
+                pendentes[NOMES_PRIORIDADE.get(envio.prioridade, str(envio.prioridade))] += 1
+        return {
+            "depth": self._depth,
+            "max_depth": self.max_fila,
+            "active": self._ativos,
+            "numbers": len(self._por_numero),
+            "pending": dict(pendentes),
+            "sent": dict(self.enviadas),
+            "failed": dict(self.falhas),
+            "retried": self.retentativas,
+            "rejected": self.rejeitadas,
+            "max_wait_seconds": dict(self.espera_max),
+            "tracking": len(self._acompanhando),
+            "status": dict(self.status)
+        }
+
+
+_dispatcher: Optional[OutboundDispatcher] = None
+
+
+async def init_outbound_dispatcher() -> OutboundDispatcher:
+    global _dispatcher
+    _dispatcher = OutboundDispatcher()
+    await _dispatcher.start()
+    return _dispatcher
+
+
+def get_outbound_dispatcher() -> Optional[OutboundDispatcher]:
+    return _dispatcher
+
+
+async def close_outbound_dispatcher(drain_timeout: float = 10.0) -> None:
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop(drain_timeout)
+        _dispatcher = None
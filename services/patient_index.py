@@ -0,0 +1,434 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from config import get_settings
+from models import RegistroPaciente
+from services.catalog_cache import normalizar
+from services.rate_limiter import prioridade_baixa
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+def normalizar_documento(documento: Optional[str]) -> Optional[str]:
+    digitos = re.sub(r"\D", "", str(documento or ""))
+    return digitos or None
+
+
+def variantes_telefone(numero: Optional[str]) -> Set[str]:
+    """
+    Formas E.164 de um número brasileiro: com e sem o nono dígito do celular.
+
+    Aceita máscaras ("(47) 99999-9999"), DDI opcional e o sufixo do WhatsApp
+    ("554799999999@s.whatsapp.net").
+    """
+    digitos = re.sub(r"\D", "", str(numero or "").split("@")[0])
+    if len(digitos) in (10, 11):
+        digitos = "55" + digitos
+    if not digitos.startswith("55") or len(digitos) not in (12, 13):
+        return {f"+{digitos}"} if len(digitos) >= 8 else set()
+    ddd, assinante = digitos[2:4], digitos[4:]
+    variantes = {f"+55{ddd}{assinante}"}
+    if len(assinante) == 9 and assinante[0] == "9":
+        variantes.add(f"+55{ddd}{assinante[1:]}")
+    elif len(assinante) == 8 and assinante[0] in "6789":
+        variantes.add(f"+55{ddd}9{assinante}")
+    return variantes
+
+
+def trigramas(texto: str) -> Set[str]:
+    preenchido = f"  {texto} "
+    return {preenchido[i:i + 3] for i in range(len(preenchido) - 2)}
+
+
+class _Registro:
+    __slots__ = ("paciente", "atualizado_em", "documento", "telefones", "nome")
+
+    def __init__(self, paciente: RegistroPaciente, atualizado_em: float):
+        # O paciente fica como registro compacto; o dict da CNN é remontado na leitura
+        self.paciente = paciente
+        self.atualizado_em = atualizado_em
+        self.documento = normalizar_documento(paciente.documento)
+        variantes: Set[str] = set()
+        for numero in paciente.telefones:
+            variantes |= variantes_telefone(numero)
+        self.telefones = tuple(variantes)
+        self.nome = normalizar(paciente.nome)
+
+
+class _IndiceClinica:
+    """Índices em memória dos pacientes de uma clínica."""
+
+    def __init__(self):
+        self.registros: Dict[Any, _Registro] = {}
+        self.por_documento: Dict[str, Any] = {}
+        self.por_telefone: Dict[str, Set[Any]] = {}
+        self.por_trigrama: Dict[str, Set[Any]] = {}
+
+    def remover(self, id_paciente: Any) -> None:
+        registro = self.registros.pop(id_paciente, None)
+        if registro is None:
+            return
+        if registro.documento and self.por_documento.get(registro.documento) == id_paciente:
+            del self.por_documento[registro.documento]
+        for telefone in registro.telefones:
+            ids = self.por_telefone.get(telefone)
+            if ids is not None:
+                ids.discard(id_paciente)
+                if not ids:
+                    del self.por_telefone[telefone]
+        for tri in trigramas(registro.nome):
+            ids = self.por_trigrama.get(tri)
+            if ids is not None:
+                ids.discard(id_paciente)
+                if not ids:
+                    del self.por_trigrama[tri]
+
+    def excedentes(self, maximo: int) -> List[Any]:
+        # Os registros ficam na ordem de atualização: saem os atualizados há mais tempo
+        ids = list(islice(self.registros, max(0, len(self.registros) - maximo)))
+        for id_paciente in ids:
+            self.remover(id_paciente)
+        return ids
+
+    def vencidos(self, limite: float) -> List[Any]:
+        ids = [i for i, registro in self.registros.items() if registro.atualizado_em <= limite]
+        for id_paciente in ids:
+            self.remover(id_paciente)
+        return ids
+
+    def adicionar(self, id_paciente: Any, registro: _Registro) -> None:
+        self.remover(id_paciente)
+        self.registros[id_paciente] = registro
+        if registro.documento:
+            self.por_documento[registro.documento] = id_paciente
+        for telefone in registro.telefones:
+            self.por_telefone.setdefault(telefone, set()).add(id_paciente)
+        for tri in trigramas(registro.nome):
+            self.por_trigrama.setdefault(tri, set()).add(id_paciente)
+
+
+class SQLitePatientBackend:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pacientes ("
+            " cid TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " dados TEXT NOT NULL,"
+            " atualizado_em REAL NOT NULL,"
+            " PRIMARY KEY (cid, id))"
+        )
+
+    def _carregar(self, cid: str, desde: float) -> List[Tuple[Dict, float]]:
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT dados, atualizado_em FROM pacientes WHERE cid = ? AND atualizado_em > ? ORDER BY atualizado_em",
+                (cid, desde)
+            ).fetchall()
+        return [(json.loads(dados), atualizado_em) for dados, atualizado_em in linhas]
+
+    def _gravar(self, cid: str, pacientes: List[Tuple[Dict, float]], removidos: List[Any]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO pacientes (cid, id, dados, atualizado_em) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(cid, id) DO UPDATE SET dados = excluded.dados, atualizado_em = excluded.atualizado_em",
+                    [(cid, str(p["id"]), json.dumps(p, separators=(",", ":"), ensure_ascii=False), t) for p, t in pacientes]
+                )
+                self._conn.executemany(
+                    "DELETE FROM pacientes WHERE cid = ? AND id = ?",
+                    [(cid, str(id_paciente)) for id_paciente in removidos]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _podar(self, antes_de: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM pacientes WHERE atualizado_em <= ?", (antes_de,))
+
+    async def carregar(self, cid: str, desde: float) -> List[Tuple[Dict, float]]:
+        return await asyncio.to_thread(self._carregar, cid, desde)
+
+    async def gravar(self, cid: str, pacientes: List[Tuple[Dict, float]], removidos: List[Any]) -> None:
+        await asyncio.to_thread(self._gravar, cid, pacientes, removidos)
+
+    async def podar(self, antes_de: float) -> None:
+        await asyncio.to_thread(self._podar, antes_de)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PatientIndex:
+    """
+    Índice local de pacientes por clínica: CPF/CNPJ, telefone (E.164, com e
+    sem nono dígito) e trigramas do nome sem acentos.
+
+    É alimentado pelas respostas da CNN. Entradas com menos de ``ttl`` segundos
+    são servidas direto; mais antigas (até ``max_age``) são servidas e
+    revalidadas em background. O SQLite guarda o índice entre reinícios.
+
+    Como o índice guarda dados pessoais, nada fica além de ``max_age``: uma
+    poda de hora em hora remove da memória e do SQLite o que venceu. Cada
+    clínica guarda no máximo ``max_por_clinica`` pacientes; acima disso saem
+    os atualizados há mais tempo.
+    """
+
+    INTERVALO_PODA = 3600.0
+
+    def __init__(
+        self,
+        backend=None,
+        ttl: float = 3600.0,
+        max_age: float = 2592000.0,
+        max_por_clinica: int = 50000
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_por_clinica = max_por_clinica
+        self._clinicas: Dict[str, _IndiceClinica] = {}
+        self._cargas = SingleFlight()
+        self._revalidacoes: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._poda: Optional[asyncio.Task] = None
+        self._ultima_poda = 0.0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    async def _indice(self, cid: str) -> _IndiceClinica:
+        self._agendar_poda()
+        indice = self._clinicas.get(cid)
+        if indice is not None:
+            return indice
+        if self.backend is None:
+            indice = self._clinicas[cid] = _IndiceClinica()
+            return indice
+
+        # Primeira consulta da clínica no processo: carrega o que está no SQLite
+        return await self._cargas.do(cid, lambda: self._carregar(cid))
+
+    async def _carregar(self, cid: str) -> _IndiceClinica:
+        indice = _IndiceClinica()
+        try:
+            invalidos = 0
+            for paciente, atualizado_em in await self.backend.carregar(cid, time.time() - self.max_age):
+                try:
+                    registro = RegistroPaciente.from_cnn(paciente)
+                except ValueError:
+                    invalidos += 1
+                    continue
+                indice.adicionar(registro.id, _Registro(registro, atualizado_em))
+            if invalidos:
+                # Buscas por esses pacientes vão à CNN, que os grava de novo
+                logger.warning("%s pacientes fora do formato esperado ignorados no SQLite da clínica %s", invalidos, cid)
+        except Exception:
+            logger.exception("Falha ao carregar o índice de pacientes da clínica %s", cid)
+        self._clinicas[cid] = indice
+        # O limite pode ter sido reduzido desde a gravação
+        await self._limitar(cid, indice)
+        return indice
+
+    def _validos(self, indice: _IndiceClinica, ids: Iterable[Any]) -> Tuple[List[Dict], bool]:
+        agora = time.time()
+        pacientes, vencido = [], False
+        for id_paciente in ids:
+            registro = indice.registros.get(id_paciente)
+            if registro is None or agora - registro.atualizado_em > self.max_age:
+                continue
+            vencido = vencido or agora - registro.atualizado_em > self.ttl
+            pacientes.append(registro.paciente.para_cnn())
+        return pacientes, vencido
+
+    def _contar(self, pacientes: List[Dict], vencido: bool) -> None:
+        if not pacientes:
+            self.misses += 1
+        elif vencido:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+
+    async def buscar_documento(self, cid: str, documento: str) -> Tuple[List[Dict], bool]:
+        """Retorna ``(pacientes, vencido)``; lista vazia quando o índice não conhece o documento."""
+        indice = await self._indice(cid)
+        id_paciente = indice.por_documento.get(normalizar_documento(documento) or "")
+        pacientes, vencido = self._validos(indice, [id_paciente] if id_paciente is not None else [])
+        self._contar(pacientes, vencido)
+        return pacientes, vencido
+
+    async def buscar_telefone(self, cid: str, telefone: str) -> Tuple[List[Dict], bool]:
+        indice = await self._indice(cid)
+        ids: Set[Any] = set()
+        for variante in variantes_telefone(telefone):
+            ids |= indice.por_telefone.get(variante, set())
+        pacientes, vencido = self._validos(indice, sorted(ids, key=str))
+        self._contar(pacientes, vencido)
+        return pacientes, vencido
+
+    async def buscar_nome(self, cid: str, nome: str, limite: int = 50) -> List[Dict]:
+        indice = await self._indice(cid)
+        termo = normalizar(nome)
+        if not termo:
+            return []
+        if len(termo) < 3:
+            candidatos: Iterable[Any] = indice.registros
+        else:
+            # Interseção dos trigramas do termo, começando pelo conjunto menor.
+            # O termo pode estar no meio do nome: usa só os trigramas internos, sem preenchimento
+            internos = {termo[i:i + 3] for i in range(len(termo) - 2)}
+            conjuntos = sorted((indice.por_trigrama.get(t, set()) for t in internos), key=len)
+            candidatos = set(conjuntos[0]).intersection(*conjuntos[1:]) if conjuntos else set()
+        encontrados = [
+            registro for registro in (indice.registros[i] for i in candidatos)
+            if termo in registro.nome
+        ]
+        encontrados.sort(key=lambda r: r.nome)
+        pacientes, _ = self._validos(indice, [r.paciente.id for r in encontrados[:limite]])
+        return pacientes
+
+    async def registrar(self, cid: str, pacientes: Iterable[Any]) -> None:
+        """
+        Adiciona ou atualiza pacientes vindos de uma resposta da CNN.
+
+        Com algum item fora do formato esperado a resposta inteira fica fora do
+        índice: indexar só parte dela faria uma busca por telefone devolver
+        parte dos pacientes sem ir à CNN.
+        """
+        registros = []
+        for paciente in pacientes:
+            try:
+                if not isinstance(paciente, dict):
+                    raise ValueError(f"paciente inválido: {paciente!r}")
+                registros.append((RegistroPaciente.from_cnn(paciente), paciente))
+            except ValueError as e:
+                logger.warning("Resposta da CNN não indexada (clínica %s): %s", cid, e)
+                return
+        indice = await self._indice(cid)
+        agora = time.time()
+        gravar = []
+        for registro, paciente in registros:
+            indice.adicionar(registro.id, _Registro(registro, agora))
+            gravar.append((paciente, agora))
+        await self._persistir(cid, gravar, [])
+        await self._limitar(cid, indice)
+
+    async def _limitar(self, cid: str, indice: _IndiceClinica) -> None:
+        removidos = indice.excedentes(self.max_por_clinica)
+        if removidos:
+            self.evictions += len(removidos)
+            await self._persistir(cid, [], removidos)
+
+    def _agendar_poda(self) -> None:
+        agora = time.time()
+        if agora - self._ultima_poda < self.INTERVALO_PODA or (self._poda is not None and not self._poda.done()):
+            return
+        self._ultima_poda = agora
+        self._poda = asyncio.create_task(self.podar())
+
+    async def podar(self) -> None:
+        """Remove da memória e do SQLite os pacientes atualizados há mais de ``max_age``."""
+        limite = time.time() - self.max_age
+        for indice in self._clinicas.values():
+            self.evictions += len(indice.vencidos(limite))
+        if self.backend is None:
+            return
+        try:
+            await self.backend.podar(limite)
+        except Exception:
+            logger.exception("Falha ao podar o índice de pacientes")
+
+    async def remover_documento(self, cid: str, documento: str) -> None:
+        # A CNN não conhece mais o documento (ex.: cadastro excluído)
+        indice = await self._indice(cid)
+        id_paciente = indice.por_documento.get(normalizar_documento(documento) or "")
+        if id_paciente is not None:
+            indice.remover(id_paciente)
+            await self._persistir(cid, [], [id_paciente])
+
+    async def _persistir(self, cid: str, pacientes: List[Tuple[Dict, float]], removidos: List[Any]) -> None:
+        if self.backend is None or not (pacientes or removidos):
+            return
+        try:
+            await self.backend.gravar(cid, pacientes, removidos)
+        except Exception:
+            # O índice em memória continua válido; o SQLite é só para reinícios
+            logger.exception("Falha ao gravar o índice de pacientes da clínica %s", cid)
+
+    def revalidar(self, cid: str, chave: str, carregar: Callable[[], Awaitable[Any]]) -> None:
+        """Agenda (uma vez por chave) a revalidação em background de uma entrada vencida."""
+        if (cid, chave) in self._revalidacoes:
+            return
+        self.revalidations += 1
+
+        async def executar():
+            try:
+                with prioridade_baixa():
+                    await carregar()
+            except Exception as e:
+                logger.warning("Falha ao revalidar paciente %s: %s", chave, e)
+
+        tarefa = asyncio.create_task(executar())
+        self._revalidacoes[(cid, chave)] = tarefa
+        tarefa.add_done_callback(lambda _: self._revalidacoes.pop((cid, chave), None))
+
+    async def close(self) -> None:
+        tarefas = list(self._revalidacoes.values())
+        if self._poda is not None:
+            tarefas.append(self._poda)
+        for tarefa in tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*tarefas, return_exceptions=True)
+        if self.backend is not None:
+            await self.backend.close()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "clinics": len(self._clinicas),
+            "patients": sum(len(i.registros) for i in self._clinicas.values()),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.stale_hits) / total if total else 0.0,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions
+        }
+
+
+_index: Optional[PatientIndex] = None
+
+
+def get_patient_index() -> PatientIndex:
+    global _index
+    if _index is None:
+        backend = SQLitePatientBackend(settings.PACIENTE_INDEX_SQLITE_PATH) if settings.PACIENTE_INDEX_SQLITE_PATH else None
+        _index = PatientIndex(
+            backend,
+            ttl=settings.PACIENTE_INDEX_TTL,
+            max_age=settings.PACIENTE_INDEX_MAX_AGE,
+            max_por_clinica=settings.PACIENTE_INDEX_MAX_POR_CLINICA
+        )
+    return _index
+
+
+async def close_patient_index() -> None:
+    global _index
+    if _index is not None:
+        await _index.close()
+        _index = None
@@ -0,0 +1,245 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, Optional
+from config import get_settings
+
+settings = get_settings()
+
+INTERATIVA = "interativa"
+BACKGROUND = "background"
+
+# Prioridade das chamadas feitas no contexto atual (atendimento vs. tarefas de fundo)
+prioridade_atual: ContextVar[str] = ContextVar("prioridade_upstream", default=INTERATIVA)
+
+
+@contextmanager
+def prioridade_baixa() -> Iterator[None]:
+    """Marca as chamadas ao upstream feitas dentro do bloco como background."""
+    token = prioridade_atual.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        prioridade_atual.reset(token)
+
+
+class LimiteExcedido(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Limite de requisições da clínica excedido")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("taxa", "capacidade", "tokens", "atualizado_em", "pausado_ate")
+
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.atualizado_em = time.monotonic()
+        self.pausado_ate = 0.0
+
+    def _repor(self, agora: float) -> None:
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado_em) * self.taxa)
+        self.atualizado_em = agora
+
+    def reservar(self) -> float:
+        """Consome um token e retorna 0, ou retorna quantos segundos faltam para o próximo."""
+        agora = time.monotonic()
+        if agora < self.pausado_ate:
+            return self.pausado_ate - agora
+        self._repor(agora)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.taxa
+
+    def pausar(self, segundos: float) -> None:
+        # O upstream pediu para esperar (Retry-After): ninguém sai antes disso
+        self.pausado_ate = max(self.pausado_ate, time.monotonic() + segundos)
+        self.tokens = 0.0
+
+
+class _Espera:
+    __slots__ = ("evento",)
+
+    def __init__(self):
+        self.evento = asyncio.Event()
+
+
+class LimitadorClinica:
+    """
+    Token bucket + limite de concorrência adaptativo (AIMD) de uma clínica.
+
+    O limite cresce 1 por "janela" de respostas saudáveis e cai pela metade em
+    429/5xx/timeouts ou quando a latência passa de ``tolerancia_latencia`` vezes
+    a menor latência observada. Chamadas interativas sempre passam à frente das
+    de background, e estas só usam uma fração do limite.
+    """
+
+    def __init__(
+        self,
+        taxa: float,
+        rajada: float,
+        limite_inicial: float,
+        limite_min: float,
+        limite_max: float,
+        tolerancia_latencia: float,
+        fracao_background: float,
+        timeout_fila: float
+    ):
+        self.bucket = TokenBucket(taxa, rajada)
+        self.limite = float(limite_inicial)
+        self.limite_min = float(limite_min)
+        self.limite_max = float(limite_max)
+        self.tolerancia_latencia = tolerancia_latencia
+        self.fracao_background = fracao_background
+        self.timeout_fila = timeout_fila
+        self.em_uso = 0
+        self._filas: Dict[str, Deque[_Espera]] = {INTERATIVA: deque(), BACKGROUND: deque()}
+        self._latencia_min: Optional[float] = None
+        self._latencia_media: Optional[float] = None
+        self._ultima_reducao = 0.0
+        self.rejeicoes = 0
+        self.throttled = 0
+        self.falhas = 0
+        self.reducoes = 0
+
+    def _capacidade(self, prioridade: str) -> int:
+        limite = max(1, int(self.limite))
+        if prioridade == BACKGROUND:
+            return max(1, int(limite * self.fracao_background))
+        return limite
+
+    def _na_vez(self, espera: _Espera, prioridade: str) -> bool:
+        if prioridade == BACKGROUND and self._filas[INTERATIVA]:
+            return False
+        fila = self._filas[prioridade]
+        return bool(fila) and fila[0] is espera
+
+    def _acordar(self) -> None:
+        for prioridade in (INTERATIVA, BACKGROUND):
+            fila = self._filas[prioridade]
+            if fila:
+                fila[0].evento.set()
+                return
+
+    async def acquire(self, prioridade: Optional[str] = None, timeout: Optional[float] = None) -> None:
+        prioridade = prioridade or prioridade_atual.get()
+        loop = asyncio.get_running_loop()
+        prazo = loop.time() + (self.timeout_fila if timeout is None else min(timeout, self.timeout_fila))
+        espera = _Espera()
+        fila = self._filas[prioridade]
+        fila.append(espera)
+        try:
+            while True:
+                restante = prazo - loop.time()
+                if restante <= 0:
+                    self.rejeicoes += 1
+                    raise LimiteExcedido(retry_after=max(1.0, self.bucket.pausado_ate - time.monotonic()))
+                if self._na_vez(espera, prioridade) and self.em_uso < self._capacidade(prioridade):
+                    falta = self.bucket.reservar()
+                    if falta <= 0:
+                        self.em_uso += 1
+                        return
+                    await asyncio.sleep(min(falta, restante))
+                    continue
+                espera.evento.clear()
+                try:
+                    await asyncio.wait_for(espera.evento.wait(), restante)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            fila.remove(espera)
+            # Quem estava atrás pode ter vaga agora (ou esta espera desistiu)
+            self._acordar()
+
+    def release(self) -> None:
+        self.em_uso -= 1
+        self._acordar()
+
+    def _reduzir(self) -> None:
+        # Uma redução por intervalo de latência: várias falhas da mesma rajada contam uma vez
+        agora = time.monotonic()
+        if agora - self._ultima_reducao < (self._latencia_media or 0.1):
+            return
+        self._ultima_reducao = agora
+        self.limite = max(self.limite_min, self.limite / 2)
+        self.reducoes += 1
+
+    def registrar(self, status_code: Optional[int], latencia: float, retry_after: Optional[float] = None) -> None:
+        """Ajusta o limite com o resultado de uma chamada (status ``None`` = erro de rede/timeout)."""
+        if status_code == 429:
+            self.throttled += 1
+            self.bucket.pausar(retry_after if retry_after is not None else 1.0)
+            self._reduzir()
+            return
+        if status_code is None or status_code >= 500:
+            self.falhas += 1
+            self._reduzir()
+            return
+
+        self._latencia_min = latencia if self._latencia_min is None else min(self._latencia_min, latencia)
+        self._latencia_media = latencia if self._latencia_media is None else 0.8 * self._latencia_media + 0.2 * latencia
+        if self._latencia_media > self._latencia_min * self.tolerancia_latencia:
+            self._reduzir()
+            # Nova referência: evita cortar para sempre após uma mudança permanente de latência
+            self._latencia_min = min(self._latencia_media, self._latencia_min * 1.5)
+        elif self.em_uso >= int(self.limite) or self._filas[INTERATIVA] or self._filas[BACKGROUND]:
+            # Só cresce quando o limite atual está sendo usado de fato
+            aumentou = int(self.limite + 1 / self.limite) > int(self.limite)
+            self.limite = min(self.limite_max, self.limite + 1 / self.limite)
+            if aumentou:
+                self._acordar()
+
+    def stats(self) -> Dict:
+        return {
+            "limit": round(self.limite, 2),
+            "in_flight": self.em_uso,
+            "queued_interactive": len(self._filas[INTERATIVA]),
+            "queued_background": len(self._filas[BACKGROUND]),
+            "rejections": self.rejeicoes,
+            "throttled": self.throttled,
+            "failures": self.falhas,
+            "decreases": self.reducoes,
+            "tokens": round(self.bucket.tokens, 2),
+            "latency_avg": self._latencia_media,
+            "latency_min": self._latencia_min
+        }
+
+
+class LimitadoresCNN:
+    """Um limitador por ``clinicaNasNuvens-cid``, criado sob demanda."""
+
+    def __init__(self):
+        self._limitadores: Dict[str, LimitadorClinica] = {}
+
+    def get(self, cid: str) -> LimitadorClinica:
+        limitador = self._limitadores.get(cid)
+        if limitador is None:
+            limitador = self._limitadores[cid] = LimitadorClinica(
+                taxa=settings.CNN_RATE_LIMIT_RPS,
+                rajada=settings.CNN_RATE_LIMIT_BURST,
+                limite_inicial=settings.CNN_CONCURRENCY_INITIAL,
+                limite_min=settings.CNN_CONCURRENCY_MIN,
+                limite_max=settings.CNN_CONCURRENCY_MAX,
+                tolerancia_latencia=settings.CNN_LATENCY_TOLERANCE,
+                fracao_background=settings.CNN_BACKGROUND_SHARE,
+                timeout_fila=settings.CNN_LIMITER_QUEUE_TIMEOUT
+            )
+        return limitador
+
+    def stats(self) -> Dict:
+        return {cid: limitador.stats() for cid, limitador in self._limitadores.items()}
+
+
+_limitadores: Optional[LimitadoresCNN] = None
+
+
+def get_cnn_limiters() -> LimitadoresCNN:
+    global _limitadores
+    if _limitadores is None:
+        _limitadores = LimitadoresCNN()
+    return _limitadores
@@ -0,0 +1,442 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+from config import get_settings
+from services.agendamentos_paginados import FiltroAgendamentos, iterar_agendamentos
+from services.clinica_cache import ClinicaResolvida
+from services.outbound_dispatcher import LEMBRETE, FilaCheia, get_outbound_dispatcher
+from services.metrics import metricas_da_clinica
+from services.rate_limiter import prioridade_baixa
+from services.supabase_service import SupabaseService
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+MENSAGEM_LEMBRETE = (
+    "Olá! Lembramos que sua consulta está marcada para {data} às {hora}. "
+    "Se precisar remarcar, responda esta mensagem."
+)
+
+# (cnpj, id do agendamento, tipo do lembrete, início do agendamento)
+ChaveLembrete = Tuple[str, int, str, str]
+
+
+def _numero_whatsapp(telefone: Optional[str]) -> Optional[str]:
+    digitos = re.sub(r"\D", "", str(telefone or ""))
+    if len(digitos) in (10, 11):
+        digitos = "55" + digitos
+    return digitos if len(digitos) >= 12 else None
+
+
+def _antecedencias() -> List[Tuple[str, timedelta]]:
+    # "24,2" -> [("24h", 24h), ("2h", 2h)], da maior para a menor
+    horas = sorted({float(h) for h in settings.LEMBRETES_ANTECEDENCIAS.split(",") if h.strip()}, reverse=True)
+    return [(f"{h:g}h", timedelta(hours=h)) for h in horas]
+
+
+def _dias(inicio: date, fim: date) -> Iterable[date]:
+    dia = inicio
+    while dia <= fim:
+        yield dia
+        dia += timedelta(days=1)
+
+
+class _Agendamento:
+    __slots__ = ("id", "inicio", "numero")
+
+    def __init__(self, id: int, inicio: datetime, numero: str):
+        self.id = id
+        self.inicio = inicio
+        self.numero = numero
+
+    @classmethod
+    def da_cnn(cls, item: Dict) -> Optional["_Agendamento"]:
+        try:
+            inicio = datetime.fromisoformat(f"{str(item['data'])[:10]}T{str(item['horaInicio'])[:8]}")
+            id_agenda = int(item["id"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        numero = _numero_whatsapp(item.get("telefoneCelularPaciente"))
+        return cls(id_agenda, inicio, numero) if numero else None
+
+
+class SQLiteReminderBackend:
+    """Dias já sincronizados (o horizonte de cada clínica) e lembretes enviados."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lembretes_dias ("
+            " cnpj TEXT NOT NULL,"
+            " dia TEXT NOT NULL,"
+            " sincronizado_em REAL NOT NULL,"
+            " agendamentos TEXT NOT NULL,"
+            " PRIMARY KEY (cnpj, dia))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lembretes_enviados ("
+            " cnpj TEXT NOT NULL,"
+            " id INTEGER NOT NULL,"
+            " tipo TEXT NOT NULL,"
+            " inicio TEXT NOT NULL,"
+            " enviado_em REAL NOT NULL,"
+            " PRIMARY KEY (cnpj, id, tipo, inicio))"
+        )
+
+    def _carregar(self, desde: date):
+        with self._lock:
+            dias = self._conn.execute(
+                "SELECT cnpj, dia, sincronizado_em, agendamentos FROM lembretes_dias WHERE dia >= ?",
+                (desde.isoformat(),)
+            ).fetchall()
+            enviados = self._conn.execute(
+                "SELECT cnpj, id, tipo, inicio FROM lembretes_enviados WHERE inicio >= ?",
+                (desde.isoformat(),)
+            ).fetchall()
+        return (
+            [(cnpj, date.fromisoformat(dia), sincronizado_em, json.loads(dados)) for cnpj, dia, sincronizado_em, dados in dias],
+            [tuple(linha) for linha in enviados]
+        )
+
+    def _gravar_dias(self, cnpj: str, dias: List[Tuple[date, float, List]]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO lembretes_dias (cnpj, dia, sincronizado_em, agendamentos) VALUES (?, ?, ?, ?)",
+                [(cnpj, dia.isoformat(), t, json.dumps(itens, separators=(",", ":"))) for dia, t, itens in dias]
+            )
+
+    def _gravar_enviado(self, chave: ChaveLembrete) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO lembretes_enviados (cnpj, id, tipo, inicio, enviado_em) VALUES (?, ?, ?, ?, ?)",
+                (*chave, time.time())
+            )
+
+    def _podar(self, antes_de: date) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM lembretes_dias WHERE dia < ?", (antes_de.isoformat(),))
+            self._conn.execute("DELETE FROM lembretes_enviados WHERE inicio < ?", (antes_de.isoformat(),))
+
+    async def carregar(self, desde: date):
+        return await asyncio.to_thread(self._carregar, desde)
+
+    async def gravar_dias(self, cnpj: str, dias: List[Tuple[date, float, List]]) -> None:
+        await asyncio.to_thread(self._gravar_dias, cnpj, dias)
+
+    async def gravar_enviado(self, chave: ChaveLembrete) -> None:
+        await asyncio.to_thread(self._gravar_enviado, chave)
+
+    async def podar(self, antes_de: date) -> None:
+        await asyncio.to_thread(self._podar, antes_de)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ReminderScheduler:
+    """
+    Lembretes de consulta (por padrão 24h e 2h antes) enviados pela fila do WhatsApp.
+
+    Cada clínica tem um horizonte de dias já sincronizados com a CNN; a cada
+    rodada só os dias novos (e os sincronizados há mais de
+    ``LEMBRETES_REFRESH_INTERVAL``) são buscados. Os lembretes ficam num único
+    min-heap ordenado pelo horário de envio, sem uma task por agendamento, e o
+    dia do agendamento é revalidado logo antes do envio. Horizonte e lembretes
+    enviados ficam no SQLite: um reinício não repete buscas nem mensagens.
+    """
+
+    def __init__(self, backend: Optional[SQLiteReminderBackend] = None):
+        self.backend = backend
+        self._tz = ZoneInfo(settings.LEMBRETES_TIMEZONE)
+        self._antecedencias = _antecedencias()
+        self._filtro = FiltroAgendamentos(status=settings.LEMBRETES_STATUS)
+        self._clinicas: Dict[str, ClinicaResolvida] = {}
+        self._dias: Dict[Tuple[str, date], Dict[int, _Agendamento]] = {}
+        self._sincronizado: Dict[Tuple[str, date], float] = {}
+        self._enviados: Set[ChaveLembrete] = set()
+        # (quando, ordem, cnpj, dia, id, tipo, início)
+        self._fila: List[Tuple[datetime, int, str, date, int, str, str]] = []
+        self._na_fila: Set[ChaveLembrete] = set()
+        self._ordem = itertools.count()
+        self._acordar = asyncio.Event()
+        self._vagas = asyncio.Semaphore(settings.LEMBRETES_MAX_PENDENTES)
+        self._tasks: List[asyncio.Task] = []
+        self.contagem: Counter = Counter()
+        self.ultima_sincronizacao: Optional[float] = None
+
+    def _agora(self) -> datetime:
+        # Horários da CNN são locais da clínica, sem fuso
+        return datetime.now(self._tz).replace(tzinfo=None)
+
+    async def start(self) -> None:
+        if self.backend is not None:
+            dias, enviados = await self.backend.carregar(self._agora().date())
+            self._enviados.update(enviados)
+            for cnpj, dia, sincronizado_em, itens in dias:
+                agendamentos = {
+                    id_agenda: _Agendamento(id_agenda, datetime.fromisoformat(inicio), numero)
+                    for id_agenda, inicio, numero in itens
+                }
+                self._registrar_dia(cnpj, dia, agendamentos, sincronizado_em)
+        self._tasks = [
+            asyncio.create_task(self._sincronizar_loop(), name="lembretes-sync"),
+            asyncio.create_task(self._enviar_loop(), name="lembretes-envio")
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.backend is not None:
+            await self.backend.close()
+
+    # Sincronização com a CNN
+
+    async def _sincronizar_loop(self) -> None:
+        while True:
+            try:
+                await self.sincronizar()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Falha ao sincronizar agendamentos para lembretes")
+            await asyncio.sleep(settings.LEMBRETES_SYNC_INTERVAL)
+
+    async def sincronizar(self) -> None:
+        clinicas: Dict[str, ClinicaResolvida] = {}
+        for dados in await SupabaseService().list_clinicas():
+            try:
+                clinica = ClinicaResolvida(dados)
+            except ValueError:
+                # Cadastro incompleto (sem cid ou api_key da CNN)
+                continue
+            clinicas[clinica.clinica.cnpj] = clinica
+        self._clinicas = clinicas
+
+        limite = asyncio.Semaphore(settings.LEMBRETES_SYNC_CONCURRENCY)
+
+        async def sincronizar_clinica(clinica: ClinicaResolvida) -> None:
+            async with limite:
+                try:
+                    await self._sincronizar_clinica(clinica)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.contagem["falhas_sync"] += 1
+                    logger.warning("Falha ao sincronizar agendamentos de %s: %s", clinica.clinica.cnpj, e)
+
+        await asyncio.gather(*(sincronizar_clinica(c) for c in clinicas.values()))
+        await self._podar()
+        self.ultima_sincronizacao = time.time()
+
+    async def _sincronizar_clinica(self, clinica: ClinicaResolvida) -> None:
+        cnpj = clinica.clinica.cnpj
+        hoje = self._agora().date()
+        agora = time.time()
+        pendentes = [
+            dia for dia in _dias(hoje, hoje + timedelta(days=settings.LEMBRETES_HORIZONTE_DIAS))
+            if agora - self._sincronizado.get((cnpj, dia), 0.0) > settings.LEMBRETES_REFRESH_INTERVAL
+        ]
+        # Dias consecutivos viram um único período na CNN
+        for _, grupo in itertools.groupby(enumerate(pendentes), key=lambda par: par[1] - timedelta(days=par[0])):
+            dias = [dia for _, dia in grupo]
+            await self._buscar(clinica, dias[0], dias[-1])
+
+    async def _buscar(self, clinica: ClinicaResolvida, inicio: date, fim: date) -> None:
+        cnpj = clinica.clinica.cnpj
+        por_dia: Dict[date, Dict[int, _Agendamento]] = {dia: {} for dia in _dias(inicio, fim)}
+        with prioridade_baixa(), metricas_da_clinica(cnpj):
+            itens = await iterar_agendamentos(clinica.cnn_service(), self._filtro, inicio.isoformat(), fim.isoformat())
+            async for item in itens:
+                if "erro" in item:
+                    raise RuntimeError(item["erro"])
+                agendamento = _Agendamento.da_cnn(item)
+                if agendamento is not None and agendamento.inicio.date() in por_dia:
+                    por_dia[agendamento.inicio.date()][agendamento.id] = agendamento
+        self.contagem["buscas"] += 1
+
+        agora = time.time()
+        for dia, agendamentos in por_dia.items():
+            self._registrar_dia(cnpj, dia, agendamentos, agora)
+        if self.backend is not None:
+            await self.backend.gravar_dias(cnpj, [
+                (dia, agora, [[a.id, a.inicio.isoformat(), a.numero] for a in agendamentos.values()])
+                for dia, agendamentos in por_dia.items()
+            ])
+
+    def _registrar_dia(self, cnpj: str, dia: date, agendamentos: Dict[int, _Agendamento], sincronizado_em: float) -> None:
+        # O dia é substituído por inteiro: cancelados e remarcados somem daqui,
+        # e os lembretes antigos deles são descartados ao sair do heap
+        self._dias[(cnpj, dia)] = agendamentos
+        self._sincronizado[(cnpj, dia)] = sincronizado_em
+        agora = self._agora()
+        for agendamento in agendamentos.values():
+            self._agendar(cnpj, dia, agendamento, agora)
+
+    def _agendar(self, cnpj: str, dia: date, agendamento: _Agendamento, agora: datetime) -> None:
+        if agendamento.inicio <= agora:
+            return
+        inicio = agendamento.inicio.isoformat()
+        atrasado = False
+        # Da menor antecedência para a maior: com vários lembretes já vencidos
+        # (agendamento recente ou serviço parado), só o mais próximo é enviado
+        for tipo, antecedencia in reversed(self._antecedencias):
+            quando = agendamento.inicio - antecedencia
+            if quando <= agora:
+                if atrasado:
+                    continue
+                atrasado = True
+            chave = (cnpj, agendamento.id, tipo, inicio)
+            if chave in self._enviados or chave in self._na_fila:
+                continue
+            self._na_fila.add(chave)
+            heapq.heappush(self._fila, (quando, next(self._ordem), cnpj, dia, agendamento.id, tipo, inicio))
+        self._acordar.set()
+
+    async def _podar(self) -> None:
+        hoje = self._agora().date()
+        for chave in [c for c in self._dias if c[1] < hoje]:
+            del self._dias[chave]
+            self._sincronizado.pop(chave, None)
+        self._enviados = {c for c in self._enviados if c[3] >= hoje.isoformat()}
+        if self.backend is not None:
+            await self.backend.podar(hoje)
+
+    # Envio
+
+    async def _enviar_loop(self) -> None:
+        while True:
+            agora = self._agora()
+            if not self._fila or self._fila[0][0] > agora:
+                espera = (self._fila[0][0] - agora).total_seconds() if self._fila else 60.0
+                self._acordar.clear()
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), timeout=min(max(espera, 0.05), 60.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            vencidos = []
+            while self._fila and self._fila[0][0] <= agora and len(vencidos) < settings.LEMBRETES_MAX_PENDENTES:
+                vencidos.append(heapq.heappop(self._fila))
+            try:
+                await self._enviar_lote(vencidos)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Falha ao enviar lembretes")
+
+    async def _enviar_lote(self, vencidos: List[Tuple]) -> None:
+        # Revalida cada dia envolvido (uma busca por clínica e dia) antes de enviar
+        agora = time.time()
+        dias = {(cnpj, dia) for _, _, cnpj, dia, _, _, _ in vencidos}
+        for cnpj, dia in dias:
+            clinica = self._clinicas.get(cnpj)
+            if clinica is None or agora - self._sincronizado.get((cnpj, dia), 0.0) <= settings.LEMBRETES_REVALIDACAO:
+                continue
+            try:
+                await self._buscar(clinica, dia, dia)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Sem revalidação, vale o que foi sincronizado por último
+                logger.warning("Falha ao revalidar agendamentos de %s em %s: %s", cnpj, dia, e)
+
+        despachante = get_outbound_dispatcher()
+        for posicao, (_, _, cnpj, dia, id_agenda, tipo, inicio) in enumerate(vencidos):
+            chave = (cnpj, id_agenda, tipo, inicio)
+            self._na_fila.discard(chave)
+            agendamento = self._dias.get((cnpj, dia), {}).get(id_agenda)
+            if agendamento is None or agendamento.inicio.isoformat() != inicio:
+                self.contagem["descartados"] += 1
+                continue
+            if chave in self._enviados or agendamento.inicio <= self._agora():
+                continue
+            if despachante is None:
+                logger.warning("Fila de envio do WhatsApp indisponível: lembrete de %s descartado", id_agenda)
+                continue
+
+            await self._vagas.acquire()
+            try:
+                resultado = despachante.enviar(
+                    agendamento.numero,
+                    MENSAGEM_LEMBRETE.format(
+                        data=agendamento.inicio.strftime("%d/%m/%Y"),
+                        hora=agendamento.inicio.strftime("%H:%M")
+                    ),
+                    prioridade=LEMBRETE
+                )
+            except FilaCheia:
+                # Fila do WhatsApp ocupada: devolve este e os demais para daqui a pouco
+                self._vagas.release()
+                adiado = self._agora() + timedelta(seconds=5)
+                for _, _, c, d, i, t, ini in vencidos[posicao:]:
+                    self._na_fila.add((c, i, t, ini))
+                    heapq.heappush(self._fila, (adiado, next(self._ordem), c, d, i, t, ini))
+                self.contagem["adiados"] += 1
+                return
+
+            # Registrado na entrega à fila: um reinício não repete o lembrete
+            self._enviados.add(chave)
+            if self.backend is not None:
+                await self.backend.gravar_enviado(chave)
+            resultado.add_done_callback(self._concluido)
+
+    def _concluido(self, resultado: asyncio.Future) -> None:
+        self._vagas.release()
+        if resultado.cancelled() or resultado.exception() is not None:
+            self.contagem["falhas_envio"] += 1
+        else:
+            self.contagem["enviados"] += 1
+
+    def stats(self) -> Dict:
+        horizonte: Dict[str, date] = defaultdict(lambda: date.min)
+        for cnpj, dia in self._dias:
+            horizonte[cnpj] = max(horizonte[cnpj], dia)
+        return {
+            "clinicas": len(self._clinicas),
+            "dias": len(self._dias),
+            "agendamentos": sum(len(a) for a in self._dias.values()),
+            "pendentes": len(self._fila),
+            "proximo": self._fila[0][0].isoformat() if self._fila else None,
+            "horizonte_min": min(horizonte.values()).isoformat() if horizonte else None,
+            "ultima_sincronizacao": self.ultima_sincronizacao,
+            **self.contagem
+        }
+
+
+_scheduler: Optional[ReminderScheduler] = None
+
+
+async def init_reminder_scheduler() -> Optional[ReminderScheduler]:
+    global _scheduler
+    if not settings.LEMBRETES_ENABLED:
+        return None
+    backend = SQLiteReminderBackend(settings.LEMBRETES_SQLITE_PATH) if settings.LEMBRETES_SQLITE_PATH else None
+    _scheduler = ReminderScheduler(backend)
+    await _scheduler.start()
+    return _scheduler
+
+
+def get_reminder_scheduler() -> Optional[ReminderScheduler]:
+    return _scheduler
+
+
+async def close_reminder_scheduler() -> None:
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
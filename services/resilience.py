@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Union
+import httpx
+from config import get_settings
+from services.erros import ErroUpstream, retry_after_segundos
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Instante (time.monotonic) em que a requisição atual precisa estar respondida
+prazo_atual: ContextVar[Optional[float]] = ContextVar("prazo_requisicao", default=None)
+
+METODOS_IDEMPOTENTES = frozenset({"GET", "HEAD"})
+STATUS_RETENTAVEIS = frozenset({429, 502, 503, 504})
+
+# Falhas de rede em que a requisição não chegou a ser enviada (sem conexão);
+# nas demais (ReadError, ReadTimeout...) o upstream pode já tê-la processado
+NAO_ENVIADA = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Códigos de ErroUpstream levantados antes de a requisição sair
+CODIGOS_NAO_ENVIADA = frozenset({"circuito_aberto", "prazo_esgotado", "limite_local", "conexao_recusada", "timeout_conexao"})
+
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio_aberto"
+
+
+@contextmanager
+def prazo(segundos: Optional[float]) -> Iterator[None]:
+    """
+    Define o prazo das chamadas feitas dentro do bloco.
+
+    Um prazo já em vigor (da requisição que originou a chamada) nunca é estendido.
+    """
+    if segundos is None:
+        yield
+        return
+    novo = time.monotonic() + segundos
+    atual = prazo_atual.get()
+    token = prazo_atual.set(novo if atual is None else min(atual, novo))
+    try:
+        yield
+    finally:
+        prazo_atual.reset(token)
+
+
+@contextmanager
+def novo_prazo(segundos: float) -> Iterator[None]:
+    """
+    Substitui o prazo em vigor em vez de só encurtá-lo.
+
+    Para as etapas de respostas em streaming, que continuam depois do prazo da
+    requisição que as iniciou: cada etapa recebe um prazo próprio.
+    """
+    token = prazo_atual.set(time.monotonic() + segundos)
+    try:
+        yield
+    finally:
+        prazo_atual.reset(token)
+
+
+def tempo_restante() -> Optional[float]:
+    atual = prazo_atual.get()
+    if atual is None:
+        return None
+    return atual - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Abre após ``limite_falhas`` falhas seguidas e rejeita chamadas por
+    ``tempo_reset`` segundos. Depois disso deixa passar uma única chamada de
+    teste (meio aberto): sucesso fecha o circuito, falha abre de novo.
+    """
+
+    def __init__(self, limite_falhas: int, tempo_reset: float):
+        self.limite_falhas = limite_falhas
+        self.tempo_reset = tempo_reset
+        self.estado = FECHADO
+        self.falhas_seguidas = 0
+        self.aberto_em = 0.0
+        self._sonda_em_andamento = False
+        self.aberturas = 0
+        self.rejeicoes = 0
+
+    def restante_aberto(self) -> float:
+        return max(0.0, self.aberto_em + self.tempo_reset - time.monotonic())
+
+    def permitir(self) -> bool:
+        if self.estado == FECHADO:
+            return True
+        if self.estado == ABERTO and self.restante_aberto() <= 0:
+            self.estado = MEIO_ABERTO
+        if self.estado == MEIO_ABERTO and not self._sonda_em_andamento:
+            self._sonda_em_andamento = True
+            return True
+        self.rejeicoes += 1
+        return False
+
+    def sucesso(self) -> None:
+        self.estado = FECHADO
+        self.falhas_seguidas = 0
+        self._sonda_em_andamento = False
+
+    def falha(self) -> None:
+        self.falhas_seguidas += 1
+        if self.estado == MEIO_ABERTO or self.falhas_seguidas >= self.limite_falhas:
+            if self.estado != ABERTO:
+                self.aberturas += 1
+            self.estado = ABERTO
+            self.aberto_em = time.monotonic()
+        self._sonda_em_andamento = False
+
+    def liberar_sonda(self) -> None:
+        # Chamada de teste abortada sem resultado (cancelada, rejeitada localmente)
+        self._sonda_em_andamento = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.estado,
+            "consecutive_failures": self.falhas_seguidas,
+            "opened": self.aberturas,
+            "rejections": self.rejeicoes,
+            "retry_in": round(self.restante_aberto(), 3) if self.estado != FECHADO else 0.0
+        }
+
+
+class Circuitos:
+    """Um circuit breaker por chave (host do upstream ou clínica da CNN)."""
+
+    def __init__(self):
+        self._circuitos: Dict[str, CircuitBreaker] = {}
+
+    def get(self, chave: str) -> CircuitBreaker:
+        circuito = self._circuitos.get(chave)
+        if circuito is None:
+            circuito = self._circuitos[chave] = CircuitBreaker(
+                settings.CIRCUIT_FAILURE_THRESHOLD,
+                settings.CIRCUIT_RESET_TIMEOUT
+            )
+        return circuito
+
+    def stats(self) -> Dict:
+        return {chave: circuito.stats() for chave, circuito in self._circuitos.items()}
+
+
+_circuitos: Optional[Circuitos] = None
+
+
+def get_circuitos() -> Circuitos:
+    global _circuitos
+    if _circuitos is None:
+        _circuitos = Circuitos()
+    return _circuitos
+
+
+def _limitar(valor: Optional[float], restante: float) -> float:
+    return restante if valor is None else min(valor, restante)
+
+
+def _timeout(client: httpx.AsyncClient, restante: Optional[float]) -> Union[httpx.Timeout, object]:
+    # O timeout de cada tentativa nunca passa do que sobra do prazo
+    if restante is None:
+        return httpx.USE_CLIENT_DEFAULT
+    padrao = client.timeout
+    return httpx.Timeout(
+        connect=_limitar(padrao.connect, restante),
+        read=_limitar(padrao.read, restante),
+        write=_limitar(padrao.write, restante),
+        pool=_limitar(padrao.pool, restante)
+    )
+
+
+def _espera(tentativa: int) -> float:
+    # Backoff exponencial com jitter completo
+    return random.uniform(0, min(settings.RETRY_MAX_DELAY, settings.RETRY_BASE_DELAY * 2 ** tentativa))
+
+
+def _erro_status(upstream: str, response: httpx.Response) -> ErroUpstream:
+    status = response.status_code
+    if status == 429:
+        return ErroUpstream(
+            429, f"Limite de requisições de {upstream} atingido", upstream, codigo="limite_upstream",
+            retry_after=retry_after_segundos(response.headers.get("Retry-After")) or 1.0, upstream_status=status
+        )
+    if status >= 500:
+        return ErroUpstream(502, f"{upstream} respondeu {status}", upstream, codigo="falha_upstream", upstream_status=status)
+    try:
+        corpo = response.json()
+    except ValueError:
+        corpo = None
+    mensagem = (corpo.get("mensagem") or corpo.get("message")) if isinstance(corpo, dict) else None
+    # Erros de validação e "não encontrado" são repassados; credenciais inválidas são problema nosso
+    repassado = status if status in (400, 404, 409, 422) else 502
+    return ErroUpstream(
+        repassado, mensagem or f"{upstream} recusou a requisição ({status})", upstream,
+        codigo="requisicao_recusada", upstream_status=status
+    )
+
+
+async def chamar(
+    upstream: str,
+    circuito: str,
+    client: httpx.AsyncClient,
+    method: str,
+    enviar: Callable[[object], Awaitable[httpx.Response]]
+) -> httpx.Response:
+    """
+    Executa ``enviar(timeout)`` com prazo, retentativas e circuit breaker.
+
+    Só GET/HEAD são retentados (falha de rede, 429, 502-504), com espera que
+    respeita o Retry-After e o prazo da requisição. Qualquer status >= 400 vira
+    ErroUpstream antes de alguém chamar ``response.json()``.
+    """
+    breaker = get_circuitos().get(circuito)
+    if not breaker.permitir():
+        raise ErroUpstream(
+            503, f"{upstream} indisponível (circuito aberto)", upstream,
+            codigo="circuito_aberto", retry_after=breaker.restante_aberto()
+        )
+
+    retentavel = method.upper() in METODOS_IDEMPOTENTES
+    tentativas = settings.RETRY_MAX_ATTEMPTS if retentavel else 1
+    concluida = False
+    try:
+        for tentativa in range(tentativas):
+            restante = tempo_restante()
+            if restante is not None and restante <= 0:
+                raise ErroUpstream(504, "Prazo da requisição esgotado", upstream, codigo="prazo_esgotado")
+
+            ultima = tentativa == tentativas - 1
+            espera_minima = 0.0
+            try:
+                if restante is None:
+                    response = await enviar(_timeout(client, restante))
+                else:
+                    # Timeouts do httpx são por operação; o prazo limita a tentativa inteira
+                    response = await asyncio.wait_for(enviar(_timeout(client, restante)), restante)
+            except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+                breaker.falha()
+                concluida = True
+                if ultima:
+                    codigo = "timeout_conexao" if isinstance(e, NAO_ENVIADA) else "timeout_upstream"
+                    raise ErroUpstream(504, f"Tempo esgotado ao chamar {upstream}", upstream, codigo=codigo)
+            except httpx.TransportError as e:
+                breaker.falha()
+                concluida = True
+                if ultima:
+                    codigo = "conexao_recusada" if isinstance(e, NAO_ENVIADA) else "conexao_upstream"
+                    raise ErroUpstream(502, f"Falha de conexão com {upstream}: {e}", upstream, codigo=codigo)
+            else:
+                status = response.status_code
+                if status >= 500:
+                    breaker.falha()
+                else:
+                    # 429 é limite da clínica, não indisponibilidade do serviço
+                    breaker.sucesso()
+                concluida = True
+                if status < 400:
+                    return response
+                if ultima or status not in STATUS_RETENTAVEIS:
+                    raise _erro_status(upstream, response)
+                espera_minima = retry_after_segundos(response.headers.get("Retry-After")) or 0.0
+
+            if not breaker.permitir():
+                raise ErroUpstream(
+                    503, f"{upstream} indisponível (circuito aberto)", upstream,
+                    codigo="circuito_aberto", retry_after=breaker.restante_aberto()
+                )
+            concluida = False
+            espera = max(espera_minima, _espera(tentativa))
+            restante = tempo_restante()
+            if restante is not None and espera >= restante:
+                breaker.liberar_sonda()
+                raise ErroUpstream(504, "Prazo da requisição esgotado", upstream, codigo="prazo_esgotado")
+            logger.debug("Retentando %s %s em %.2fs (tentativa %d)", upstream, method, espera, tentativa + 2)
+            await asyncio.sleep(espera)
+    finally:
+        if not concluida:
+            breaker.liberar_sonda()
@@ -0,0 +1,20 @@
+from typing import Any
+import orjson
+from fastapi.responses import ORJSONResponse, Response
+
+
+def responder(dados: Any) -> Response:
+    """
+    Resposta JSON sem passar pelo ``jsonable_encoder`` do FastAPI.
+
+    ``bytes`` são o corpo da CNN repassado como veio (sem parse nem nova
+    serialização); os demais valores são serializados com orjson.
+    """
+    if isinstance(dados, bytes):
+        return Response(content=dados, media_type="application/json")
+    return ORJSONResponse(dados)
+
+
+def linha_ndjson(dados: Any) -> bytes:
+    # Uma linha de resposta NDJSON serializada com orjson
+    return orjson.dumps(dados, option=orjson.OPT_APPEND_NEWLINE)
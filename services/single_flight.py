@@ -0,0 +1,82 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Mapping, Optional, Tuple
+
+
+def normalizar_params(params: Optional[Mapping[str, Any]]) -> Tuple:
+    # Ordem dos parâmetros e valores None não mudam a requisição enviada
+    if not params:
+        return ()
+    return tuple(sorted(
+        (str(k), str(v).lower() if isinstance(v, bool) else str(v))
+        for k, v in params.items()
+        if v is not None
+    ))
+
+
+class SingleFlight:
+    """
+    Une chamadas idênticas em andamento numa única execução.
+
+    O primeiro chamador de uma chave dispara ``factory()`` numa task própria;
+    os demais aguardam o mesmo resultado (ou a mesma exceção). Cancelar um
+    chamador não cancela a chamada dos outros. Não guarda nada depois que a
+    chamada termina, então pode ficar sob qualquer cache.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.collapsed = 0
+        self.errors = 0
+
+    async def do(self, chave: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        tarefa = self._inflight.get(chave)
+        if tarefa is None:
+            self.leaders += 1
+            tarefa = asyncio.ensure_future(factory())
+            self._inflight[chave] = tarefa
+            tarefa.add_done_callback(lambda t: self._concluir(chave, t))
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(tarefa)
+
+    def __contains__(self, chave: Hashable) -> bool:
+        return chave in self._inflight
+
+    def chaves(self) -> List[Hashable]:
+        return list(self._inflight)
+
+    def vigente(self, chave: Hashable) -> bool:
+        """Chamado dentro de ``factory()``: a execução ainda é a da chave (não foi esquecida)."""
+        return self._inflight.get(chave) is asyncio.current_task()
+
+    def esquecer(self, chave: Hashable) -> None:
+        # Quem já aguarda recebe o resultado em andamento; os próximos disparam outra execução
+        self._inflight.pop(chave, None)
+
+    def _concluir(self, chave: Hashable, tarefa: asyncio.Future) -> None:
+        if self._inflight.get(chave) is tarefa:
+            del self._inflight[chave]
+        if not tarefa.cancelled() and tarefa.exception() is not None:
+            # Marca a exceção como consumida mesmo se todos os chamadores desistiram
+            self.errors += 1
+
+    def stats(self) -> Dict:
+        total = self.leaders + self.collapsed
+        return {
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "collapsed": self.collapsed,
+            "errors": self.errors,
+            "collapse_ratio": self.collapsed / total if total else 0.0
+        }
+
+
+_cnn: Optional[SingleFlight] = None
+
+
+def get_cnn_single_flight() -> SingleFlight:
+    global _cnn
+    if _cnn is None:
+        _cnn = SingleFlight()
+    return _cnn
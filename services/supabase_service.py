@@ -1,27 +1,88 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from config import get_settings
 
 settings = get_settings()
 
+# O client do supabase-py é síncrono: um único client por processo e
+# execução das consultas num pool de threads limitado, fora do event loop.
+_client: Optional[Client] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def init_supabase(client: Optional[Client] = None) -> Client:
+    global _client, _executor, _semaphore
+    _client = client or create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+    _executor = ThreadPoolExecutor(
+        max_workers=settings.SUPABASE_MAX_WORKERS,
+        thread_name_prefix="supabase"
+    )
+    _semaphore = asyncio.Semaphore(settings.SUPABASE_MAX_WORKERS)
+    return _client
+
+
+def get_supabase_client() -> Client:
+    # Scripts fora do lifespan (ex.: test_patient.py) inicializam sob demanda
+    if _client is None:
+        init_supabase()
+    return _client
+
+
+def close_supabase() -> None:
+    global _client, _executor, _semaphore
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+    _client = None
+    _executor = None
+    _semaphore = None
+
+
+async def run_blocking(func, *args):
+    if _executor is None:
+        init_supabase()
+    # O semáforo mantém a fila de espera no event loop (cancelável) e não no executor
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, func, *args)
+
+
 class SupabaseService:
-    def __init__(self):
-        self.client: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
-    
+    def __init__(self, client: Optional[Client] = None):
+        self.client: Client = client or get_supabase_client()
+
+    async def _execute(self, query):
+        return await run_blocking(query.execute)
+
     async def get_clinica_by_cnpj(self, cnpj: str) -> Optional[Dict]:
-        response = self.client.table('companies').select('*').eq('cnpj', cnpj).execute()
+        response = await self._execute(self.client.table('companies').select('*').eq('cnpj', cnpj))
         if response.data:
             return response.data[0]
         return None
-    
+
     async def create_clinica(self, clinica_data: Dict) -> Dict:
-        response = self.client.table('companies').insert(clinica_data).execute()
+        response = await self._execute(self.client.table('companies').insert(clinica_data))
         return response.data[0]
-    
+
     async def update_clinica(self, cnpj: str, clinica_data: Dict) -> Dict:
-        response = self.client.table('companies').update(clinica_data).eq('cnpj', cnpj).execute()
+        response = await self._execute(self.client.table('companies').update(clinica_data).eq('cnpj', cnpj))
         return response.data[0]
-    
+
     async def delete_clinica(self, cnpj: str) -> Dict:
-        response = self.client.table('companies').delete().eq('cnpj', cnpj).execute()
-        return response.data[0] 
\ No newline at end of file
+        response = await self._execute(self.client.table('companies').delete().eq('cnpj', cnpj))
+        return response.data[0]
+
+    async def list_clinicas(self, tamanho_pagina: int = 1000) -> List[Dict]:
+        # O PostgREST limita o tamanho da resposta: busca em páginas pelo range
+        clinicas: List[Dict] = []
+        inicio = 0
+        while True:
+            response = await self._execute(
+                self.client.table('companies').select('*').order('cnpj').range(inicio, inicio + tamanho_pagina - 1)
+            )
+            clinicas.extend(response.data or [])
+            if len(response.data or []) < tamanho_pagina:
+                return clinicas
+            inicio += tamanho_pagina
@@ -0,0 +1,475 @@
+"""
+Registro das tools do MCP, executadas no próprio processo.
+
+Cada tool liga um nome a uma chamada do ``CNNService`` com parâmetros
+validados por um modelo pydantic. ``executar_lote`` roda várias chamadas numa
+única requisição: as independentes em paralelo, as demais assim que as
+chamadas de que dependem terminam.
+"""
+import asyncio
+import hashlib
+import json
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type
+from fastapi import HTTPException
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from config import get_settings
+from dependencies import normalizar_cnpj
+from models import Paciente
+from services.agendamentos_paginados import CursorInvalido, FiltroAgendamentos, listar_pagina
+from services.idempotency import executar_idempotente
+from services.importacao_pacientes import ID_ORIGEM_PADRAO, payload_cnn
+
+settings = get_settings()
+
+# Referência ao resultado de outra chamada do lote: {"$ref": "<id>.lista.0.id"}
+REF = "$ref"
+
+
+class Parametros(BaseModel):
+    # Parâmetros desconhecidos são erro: um nome digitado errado não é ignorado
+    model_config = ConfigDict(extra="forbid")
+
+
+class Ferramenta:
+    __slots__ = ("nome", "descricao", "parametros", "handler", "escrita")
+
+    def __init__(
+        self,
+        nome: str,
+        descricao: str,
+        parametros: Type[Parametros],
+        handler: Callable[[Any, Any], Awaitable[Any]],
+        escrita: bool = False
+    ):
+        self.nome = nome
+        self.descricao = descricao
+        self.parametros = parametros
+        self.handler = handler
+        # Tools que criam registros na CNN aceitam idempotency_key
+        self.escrita = escrita
+
+    def descrever(self) -> Dict:
+        return {
+            "name": self.nome,
+            "description": self.descricao,
+            "parameters": self.parametros.model_json_schema()
+        }
+
+
+FERRAMENTAS: Dict[str, Ferramenta] = {}
+
+
+def ferramenta(nome: str, descricao: str, parametros: Type[Parametros], escrita: bool = False):
+    def registrar(handler):
+        FERRAMENTAS[nome] = Ferramenta(nome, descricao, parametros, handler, escrita)
+        return handler
+    return registrar
+
+
+def manifesto() -> List[Dict]:
+    return [f.descrever() for f in FERRAMENTAS.values()]
+
+
+class Manifesto:
+    """Lista de tools já serializada, com ETag forte derivada do conteúdo."""
+
+    __slots__ = ("corpo", "etag")
+
+    def __init__(self, tools: List[Dict]):
+        self.corpo: bytes = json.dumps({"tools": tools}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = '"%s"' % hashlib.sha256(self.corpo).hexdigest()[:32]
+
+    def corresponde(self, if_none_match: Optional[str]) -> bool:
+        # If-None-Match usa comparação fraca: W/"x" também corresponde a "x"
+        if not if_none_match:
+            return False
+        etags = [e.strip() for e in if_none_match.split(",")]
+        return "*" in etags or self.etag in (e[2:] if e.startswith("W/") else e for e in etags)
+
+
+_manifesto: Optional[Manifesto] = None
+
+
+def get_manifesto() -> Manifesto:
+    # As tools só mudam com um novo deploy: o manifesto é gerado uma única vez
+    global _manifesto
+    if _manifesto is None:
+        _manifesto = Manifesto(manifesto())
+    return _manifesto
+
+
+def _hora(valor: str) -> str:
+    # A CNN espera HH:MM:SS
+    return valor if len(valor) == 8 else f"{valor}:00"
+
+
+# --- Pacientes ---
+
+class ListarPacientes(Parametros):
+    nome: str = Field("", description="Filtro por nome do paciente")
+    email: str = Field("", description="Filtro por email")
+    telefone: str = Field("", description="Filtro por telefone")
+    cpf: Optional[str] = Field(None, description="Filtro por CPF do paciente")
+
+
+@ferramenta("listar_pacientes", "Lista os pacientes da clínica", ListarPacientes)
+async def listar_pacientes(tenant, p: ListarPacientes):
+    if p.cpf:
+        return await tenant.cnn.get_paciente(p.cpf)
+    return await tenant.cnn.get_pacientes(p.nome, p.email, p.telefone)
+
+
+class CriarPaciente(Parametros):
+    nome: str = Field(..., min_length=1, description="Nome completo do paciente")
+    cpf: str = Field(..., description="CPF ou CNPJ do paciente")
+    data_nascimento: date = Field(..., description="Data de nascimento (YYYY-MM-DD)")
+    telefone: str = Field(..., description="Telefone celular do paciente")
+    email: Optional[str] = Field(None, description="Email do paciente")
+
+
+@ferramenta("criar_paciente", "Cria um novo paciente na clínica", CriarPaciente, escrita=True)
+async def criar_paciente(tenant, p: CriarPaciente):
+    paciente = Paciente(
+        nome=p.nome,
+        cpf_cnpj="".join(c for c in p.cpf if c.isdigit()),
+        data_nascimento=p.data_nascimento.isoformat(),
+        telefone_celular="".join(c for c in p.telefone if c.isdigit()),
+        email=p.email
+    )
+    id_origem = tenant.clinica.clinica.id_origem_paciente or ID_ORIGEM_PADRAO
+    return await tenant.cnn.criar_paciente(payload_cnn(paciente, id_origem))
+
+
+class ObterPaciente(Parametros):
+    cpf: str = Field(..., description="CPF do paciente")
+
+
+@ferramenta("obter_paciente", "Obtém os dados de um paciente, com os convênios", ObterPaciente)
+async def obter_paciente(tenant, p: ObterPaciente):
+    lista = (await tenant.cnn.get_paciente(p.cpf)).get("lista") or []
+    if not lista:
+        raise HTTPException(status_code=404, detail="Paciente não encontrado")
+    paciente = lista[0]
+    convenios = await tenant.cnn.get_convenios_paciente(paciente["id"])
+    return {**paciente, "convenios": convenios.get("lista", [])}
+
+
+class ListarConveniosPaciente(Parametros):
+    id_paciente: int = Field(..., description="ID do paciente")
+
+
+@ferramenta("listar_convenios_paciente", "Lista os convênios de um paciente", ListarConveniosPaciente)
+async def listar_convenios_paciente(tenant, p: ListarConveniosPaciente):
+    return await tenant.cnn.get_convenios_paciente(p.id_paciente)
+
+
+class AssociarConvenioPaciente(Parametros):
+    id_paciente: int = Field(..., description="ID do paciente")
+    id_tipo_convenio: int = Field(..., description="ID do tipo de convênio (Particular: 12642)")
+
+
+@ferramenta("associar_convenio_paciente", "Associa um convênio a um paciente", AssociarConvenioPaciente, escrita=True)
+async def associar_convenio_paciente(tenant, p: AssociarConvenioPaciente):
+    return await tenant.cnn.associar_convenio(id_paciente=p.id_paciente, id_tipo_convenio=p.id_tipo_convenio)
+
+
+# --- Catálogos ---
+
+class SemParametros(Parametros):
+    pass
+
+
+@ferramenta("listar_tipos_convenios", "Lista os tipos de convênios da clínica", SemParametros)
+async def listar_tipos_convenios(tenant, p: SemParametros):
+    return await tenant.cnn.get_tipo_convenios()
+
+
+class ListarExecutores(Parametros):
+    id_especialidade: Optional[int] = Field(None, description="ID da especialidade")
+    id_tipo_convenio: Optional[int] = Field(None, description="ID do tipo de convênio")
+    nome: Optional[str] = Field(None, description="Filtro por nome do médico")
+
+
+@ferramenta("listar_executores", "Lista os médicos/executores disponíveis", ListarExecutores)
+async def listar_executores(tenant, p: ListarExecutores):
+    return await tenant.cnn.get_executores_agenda(
+        id_especialidade=p.id_especialidade,
+        id_tipo_convenio=p.id_tipo_convenio,
+        nome=p.nome
+    )
+
+
+class ListarEspecialidades(Parametros):
+    nome: str = Field("", description="Filtro por nome da especialidade")
+
+
+@ferramenta("listar_especialidades", "Lista as especialidades atendidas na clínica", ListarEspecialidades)
+async def listar_especialidades(tenant, p: ListarEspecialidades):
+    return await tenant.cnn.get_especialidades(p.nome)
+
+
+# --- Agenda ---
+
+class VerificarDisponibilidade(Parametros):
+    id_executor: int = Field(..., description="ID do executor (médico)")
+    cod_tipo_atendimento: int = Field(..., description="Código do tipo de atendimento")
+    data_inicio: date = Field(..., description="Data inicial (YYYY-MM-DD)")
+    data_fim: date = Field(..., description="Data final (YYYY-MM-DD)")
+
+
+@ferramenta("verificar_disponibilidade", "Verifica os horários livres de um médico", VerificarDisponibilidade)
+async def verificar_disponibilidade(tenant, p: VerificarDisponibilidade):
+    if p.data_fim < p.data_inicio:
+        raise HTTPException(status_code=422, detail="data_fim anterior a data_inicio")
+    return await tenant.cnn.get_disponibilidade_executor(
+        id_executor=p.id_executor,
+        cod_tipo_atendimento=p.cod_tipo_atendimento,
+        data_inicio=p.data_inicio.isoformat(),
+        data_fim=p.data_fim.isoformat()
+    )
+
+
+class CriarAgendamento(Parametros):
+    id_paciente: int = Field(..., description="ID do paciente")
+    id_paciente_convenio: int = Field(..., description="ID do convênio do paciente")
+    id_executor: int = Field(..., description="ID da pessoa do executor (médico)")
+    id_tipo_consulta: int = Field(..., description="ID do tipo de consulta")
+    id_especialidade: int = Field(..., description="ID da especialidade")
+    id_tipo_procedimento: int = Field(..., description="ID do tipo de procedimento")
+    data: date = Field(..., description="Data do agendamento (YYYY-MM-DD)")
+    hora_inicio: str = Field(..., pattern=r"^\d{2}:\d{2}(:\d{2})?$", description="Hora de início (HH:MM)")
+    hora_fim: str = Field(..., pattern=r"^\d{2}:\d{2}(:\d{2})?$", description="Hora de término (HH:MM)")
+    telefone_celular_paciente: Optional[str] = Field(None, description="Telefone do paciente")
+    observacoes: Optional[str] = Field(None, description="Observações do agendamento")
+
+
+@ferramenta("criar_agendamento", "Cria um novo agendamento", CriarAgendamento, escrita=True)
+async def criar_agendamento(tenant, p: CriarAgendamento):
+    clinica = tenant.clinica.clinica
+    dados = {
+        "data": p.data.isoformat(),
+        "horaInicio": _hora(p.hora_inicio),
+        "horaFim": _hora(p.hora_fim),
+        "idLocalAgenda": clinica.id_local,
+        "idOrigemPaciente": clinica.id_origem_paciente or ID_ORIGEM_PADRAO,
+        "idPaciente": p.id_paciente,
+        "idPacienteConvenio": p.id_paciente_convenio,
+        "idPessoaExecutor": p.id_executor,
+        "idRotulo": clinica.id_rotulo,
+        "idTipoConsulta": p.id_tipo_consulta,
+        "procedimentos": [{
+            "idEspecialidade": p.id_especialidade,
+            "idTipoProcedimento": p.id_tipo_procedimento,
+            "quantidade": 1
+        }],
+        "status": "AGENDADO"
+    }
+    if p.telefone_celular_paciente:
+        dados["telefoneCelularPaciente"] = p.telefone_celular_paciente
+    if p.observacoes:
+        dados["observacoes"] = p.observacoes
+    return await tenant.cnn.criar_agendamento(dados)
+
+
+class ListarAgendamentos(Parametros):
+    codigo_paciente: Optional[int] = Field(None, description="ID do paciente")
+    id_executor: Optional[int] = Field(None, description="ID do executor (médico)")
+    status: Optional[str] = Field(None, description="Status separados por vírgula")
+    data_inicial: Optional[date] = Field(None, description="Data inicial (YYYY-MM-DD)")
+    data_final: Optional[date] = Field(None, description="Data final (YYYY-MM-DD)")
+    data_por: str = Field("AGENDAMENTO", description="Campo de data usado no filtro")
+
+
+@ferramenta("listar_agendamentos", "Lista os agendamentos", ListarAgendamentos)
+async def listar_agendamentos(tenant, p: ListarAgendamentos):
+    data_inicial = p.data_inicial.isoformat() if p.data_inicial else None
+    data_final = p.data_final.isoformat() if p.data_final else None
+    # Filtros que a CNN não aplica vão pela listagem paginada
+    if p.id_executor or p.status:
+        filtro = FiltroAgendamentos(
+            codigo_paciente=p.codigo_paciente,
+            id_executor=p.id_executor,
+            status=p.status,
+            data_por=p.data_por
+        )
+        try:
+            return await listar_pagina(tenant.cnn, filtro, 100, data_inicial=data_inicial, data_final=data_final)
+        except CursorInvalido as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return await tenant.cnn.get_agendamentos(
+        codigo_paciente=p.codigo_paciente,
+        data_inicial=data_inicial,
+        data_final=data_final,
+        data_por=p.data_por
+    )
+
+
+# --- Clínica ---
+
+@ferramenta("obter_clinica", "Obtém os dados da clínica", SemParametros)
+async def obter_clinica(tenant, p: SemParametros):
+    return tenant.clinica.dados
+
+
+# --- Execução em lote ---
+
+class ChamadaTool(BaseModel):
+    id: str = Field(..., min_length=1, max_length=64)
+    tool: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+    depends_on: List[str] = Field(default_factory=list)
+    idempotency_key: Optional[str] = None
+
+
+class LoteTools(BaseModel):
+    cnpj: Optional[str] = None
+    calls: List[ChamadaTool] = Field(..., min_length=1)
+
+
+def _refs(valor: Any) -> List[str]:
+    if isinstance(valor, dict):
+        if set(valor) == {REF} and isinstance(valor[REF], str):
+            return [valor[REF].split(".", 1)[0]]
+        return [r for v in valor.values() for r in _refs(v)]
+    if isinstance(valor, list):
+        return [r for v in valor for r in _refs(v)]
+    return []
+
+
+def _resolver(valor: Any, resultados: Dict[str, Any]) -> Any:
+    if isinstance(valor, dict):
+        if set(valor) == {REF} and isinstance(valor[REF], str):
+            atual = resultados
+            for parte in valor[REF].split("."):
+                if isinstance(atual, list) and parte.lstrip("-").isdigit() and -len(atual) <= int(parte) < len(atual):
+                    atual = atual[int(parte)]
+                elif isinstance(atual, dict) and parte in atual:
+                    atual = atual[parte]
+                else:
+                    raise HTTPException(status_code=422, detail=f"Referência não encontrada: {valor[REF]}")
+            return atual
+        return {k: _resolver(v, resultados) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_resolver(v, resultados) for v in valor]
+    return valor
+
+
+def _erro_validacao(e: ValidationError) -> HTTPException:
+    campos = ", ".join(".".join(str(p) for p in erro["loc"]) or erro["msg"] for erro in e.errors())
+    return HTTPException(status_code=422, detail=f"Parâmetros inválidos: {campos}")
+
+
+def planejar(lote: List[ChamadaTool], cnpj: str) -> List[ChamadaTool]:
+    """
+    Valida o lote inteiro antes de executar qualquer chamada e devolve as
+    chamadas em ordem topológica. Erros aqui recusam o lote (400/422).
+    """
+    if len(lote) > settings.TOOLS_BATCH_MAX_CALLS:
+        raise HTTPException(status_code=400, detail=f"Lote com mais de {settings.TOOLS_BATCH_MAX_CALLS} chamadas")
+    chamadas: Dict[str, ChamadaTool] = {}
+    for chamada in lote:
+        if chamada.id in chamadas:
+            raise HTTPException(status_code=400, detail=f"id repetido no lote: {chamada.id}")
+        ferramenta = FERRAMENTAS.get(chamada.tool)
+        if ferramenta is None:
+            raise HTTPException(status_code=400, detail=f"Tool desconhecida: {chamada.tool}")
+        # O CNPJ nos parâmetros (formato antigo das tools) precisa ser o do lote
+        if "cnpj" in chamada.params:
+            if normalizar_cnpj(chamada.params.pop("cnpj")) not in (None, cnpj):
+                raise HTTPException(status_code=400, detail=f"Chamada {chamada.id} é de outra clínica")
+        if chamada.idempotency_key and not ferramenta.escrita:
+            raise HTTPException(status_code=400, detail=f"{chamada.tool} não aceita idempotency_key")
+        # Referências a outras chamadas são dependências implícitas
+        chamada.depends_on = list(dict.fromkeys(chamada.depends_on + _refs(chamada.params)))
+        if not _refs(chamada.params):
+            try:
+                ferramenta.parametros.model_validate(chamada.params)
+            except ValidationError as e:
+                erro = _erro_validacao(e)
+                raise HTTPException(status_code=422, detail=f"Chamada {chamada.id}: {erro.detail}")
+        chamadas[chamada.id] = chamada
+
+    for chamada in chamadas.values():
+        for dependencia in chamada.depends_on:
+            if dependencia not in chamadas:
+                raise HTTPException(status_code=400, detail=f"Chamada {chamada.id} depende de id inexistente: {dependencia}")
+
+    # Kahn: as chamadas saem na ordem em que podem começar
+    pendentes = {id_: len(c.depends_on) for id_, c in chamadas.items()}
+    dependentes: Dict[str, List[str]] = {id_: [] for id_ in chamadas}
+    for chamada in chamadas.values():
+        for dependencia in chamada.depends_on:
+            dependentes[dependencia].append(chamada.id)
+    prontas = [id_ for id_, n in pendentes.items() if n == 0]
+    ordem: List[ChamadaTool] = []
+    while prontas:
+        id_ = prontas.pop()
+        ordem.append(chamadas[id_])
+        for dependente in dependentes[id_]:
+            pendentes[dependente] -= 1
+            if pendentes[dependente] == 0:
+                prontas.append(dependente)
+    if len(ordem) != len(chamadas):
+        ciclo = sorted(id_ for id_, n in pendentes.items() if n)
+        raise HTTPException(status_code=400, detail=f"Dependências em ciclo: {', '.join(ciclo)}")
+    return ordem
+
+
+async def _executar(tenant, chamada: ChamadaTool, resultados: Dict[str, Any]) -> Dict:
+    ferramenta = FERRAMENTAS[chamada.tool]
+    resposta = {"id": chamada.id, "tool": chamada.tool}
+    try:
+        params = ferramenta.parametros.model_validate(_resolver(chamada.params, resultados))
+    except ValidationError as e:
+        erro = _erro_validacao(e)
+        return {**resposta, "ok": False, "status": erro.status_code, "erro": erro.detail}
+    except HTTPException as e:
+        return {**resposta, "ok": False, "status": e.status_code, "erro": e.detail}
+    try:
+        resultado = await executar_idempotente(
+            f"tools:{chamada.tool}:{tenant.cnpj}",
+            chamada.idempotency_key,
+            params.model_dump(mode="json"),
+            lambda: ferramenta.handler(tenant, params)
+        )
+    except HTTPException as e:
+        return {**resposta, "ok": False, "status": e.status_code, "erro": e.detail}
+    except Exception as e:
+        return {**resposta, "ok": False, "status": 500, "erro": str(e) or type(e).__name__}
+    return {**resposta, "ok": True, "resultado": resultado}
+
+
+async def executar_lote(tenant, lote: List[ChamadaTool]) -> List[Dict]:
+    """
+    Executa o lote da clínica ``tenant``. Cada chamada começa assim que as suas
+    dependências terminam com sucesso; se alguma falhar, a chamada não roda
+    (status 424). Os resultados seguem a ordem das chamadas no lote.
+    """
+    ordem = planejar(lote, tenant.cnpj)
+    resultados: Dict[str, Any] = {}
+    tarefas: Dict[str, asyncio.Task] = {}
+
+    async def rodar(chamada: ChamadaTool) -> Dict:
+        if chamada.depends_on:
+            anteriores = await asyncio.gather(*(tarefas[d] for d in chamada.depends_on))
+            falhas = [r["id"] for r in anteriores if not r["ok"]]
+            if falhas:
+                return {
+                    "id": chamada.id, "tool": chamada.tool, "ok": False, "status": 424,
+                    "erro": f"Dependência falhou: {', '.join(falhas)}"
+                }
+        resposta = await _executar(tenant, chamada, resultados)
+        if resposta["ok"]:
+            resultados[chamada.id] = resposta["resultado"]
+        return resposta
+
+    # A ordem topológica garante que as tarefas das dependências já existem
+    for chamada in ordem:
+        tarefas[chamada.id] = asyncio.ensure_future(rodar(chamada))
+    try:
+        await asyncio.gather(*tarefas.values())
+        return [tarefas[chamada.id].result() for chamada in lote]
+    finally:
+        for tarefa in tarefas.values():
+            tarefa.cancel()
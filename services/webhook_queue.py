@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from services.metrics import get_metricas
+
+logger = logging.getLogger(__name__)
+
+
+class _Janela:
+    """Contagem, soma, máximo e amostras recentes de uma duração."""
+
+    def __init__(self, tamanho: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recentes: Deque[float] = deque(maxlen=tamanho)
+
+    def observe(self, valor: float) -> None:
+        self.count += 1
+        self.total += valor
+        self.max = max(self.max, valor)
+        self._recentes.append(valor)
+
+    def percentil(self, p: float) -> float:
+        if not self._recentes:
+            return 0.0
+        ordenados = sorted(self._recentes)
+        return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentil(0.50),
+            "p95": self.percentil(0.95),
+            "max": self.max
+        }
+
+
+class WebhookQueue:
+    """
+    Fila limitada de mensagens drenada por um pool de workers assíncronos.
+
+    Mensagens com a mesma chave (número do WhatsApp) são processadas uma de
+    cada vez e na ordem de chegada; chaves diferentes rodam em paralelo.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int,
+        max_depth: int
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self._pendentes: Dict[str, Deque[tuple]] = {}
+        self._prontas: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._depth = 0
+        self._ativos = 0
+        self.aceitas = 0
+        self.rejeitadas = 0
+        self.falhas = 0
+        self.espera = _Janela()
+        self.processamento = _Janela()
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    async def start(self) -> None:
+        self._prontas = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"webhook-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        if self._prontas is not None and self._depth:
+            try:
+                await asyncio.wait_for(self._drenada(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Fila do webhook encerrada com %s mensagens pendentes", self._depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _drenada(self) -> None:
+        while self._depth or self._ativos:
+            await asyncio.sleep(0.05)
+
+    def enqueue(self, chave: str, item: Any) -> bool:
+        if self._prontas is None or self._depth >= self.max_depth:
+            self.rejeitadas += 1
+            return False
+
+        self._depth += 1
+        self.aceitas += 1
+        fila = self._pendentes.get(chave)
+        if fila is None:
+            self._pendentes[chave] = deque([(time.monotonic(), item)])
+            self._prontas.put_nowait(chave)
+        else:
+            # A chave já está na fila ou em processamento; o worker a reagenda
+            fila.append((time.monotonic(), item))
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            chave = await self._prontas.get()
+            fila = self._pendentes[chave]
+            enfileirado_em, item = fila.popleft()
+            self._depth -= 1
+            self._ativos += 1
+            inicio = time.monotonic()
+            self.espera.observe(inicio - enfileirado_em)
+            get_metricas().fila_espera.observe(inicio - enfileirado_em, "webhook")
+            try:
+                await self.handler(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.falhas += 1
+                logger.exception("Falha ao processar mensagem do webhook (%s)", chave)
+            finally:
+                self._ativos -= 1
+                duracao = time.monotonic() - inicio
+                self.processamento.observe(duracao)
+                get_metricas().fila_processamento.observe(duracao, "webhook")
+                if fila:
+                    self._prontas.put_nowait(chave)
+                else:
+                    del self._pendentes[chave]
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "depth": self._depth,
+            "max_depth": self.max_depth,
+            "active": self._ativos,
+            "accepted": self.aceitas,
+            "rejected": self.rejeitadas,
+            "failed": self.falhas,
+            "wait_seconds": self.espera.snapshot(),
+            "processing_seconds": self.processamento.snapshot()
+        }
+
+
+_queue: Optional[WebhookQueue] = None
+
+
+async def init_webhook_queue(handler: Callable[[Any], Awaitable[None]], workers: int, max_depth: int) -> WebhookQueue:
+    global _queue
+    _queue = WebhookQueue(handler, workers=workers, max_depth=max_depth)
+    await _queue.start()
+    return _queue
+
+
+def get_webhook_queue() -> Optional[WebhookQueue]:
+    return _queue
+
+
+async def close_webhook_queue(drain_timeout: float = 10.0) -> None:
+    global _queue
+    if _queue is not None:
+        await _queue.stop(drain_timeout)
+        _queue = None
@@ -1,131 +1,53 @@
 import axios from 'axios';
 
-const API_BASE_URL = 'https://mcp-clinica-nas-nuvens.onrender.com/api/v1';
+const API_URL = 'https://mcp-clinica-nas-nuvens.onrender.com/api';
 
-interface Tool {
-  name: string;
-  description: string;
-  parameters: Record<string, {
-    type: string;
-    required: boolean;
-    description?: string;
-  }>;
-  execute: (params: any) => Promise<any>;
-}
+// A clínica vem da configuração deste processo, nunca dos parâmetros gerados
+// pelo LLM (o manifesto das tools não tem cnpj). Com CLINICA_API_KEY a API
+// resolve a clínica pelo mapeamento TENANT_API_KEYS.
+const CLINICA_CNPJ = process.env.CLINICA_CNPJ;
+const CLINICA_API_KEY = process.env.CLINICA_API_KEY;
 
-const tools: Tool[] = [
-  {
-    name: "listar_pacientes",
-    description: "Lista todos os pacientes da clínica",
-    parameters: {
-      cnpj: {
-        type: "string",
-        required: true,
-        description: "CNPJ da clínica"
-      },
-      nome: {
-        type: "string",
-        required: false,
-        description: "Filtro por nome do paciente"
-      },
-      cpf: {
-        type: "string",
-        required: false,
-        description: "Filtro por CPF do paciente"
-      }
-    },
-    execute: async (params) => {
-      const response = await axios.get(`${API_BASE_URL}/pacientes`, { params });
-      return response.data;
-    }
-  },
-  {
-    name: "criar_paciente",
-    description: "Cria um novo paciente na clínica",
-    parameters: {
-      cnpj: {
-        type: "string",
-        required: true,
-        description: "CNPJ da clínica"
-      },
-      nome: {
-        type: "string",
-        required: true,
-        description: "Nome do paciente"
-      },
-      cpf: {
-        type: "string",
-        required: true,
-        description: "CPF do paciente"
-      },
-      data_nascimento: {
-        type: "string",
-        required: true,
-        description: "Data de nascimento (YYYY-MM-DD)"
-      },
-      telefone: {
-        type: "string",
-        required: true,
-        description: "Telefone do paciente"
-      },
-      email: {
-        type: "string",
-        required: true,
-        description: "Email do paciente"
-      }
-    },
-    execute: async (params) => {
-      const response = await axios.post(`${API_BASE_URL}/pacientes`, params);
-      return response.data;
-    }
-  },
-  {
-    name: "listar_executores",
-    description: "Lista todos os médicos/executores disponíveis",
-    parameters: {
-      cnpj: {
-        type: "string",
-        required: true,
-        description: "CNPJ da clínica"
-      },
-      id_especialidade: {
-        type: "number",
-        required: false,
-        description: "ID da especialidade"
-      },
-      id_tipo_convenio: {
-        type: "number",
-        required: false,
-        description: "ID do tipo de convênio"
-      }
-    },
-    execute: async (params) => {
-      const response = await axios.get(`${API_BASE_URL}/executores`, { params });
-      return response.data;
-    }
+function tenantHeaders(): Record<string, string> {
+  const headers: Record<string, string> = {};
+  if (CLINICA_API_KEY) {
+    headers['X-API-Key'] = CLINICA_API_KEY;
   }
-];
+  return headers;
+}
 
-// Função para listar as tools disponíveis
+interface ToolCall {
+  id: string;
+  tool: string;
+  params?: Record<string, any>;
+  depends_on?: string[];
+  idempotency_key?: string;
+}
+
+// As tools (nomes, descrições e parâmetros) vêm do registro da API
 async function listTools() {
-  return { tools: tools.map(({ name, description, parameters }) => ({ name, description, parameters })) };
+  const response = await axios.get(`${API_URL}/tools`);
+  return response.data;
+}
+
+// Várias tools numa única requisição: a API executa as independentes em paralelo
+async function executeTools(calls: ToolCall[], cnpj: string | undefined = CLINICA_CNPJ) {
+  const response = await axios.post(
+    `${API_URL}/tools/execute`,
+    { cnpj, calls },
+    { headers: tenantHeaders() }
+  );
+  return response.data.results;
 }
 
 // Função para executar uma tool
 async function executeTool(toolName: string, parameters: any) {
-  const tool = tools.find(t => t.name === toolName);
-  if (!tool) {
-    throw new Error(`Tool '${toolName}' not found`);
+  const [result] = await executeTools([{ id: '1', tool: toolName, params: parameters || {} }]);
+  if (!result.ok) {
+    const erro = typeof result.erro === 'string' ? result.erro : JSON.stringify(result.erro);
+    throw new Error(erro);
   }
-
-  // Validar parâmetros obrigatórios
-  for (const [key, param] of Object.entries(tool.parameters)) {
-    if (param.required && !parameters[key]) {
-      throw new Error(`Missing required parameter: ${key}`);
-    }
-  }
-
-  return await tool.execute(parameters);
+  return result.resultado;
 }
 
 // Processar entrada e saída padrão
@@ -147,6 +69,9 @@ process.stdin.on('data', async (chunk) => {
         response = await listTools();
       } else if (request.type === 'executeTool') {
         response = await executeTool(request.tool, request.parameters);
+      } else if (request.type === 'executeTools') {
+        // O host (não o LLM) pode indicar outra clínica em request.cnpj
+        response = await executeTools(request.calls, request.cnpj);
       } else {
         throw new Error(`Unknown request type: ${request.type}`);
       }
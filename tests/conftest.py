@@ -0,0 +1,17 @@
+import os
+import sys
+from pathlib import Path
+
+# As configurações são lidas na importação dos serviços: valores fictícios,
+# nenhum teste acessa as APIs externas
+for nome, valor in {
+    "SUPABASE_URL": "http://supabase.invalid",
+    "SUPABASE_KEY": "chave-de-teste",
+    "EVOLUTION_API_URL": "http://evolution.invalid",
+    "EVOLUTION_API_KEY": "chave-de-teste",
+    "MCP_SERVER_URL": "http://mcp.invalid",
+    "MCP_API_KEY": "chave-de-teste",
+}.items():
+    os.environ.setdefault(nome, valor)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
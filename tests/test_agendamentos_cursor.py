@@ -0,0 +1,97 @@
+import asyncio
+from datetime import date, timedelta
+import pytest
+from services import agendamentos_paginados
+from services.agendamentos_paginados import (
+    CursorInvalido,
+    FiltroAgendamentos,
+    _Posicao,
+    codificar_cursor,
+    decodificar_cursor,
+    iterar_agendamentos,
+    listar_pagina,
+)
+
+POR_PAGINA = 3
+
+
+class CNNFalsa:
+    """Devolve dois agendamentos por dia, paginados como a CNN (``totalPaginas``)."""
+
+    def __init__(self, inicio: date, fim: date):
+        self.agendamentos = []
+        dia = inicio
+        while dia <= fim:
+            for n in range(2):
+                self.agendamentos.append({
+                    "id": len(self.agendamentos) + 1,
+                    "data": dia.isoformat(),
+                    "status": "AGENDADO" if n == 0 else "CANCELADO",
+                })
+            dia += timedelta(days=1)
+        self.chamadas = 0
+
+    async def get_agendamentos(self, codigo_paciente, data_inicial, data_final, data_por, pagina):
+        self.chamadas += 1
+        itens = [a for a in self.agendamentos if data_inicial <= a["data"] <= data_final]
+        total = max(1, -(-len(itens) // POR_PAGINA))
+        return {"lista": itens[pagina * POR_PAGINA:(pagina + 1) * POR_PAGINA], "totalPaginas": total}
+
+
+@pytest.fixture(autouse=True)
+def trechos_de_tres_dias(monkeypatch):
+    monkeypatch.setattr(agendamentos_paginados.settings, "AGENDAMENTOS_CHUNK_DIAS", 3)
+
+
+def test_cursor_ida_e_volta():
+    filtro = FiltroAgendamentos(codigo_paciente=7, status="confirmado,agendado")
+    posicao = _Posicao(date(2024, 3, 1), date(2024, 3, 31), pagina=2, offset=1)
+    lida = decodificar_cursor(codificar_cursor(posicao, filtro), filtro)
+    assert (lida.inicio, lida.fim, lida.pagina, lida.offset) == (date(2024, 3, 1), date(2024, 3, 31), 2, 1)
+
+
+def test_cursor_recusa_outros_filtros():
+    cursor = codificar_cursor(_Posicao(date(2024, 3, 1), date(2024, 3, 31)), FiltroAgendamentos(status="AGENDADO"))
+    with pytest.raises(CursorInvalido):
+        decodificar_cursor(cursor, FiltroAgendamentos(status="CANCELADO"))
+
+
+@pytest.mark.parametrize("cursor", ["", "nao-e-base64!", "eyJpIjoxfQ"])
+def test_cursor_invalido(cursor):
+    with pytest.raises(CursorInvalido):
+        decodificar_cursor(cursor, FiltroAgendamentos())
+
+
+@pytest.mark.parametrize("limite", [1, 2, 4, 7])
+def test_paginas_cobrem_o_periodo_sem_repetir(limite):
+    inicio, fim = date(2024, 3, 1), date(2024, 3, 10)
+    cnn = CNNFalsa(inicio, fim)
+    filtro = FiltroAgendamentos(status="AGENDADO")
+
+    async def percorrer():
+        ids, cursor = [], None
+        while True:
+            if cursor:
+                pagina = await listar_pagina(cnn, filtro, limite, cursor=cursor)
+            else:
+                pagina = await listar_pagina(cnn, filtro, limite, inicio.isoformat(), fim.isoformat())
+            assert len(pagina["lista"]) <= limite
+            ids.extend(item["id"] for item in pagina["lista"])
+            cursor = pagina["proximo_cursor"]
+            if cursor is None:
+                return ids
+
+    esperados = [a["id"] for a in cnn.agendamentos if a["status"] == "AGENDADO"]
+    assert asyncio.run(percorrer()) == esperados
+
+
+def test_stream_entrega_o_mesmo_que_as_paginas():
+    inicio, fim = date(2024, 3, 1), date(2024, 3, 10)
+    cnn = CNNFalsa(inicio, fim)
+    filtro = FiltroAgendamentos(status="AGENDADO")
+
+    async def consumir():
+        itens = await iterar_agendamentos(cnn, filtro, inicio.isoformat(), fim.isoformat())
+        return [item["id"] async for item in itens]
+
+    assert asyncio.run(consumir()) == [a["id"] for a in cnn.agendamentos if a["status"] == "AGENDADO"]
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from services import busca_disponibilidade
+from services.busca_disponibilidade import buscar_horarios
+from services.erros import ErroUpstream
+
+
+class CNNFalsa:
+    cid = "cid-busca"
+
+    def __init__(self, agendas):
+        # id do executor -> lista de horários ou exceção
+        self.agendas = agendas
+
+    async def get_executores_agenda(self, id_especialidade=None, id_tipo_convenio=None):
+        return {"lista": [{"id": i, "nome": f"Médico {i}"} for i in self.agendas]}
+
+    async def get_disponibilidade_executor(self, id_executor, cod_tipo_atendimento, data_inicio, data_fim):
+        agenda = self.agendas[id_executor]
+        if isinstance(agenda, Exception):
+            raise agenda
+        if agenda == "lento":
+            await asyncio.sleep(10)
+        return {"lista": agenda}
+
+
+def horario(hora):
+    return {"data": "2025-05-06", "horaInicio": hora}
+
+
+def buscar(agendas, **kwargs):
+    return asyncio.run(buscar_horarios(CNNFalsa(agendas), 1, "2025-05-06", "2025-05-06", **kwargs))
+
+
+def test_intercala_os_mais_cedo():
+    horarios, falhas = buscar({
+        1: [horario("08:00"), horario("10:00")],
+        2: [horario("09:00:00"), horario("11:00")],
+    }, limite=3)
+    assert [(h["idExecutor"], h["horaInicio"]) for h in horarios] == [(1, "08:00"), (2, "09:00:00"), (1, "10:00")]
+    assert falhas == []
+
+
+def test_falha_parcial_informa_os_executores(monkeypatch):
+    monkeypatch.setattr(busca_disponibilidade.settings, "FANOUT_TIMEOUT", 0.05)
+    horarios, falhas = buscar({1: [horario("08:00")], 2: RuntimeError("CNN fora"), 3: "lento"})
+    assert [h["idExecutor"] for h in horarios] == [1]
+    assert falhas == [2, 3]
+
+
+def test_todos_falham_vira_erro():
+    with pytest.raises(ErroUpstream) as erro:
+        buscar({1: ErroUpstream(502, "cnn respondeu 500", "cnn", codigo="falha_upstream")})
+    assert erro.value.status_code == 502
+
+
+def test_todos_com_timeout_vira_504(monkeypatch):
+    monkeypatch.setattr(busca_disponibilidade.settings, "FANOUT_TIMEOUT", 0.05)
+    with pytest.raises(ErroUpstream) as erro:
+        buscar({1: "lento", 2: "lento"})
+    assert erro.value.status_code == 504
+
+
+def test_sem_executores_nao_e_erro():
+    assert buscar({}) == ([], [])
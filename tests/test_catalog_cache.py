@@ -0,0 +1,145 @@
+import asyncio
+from services.catalog_cache import CatalogCache, normalizar
+
+ESPECIALIDADES = {"lista": [{"id": 1, "nome": "Cardiologia"}, {"id": 2, "nome": "Clínica Médica"}], "total": 2}
+
+
+class Loader:
+    def __init__(self, *respostas):
+        self.respostas = list(respostas)
+        self.chamadas = 0
+
+    async def __call__(self):
+        self.chamadas += 1
+        return self.respostas[min(self.chamadas, len(self.respostas)) - 1]
+
+
+def cache(**kwargs) -> CatalogCache:
+    parametros = dict(ttl=60.0, stale_ttl=30.0, refresh_ahead=0.8, max_entries=10)
+    parametros.update(kwargs)
+    return CatalogCache(**parametros)
+
+
+def envelhecer(c: CatalogCache, segundos: float) -> None:
+    for catalogo in c._entradas.values():
+        catalogo.carregado_em -= segundos
+
+
+async def pendentes(c: CatalogCache) -> None:
+    await asyncio.gather(*c._refreshes)
+
+
+def test_entrada_fresca_nao_chama_o_loader():
+    async def cenario():
+        c, loader = cache(), Loader(ESPECIALIDADES)
+        primeiro = await c.get("cid", "especialidades", (), loader)
+        segundo = await c.get("cid", "especialidades", (), loader)
+        return primeiro, segundo, loader.chamadas, c.stats()
+
+    primeiro, segundo, chamadas, stats = asyncio.run(cenario())
+    assert primeiro is segundo
+    assert chamadas == 1
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_perto_de_vencer_atualiza_em_background():
+    async def cenario():
+        c = cache()
+        novo = {"lista": [{"id": 3, "nome": "Dermatologia"}]}
+        loader = Loader(ESPECIALIDADES, novo)
+        await c.get("cid", "especialidades", (), loader)
+        envelhecer(c, 50)
+        servido = await c.get("cid", "especialidades", (), loader)
+        await pendentes(c)
+        atual = await c.get("cid", "especialidades", (), loader)
+        return servido.payload, atual.payload, c.stats()["refreshes"]
+
+    servido, atual, refreshes = asyncio.run(cenario())
+    assert servido == ESPECIALIDADES
+    assert atual["lista"][0]["nome"] == "Dermatologia"
+    assert refreshes == 1
+
+
+def test_vencida_e_servida_enquanto_revalida():
+    async def cenario():
+        c, loader = cache(), Loader(ESPECIALIDADES)
+        await c.get("cid", "especialidades", (), loader)
+        envelhecer(c, 70)
+        await c.get("cid", "especialidades", (), loader)
+        await pendentes(c)
+        return c.stats(), loader.chamadas
+
+    stats, chamadas = asyncio.run(cenario())
+    assert (stats["stale_hits"], stats["misses"]) == (1, 1)
+    assert chamadas == 2
+
+
+def test_vencida_alem_do_stale_ttl_busca_de_novo():
+    async def cenario():
+        c, loader = cache(), Loader(ESPECIALIDADES)
+        await c.get("cid", "especialidades", (), loader)
+        envelhecer(c, 100)
+        await c.get("cid", "especialidades", (), loader)
+        return c.stats()
+
+    stats = asyncio.run(cenario())
+    assert (stats["stale_hits"], stats["misses"]) == (0, 2)
+
+
+def test_descarta_as_menos_usadas():
+    async def cenario():
+        c = cache(max_entries=2)
+        for cid in ("a", "b"):
+            await c.get(cid, "especialidades", (), Loader(ESPECIALIDADES))
+        # "a" foi usada por último; "b" sai
+        await c.get("a", "especialidades", (), Loader(ESPECIALIDADES))
+        await c.get("c", "especialidades", (), Loader(ESPECIALIDADES))
+        return [chave[0] for chave in c._entradas], c.stats()["evictions"]
+
+    assert asyncio.run(cenario()) == (["a", "c"], 1)
+
+
+def test_resposta_de_erro_nao_fica_no_cache():
+    async def cenario():
+        c, loader = cache(), Loader({"erro": "indisponível"}, ESPECIALIDADES)
+        primeiro = await c.get("cid", "especialidades", (), loader)
+        segundo = await c.get("cid", "especialidades", (), loader)
+        return primeiro.payload, segundo.payload, loader.chamadas
+
+    assert asyncio.run(cenario()) == ({"erro": "indisponível"}, ESPECIALIDADES, 2)
+
+
+def test_filtro_ignora_acentos_e_maiusculas():
+    async def cenario():
+        c = cache()
+        catalogo = await c.get("cid", "especialidades", (), Loader(ESPECIALIDADES))
+        return catalogo.filtrar("CLINICA  medica"), catalogo.filtrar("")
+
+    filtrado, completo = asyncio.run(cenario())
+    assert filtrado == {"lista": [{"id": 2, "nome": "Clínica Médica"}], "total": 2}
+    assert completo == ESPECIALIDADES
+    assert normalizar("  Ótica ") == "otica"
+
+
+def test_executores_viram_registros_e_voltam_iguais():
+    executores = {"lista": [{"id": 7, "nome": "Dra. Ana", "idEspecialidade": 1, "crm": "123"}]}
+
+    async def cenario():
+        c = cache()
+        return await c.get("cid", "executores", (), Loader(executores))
+
+    catalogo = asyncio.run(cenario())
+    assert catalogo.registros is not None
+    assert catalogo.payload == executores
+    assert catalogo.filtrar("ana") == executores
+
+
+def test_invalidate_por_tipo():
+    async def cenario():
+        c = cache()
+        await c.get("cid", "especialidades", (), Loader(ESPECIALIDADES))
+        await c.get("cid", "tipos", (), Loader(ESPECIALIDADES))
+        c.invalidate("cid", "tipos")
+        return [chave[1] for chave in c._entradas]
+
+    assert asyncio.run(cenario()) == ["especialidades"]
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from services.catalog_cache import CatalogCache
+from services.clinica_cache import ClinicaCache
+from services.patient_index import PatientIndex, SQLitePatientBackend
+
+CNPJ = "30747815000108"
+CLINICA = {"cnpj": CNPJ, "clinica_cid": "cid-1", "api_key": "chave"}
+
+
+class Carga:
+    """Loader que fica parado até ``liberar`` e conta as chamadas."""
+
+    def __init__(self, resultado):
+        self.resultado = resultado
+        self.liberar = asyncio.Event()
+        self.chamadas = 0
+
+    async def __call__(self, *args):
+        self.chamadas += 1
+        await self.liberar.wait()
+        return self.resultado
+
+
+async def lider_cancelado(carregar, carga):
+    # O primeiro chamador é cancelado (cliente desconectou) com outro aguardando a mesma carga
+    lider = asyncio.create_task(carregar())
+    await asyncio.sleep(0)
+    seguidor = asyncio.create_task(carregar())
+    await asyncio.sleep(0)
+    lider.cancel()
+    await asyncio.sleep(0)
+    carga.liberar.set()
+    return lider, await seguidor
+
+
+def test_clinica_cache():
+    async def cenario():
+        carga = Carga(CLINICA)
+        cache = ClinicaCache(carga, ttl=60.0, negative_ttl=5.0, max_size=10)
+        lider, resultado = await lider_cancelado(lambda: cache.get(CNPJ), carga)
+        # A carga terminou e ficou no cache para as próximas leituras
+        assert (await cache.get(CNPJ)) is resultado
+        return lider, resultado, carga.chamadas, cache.stats()
+
+    lider, resultado, chamadas, stats = asyncio.run(cenario())
+    assert lider.cancelled()
+    assert resultado.clinica.cnpj == CNPJ
+    assert chamadas == 1
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 1, 1)
+
+
+def test_clinica_cache_invalidacao_durante_a_carga():
+    async def cenario():
+        carga = Carga(CLINICA)
+        cache = ClinicaCache(carga, ttl=60.0, negative_ttl=5.0, max_size=10)
+        pendente = asyncio.create_task(cache.get(CNPJ))
+        await asyncio.sleep(0)
+        cache.invalidate(CNPJ)
+        carga.liberar.set()
+        await pendente
+        return cache.stats()["size"]
+
+    assert asyncio.run(cenario()) == 0
+
+
+def test_catalog_cache():
+    async def cenario():
+        carga = Carga({"lista": [{"id": 1, "nome": "Cardiologia"}]})
+        cache = CatalogCache(ttl=60.0, stale_ttl=60.0, refresh_ahead=0.9)
+        lider, resultado = await lider_cancelado(lambda: cache.get("cid-1", "especialidades", (), carga), carga)
+        return lider, resultado, carga.chamadas, cache.stats()["entries"]
+
+    lider, resultado, chamadas, entradas = asyncio.run(cenario())
+    assert lider.cancelled()
+    assert resultado.payload == {"lista": [{"id": 1, "nome": "Cardiologia"}]}
+    assert (chamadas, entradas) == (1, 1)
+
+
+def test_patient_index(tmp_path):
+    async def cenario():
+        backend = SQLitePatientBackend(str(tmp_path / "pacientes.sqlite3"))
+        await backend.gravar("cid-1", [({"id": 1, "nome": "Maria", "cpfcnpj": "06286689966"}, time.time())], [])
+        carga = Carga(await backend.carregar("cid-1", 0.0))
+        backend.carregar = carga
+        indice = PatientIndex(backend=backend)
+        try:
+            lider, resultado = await lider_cancelado(lambda: indice.buscar_documento("cid-1", "062.866.899-66"), carga)
+        finally:
+            await indice.close()
+        return lider, resultado, carga.chamadas
+
+    lider, (pacientes, _), chamadas = asyncio.run(cenario())
+    assert lider.cancelled()
+    assert [p["id"] for p in pacientes] == [1]
+    assert chamadas == 1
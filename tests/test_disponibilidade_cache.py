@@ -0,0 +1,108 @@
+import asyncio
+from datetime import date, timedelta
+from services.disponibilidade_cache import DisponibilidadeCache
+
+
+class Loader:
+    """Devolve um horário por dia da faixa pedida e registra as faixas."""
+
+    def __init__(self, liberar: asyncio.Event = None):
+        self.faixas = []
+        self.liberar = liberar
+
+    async def __call__(self, inicio: str, fim: str):
+        self.faixas.append((inicio, fim))
+        if self.liberar is not None:
+            await self.liberar.wait()
+        dia, ultimo = date.fromisoformat(inicio), date.fromisoformat(fim)
+        horarios = []
+        while dia <= ultimo:
+            horarios.append({"data": dia.isoformat(), "horaInicio": "08:00", "horaFim": "08:30", "sala": 1})
+            dia += timedelta(days=1)
+        return horarios
+
+
+def buscar(cache, loader, inicio, fim, cid="cid"):
+    return cache.get(cid, 7, 1, inicio, fim, loader)
+
+
+def test_faixa_sobreposta_busca_so_os_dias_faltantes():
+    async def cenario():
+        cache, loader = DisponibilidadeCache(ttl=60.0, max_entries=100), Loader()
+        primeira = await buscar(cache, loader, "2024-05-01", "2024-05-03")
+        segunda = await buscar(cache, loader, "2024-05-02", "2024-05-05")
+        return primeira, segunda, loader.faixas, cache.stats()
+
+    primeira, segunda, faixas, stats = asyncio.run(cenario())
+    assert faixas == [("2024-05-01", "2024-05-03"), ("2024-05-04", "2024-05-05")]
+    assert [h["data"] for h in segunda] == ["2024-05-02", "2024-05-03", "2024-05-04", "2024-05-05"]
+    # Os horários saem do cache como vieram da CNN
+    assert primeira[0] == {"data": "2024-05-01", "horaInicio": "08:00", "horaFim": "08:30", "sala": 1}
+    assert (stats["day_hits"], stats["day_misses"], stats["upstream_calls"]) == (2, 5, 2)
+
+
+def test_invalidar_dia_remove_so_aquele_dia():
+    async def cenario():
+        cache, loader = DisponibilidadeCache(ttl=60.0, max_entries=100), Loader()
+        await buscar(cache, loader, "2024-05-01", "2024-05-03")
+        cache.invalidar_dia("cid", "2024-05-02T10:00:00")
+        await buscar(cache, loader, "2024-05-01", "2024-05-03")
+        return loader.faixas
+
+    assert asyncio.run(cenario())[1:] == [("2024-05-02", "2024-05-02")]
+
+
+def test_invalidacao_durante_a_busca_descarta_o_resultado():
+    async def cenario():
+        cache = DisponibilidadeCache(ttl=60.0, max_entries=100)
+        lento = Loader(asyncio.Event())
+        pendente = asyncio.create_task(buscar(cache, lento, "2024-05-01", "2024-05-01"))
+        await asyncio.sleep(0)
+        # Um agendamento criado enquanto a busca estava em andamento
+        cache.invalidar_dia("cid", "2024-05-01")
+        lento.liberar.set()
+        resultado = await pendente
+        return resultado, cache.stats()["entries"]
+
+    resultado, entradas = asyncio.run(cenario())
+    assert len(resultado) == 1
+    assert entradas == 0
+
+
+def test_invalidar_clinica_nao_afeta_outras():
+    async def cenario():
+        cache, loader = DisponibilidadeCache(ttl=60.0, max_entries=100), Loader()
+        await buscar(cache, loader, "2024-05-01", "2024-05-02", cid="a")
+        await buscar(cache, loader, "2024-05-01", "2024-05-02", cid="b")
+        cache.invalidar_clinica("a")
+        return {chave[0] for chave in cache._entradas}
+
+    assert asyncio.run(cenario()) == {"b"}
+
+
+def test_envelope_e_resposta_inesperada():
+    async def envelope(inicio, fim):
+        return {"lista": [{"data": inicio, "horaInicio": "09:00"}], "total": 1}
+
+    async def erro(inicio, fim):
+        return {"erro": "indisponível"}
+
+    async def cenario():
+        cache = DisponibilidadeCache(ttl=60.0, max_entries=100)
+        com_envelope = await cache.get("cid", 1, 1, "2024-05-01", "2024-05-01", envelope)
+        com_erro = await cache.get("cid", 2, 1, "2024-05-01", "2024-05-01", erro)
+        return com_envelope, com_erro, cache.stats()["entries"]
+
+    com_envelope, com_erro, entradas = asyncio.run(cenario())
+    assert com_envelope == {"lista": [{"data": "2024-05-01", "horaInicio": "09:00"}], "total": 1}
+    assert com_erro == {"erro": "indisponível"}
+    assert entradas == 1
+
+
+def test_faixa_longa_vai_direto_ao_upstream():
+    async def cenario():
+        cache, loader = DisponibilidadeCache(ttl=60.0, max_entries=100), Loader()
+        await buscar(cache, loader, "2024-01-01", "2024-06-30")
+        return loader.faixas, cache.stats()["entries"]
+
+    assert asyncio.run(cenario()) == ([("2024-01-01", "2024-06-30")], 0)
@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from services import idempotency
+from services.erros import ErroUpstream
+from services.idempotency import MemoryIdempotencyStore, SQLiteIdempotencyStore, executar_idempotente
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        store = SQLiteIdempotencyStore(str(tmp_path / "idempotency.sqlite3"), ttl=60.0, pending_ttl=60.0)
+    else:
+        store = MemoryIdempotencyStore(ttl=60.0, pending_ttl=60.0, max_entries=100)
+    monkeypatch.setattr(idempotency, "_store", store)
+    yield store
+    asyncio.run(store.close())
+
+
+def operacao(resultado, chamadas):
+    async def executar():
+        chamadas.append(resultado)
+        return resultado
+    return executar
+
+
+def test_repeticao_devolve_a_resposta_guardada(store):
+    chamadas = []
+
+    async def cenario():
+        primeira = await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 1}, chamadas))
+        segunda = await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 2}, chamadas))
+        return primeira, segunda
+
+    assert asyncio.run(cenario()) == ({"id": 1}, {"id": 1})
+    assert chamadas == [{"id": 1}]
+
+
+def test_mesma_chave_com_outro_conteudo_da_422(store):
+    chamadas = []
+
+    async def cenario():
+        await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 1}, chamadas))
+        await executar_idempotente("agendamentos", "k1", {"a": 2}, operacao({"id": 2}, chamadas))
+
+    with pytest.raises(HTTPException) as erro:
+        asyncio.run(cenario())
+    assert erro.value.status_code == 422
+    assert chamadas == [{"id": 1}]
+
+
+def test_requisicao_em_andamento_da_409(store):
+    async def cenario():
+        liberar = asyncio.Event()
+
+        async def lenta():
+            await liberar.wait()
+            return {"id": 1}
+
+        primeira = asyncio.create_task(executar_idempotente("agendamentos", "k1", {"a": 1}, lenta))
+        await asyncio.sleep(0.05)
+        try:
+            with pytest.raises(HTTPException) as erro:
+                await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 2}, []))
+        finally:
+            liberar.set()
+        return erro.value.status_code, await primeira
+
+    assert asyncio.run(cenario()) == (409, {"id": 1})
+
+
+def test_validacao_local_libera_a_chave(store):
+    async def falha():
+        raise HTTPException(status_code=400, detail="Data inválida")
+
+    async def cenario():
+        with pytest.raises(HTTPException):
+            await executar_idempotente("agendamentos", "k1", {"a": 1}, falha)
+        return await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 1}, []))
+
+    assert asyncio.run(cenario()) == {"id": 1}
+
+
+def test_escopos_diferentes_nao_colidem(store):
+    async def cenario():
+        a = await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 1}, []))
+        b = await executar_idempotente("pacientes", "k1", {"b": 2}, operacao({"id": 2}, []))
+        return a, b
+
+    assert asyncio.run(cenario()) == ({"id": 1}, {"id": 2})
+
+
+def falha_com(erro):
+    chamadas = []
+
+    async def executar():
+        chamadas.append(1)
+        raise erro
+    executar.chamadas = chamadas
+    return executar
+
+
+def test_erro_antes_do_envio_libera_a_chave(store):
+    antes = falha_com(ErroUpstream(503, "cnn indisponível", "cnn", codigo="circuito_aberto"))
+
+    async def cenario():
+        with pytest.raises(ErroUpstream):
+            await executar_idempotente("agendamentos", "k1", {"a": 1}, antes)
+        return await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 1}, []))
+
+    assert asyncio.run(cenario()) == {"id": 1}
+
+
+def test_recusa_da_cnn_libera_a_chave(store):
+    recusa = falha_com(ErroUpstream(422, "CPF inválido", "cnn", codigo="requisicao_recusada", upstream_status=422))
+
+    async def cenario():
+        with pytest.raises(ErroUpstream):
+            await executar_idempotente("pacientes", "k1", {"a": 1}, recusa)
+        return await executar_idempotente("pacientes", "k1", {"a": 1}, operacao({"id": 1}, []))
+
+    assert asyncio.run(cenario()) == {"id": 1}
+
+
+@pytest.mark.parametrize("erro", [
+    ErroUpstream(504, "Tempo esgotado ao chamar cnn", "cnn", codigo="timeout_upstream"),
+    ErroUpstream(502, "Falha de conexão com cnn", "cnn", codigo="conexao_upstream"),
+    asyncio.CancelledError(),
+])
+def test_resultado_incerto_nao_repete_a_operacao(store, erro):
+    chamadas = []
+
+    async def cenario():
+        with pytest.raises(BaseException):
+            await executar_idempotente("agendamentos", "k1", {"a": 1}, falha_com(erro))
+        with pytest.raises(HTTPException) as repetido:
+            await executar_idempotente("agendamentos", "k1", {"a": 1}, operacao({"id": 1}, chamadas))
+        return repetido.value
+
+    repetido = asyncio.run(cenario())
+    assert chamadas == []
+    if isinstance(erro, HTTPException):
+        assert (repetido.status_code, repetido.detail) == (erro.status_code, erro.detail)
+    else:
+        assert repetido.status_code == 500
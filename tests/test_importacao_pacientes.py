@@ -0,0 +1,64 @@
+import asyncio
+import json
+from services.importacao_pacientes import importar_pacientes
+
+
+class CNNFalsa:
+    def __init__(self):
+        self.pacientes = {}
+        self.criacoes = 0
+
+    async def get_paciente(self, cpf_cnpj):
+        await asyncio.sleep(0.01)
+        paciente = self.pacientes.get(cpf_cnpj)
+        return {"lista": [paciente] if paciente else []}
+
+    async def criar_paciente(self, dados):
+        await asyncio.sleep(0.01)
+        self.criacoes += 1
+        paciente = self.pacientes[dados["cpfcnpj"]] = {**dados, "id": 100 + self.criacoes}
+        return paciente
+
+    async def get_convenios_paciente(self, id_paciente):
+        return {"lista": []}
+
+    async def associar_convenio(self, id_paciente, id_tipo_convenio):
+        return {}
+
+
+def linha(numero, cpf):
+    return numero, {"nome": f"Paciente {numero}", "cpf": cpf, "data_nascimento": "1990-01-01", "telefone": "47999990000"}, None
+
+
+async def gerar(linhas):
+    for item in linhas:
+        yield item
+
+
+def importar(cnn, linhas, **kwargs):
+    async def consumir():
+        return [r async for r in importar_pacientes(cnn, gerar(linhas), **kwargs)]
+    return asyncio.run(consumir())
+
+
+def test_mesmo_cpf_no_arquivo_cria_um_paciente():
+    cnn = CNNFalsa()
+    resultados = importar(cnn, [linha(2, "111.111.111-11"), linha(3, "11111111111"), linha(4, "22222222222")], concorrencia=8)
+    status = {r["linha"]: r["status"] for r in resultados if "linha" in r}
+    assert cnn.criacoes == 2
+    assert sorted(status.values()) == ["criado", "criado", "existente"]
+    assert resultados[-1]["resumo"]["linhas"] == 3
+
+
+def test_checkpoint_pula_linhas_concluidas(tmp_path):
+    caminho = str(tmp_path / "importacao.checkpoint.jsonl")
+    cnn = CNNFalsa()
+    importar(cnn, [linha(2, "11111111111"), (3, None, "JSON inválido")], checkpoint=caminho)
+    with open(caminho, encoding="utf-8") as arquivo:
+        gravados = sorted(json.loads(texto)["linha"] for texto in arquivo)
+    assert gravados == [2, 3]
+
+    resultados = importar(cnn, [linha(2, "11111111111"), (3, None, "JSON inválido"), linha(4, "22222222222")], checkpoint=caminho)
+    assert [r["linha"] for r in resultados if "linha" in r] == [4]
+    assert resultados[-1]["resumo"]["pulada"] == 2
+    assert cnn.criacoes == 2
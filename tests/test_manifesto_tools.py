@@ -0,0 +1,50 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+from services.tool_registry import Manifesto, get_manifesto, manifesto
+
+
+@pytest.fixture(scope="module")
+def client():
+    from main import app
+    return TestClient(app)
+
+
+def test_etag_muda_com_o_conteudo():
+    um = Manifesto([{"name": "a"}])
+    assert um.etag == Manifesto([{"name": "a"}]).etag
+    assert um.etag != Manifesto([{"name": "b"}]).etag
+    assert json.loads(um.corpo) == {"tools": [{"name": "a"}]}
+
+
+@pytest.mark.parametrize("if_none_match, corresponde", [
+    (None, False),
+    ("", False),
+    ('"outra"', False),
+    ("*", True),
+    ("{etag}", True),
+    ('W/{etag}', True),
+    ('"outra", {etag}', True),
+])
+def test_if_none_match(if_none_match, corresponde):
+    atual = Manifesto([{"name": "a"}])
+    if if_none_match:
+        if_none_match = if_none_match.format(etag=atual.etag)
+    assert atual.corresponde(if_none_match) is corresponde
+
+
+def test_rota_devolve_304_para_a_versao_atual(client):
+    primeira = client.get("/api/tools")
+    assert primeira.status_code == 200
+    assert primeira.json() == {"tools": manifesto()}
+    etag = primeira.headers["etag"]
+    assert etag == get_manifesto().etag
+    assert "max-age=" in primeira.headers["cache-control"]
+
+    revalidada = client.get("/api/tools", headers={"If-None-Match": etag})
+    assert revalidada.status_code == 304
+    assert revalidada.content == b""
+    assert revalidada.headers["etag"] == etag
+
+    antiga = client.get("/api/tools", headers={"If-None-Match": '"antiga"'})
+    assert antiga.status_code == 200
@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from services import metrics
+from services.erros import ErroUpstream
+from services.metrics import Contador, Histograma, Metricas, instrumentar, metricas_da_clinica
+
+
+@pytest.fixture
+def metricas(monkeypatch):
+    novas = Metricas()
+    monkeypatch.setattr(metrics, "_metricas", novas)
+    return novas
+
+
+def test_histograma_cumulativo():
+    histograma = Histograma("latencia_seconds", "Latência", ("rota",), buckets=(0.1, 1.0))
+    for valor in (0.05, 0.5, 0.7, 3.0):
+        histograma.observe(valor, "/a")
+    assert histograma.exportar() == [
+        "# HELP latencia_seconds Latência",
+        "# TYPE latencia_seconds histogram",
+        'latencia_seconds_bucket{rota="/a",le="0.1"} 1',
+        'latencia_seconds_bucket{rota="/a",le="1"} 3',
+        'latencia_seconds_bucket{rota="/a",le="+Inf"} 4',
+        'latencia_seconds_sum{rota="/a"} 4.25',
+        'latencia_seconds_count{rota="/a"} 4',
+    ]
+
+
+def test_contador_escapa_rotulos():
+    contador = Contador("erros_total", "Erros", ("detalhe",))
+    contador.inc('aspas "e"\nquebra')
+    contador.inc('aspas "e"\nquebra', quantidade=2)
+    assert contador.exportar()[-1] == 'erros_total{detalhe="aspas \\"e\\"\\nquebra"} 3'
+
+
+class Servico:
+    async def buscar(self, falhar=False):
+        await self._enviar(503 if falhar else 200)
+        return "ok"
+
+    async def _enviar(self, status):
+        if status >= 500:
+            raise ErroUpstream(502, "Falha", "teste", codigo="erro_upstream", upstream_status=status)
+        return type("Resposta", (), {"status_code": status})()
+
+
+def test_instrumentar_conta_operacoes_e_respostas_por_clinica(metricas):
+    instrumentar(Servico, "teste", transporte="_enviar")
+
+    async def cenario():
+        servico = Servico()
+        with metricas_da_clinica("30747815000108"):
+            await servico.buscar()
+            with pytest.raises(ErroUpstream):
+                await servico.buscar(falhar=True)
+
+    asyncio.run(cenario())
+    texto = metricas.exportar()
+    rotulos = 'upstream="teste",operation="buscar",clinic="30747815000108"'
+    assert f"upstream_operations_total{{{rotulos},result=\"ok\"}} 1" in texto
+    assert f"upstream_operations_total{{{rotulos},result=\"502\"}} 1" in texto
+    assert f"upstream_errors_total{{{rotulos},code=\"erro_upstream\"}} 1" in texto
+    # A requisição HTTP é atribuída à operação pública que a fez
+    assert f"upstream_http_responses_total{{{rotulos},status=\"200\"}} 1" in texto
+    assert f"upstream_http_responses_total{{{rotulos},status=\"503\"}} 1" in texto
+    assert f"upstream_operation_duration_seconds_count{{{rotulos}}} 2" in texto
+    # Instrumentar de novo não envolve os métodos duas vezes
+    assert instrumentar(Servico, "teste", transporte="_enviar") is Servico
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from services import outbound_dispatcher
+from services.erros import ErroUpstream
+from services.outbound_dispatcher import CONFIRMACAO, INTERATIVA, LEMBRETE, OutboundDispatcher
+
+
+class EvolutionFalsa:
+    """Registra os envios; ``falhas`` é consumida na ordem, uma por chamada."""
+
+    def __init__(self, falhas=()):
+        self.falhas = list(falhas)
+        self.envios = []
+
+    async def send_message(self, numero, texto):
+        self.envios.append((numero, texto))
+        if self.falhas:
+            raise self.falhas.pop(0)
+        return {"key": {"id": f"msg-{len(self.envios)}"}, "status": "PENDING"}
+
+    async def get_message_status(self, id_mensagem):
+        return {"status": "DELIVERED"}
+
+
+@pytest.fixture(autouse=True)
+def configuracao(monkeypatch):
+    monkeypatch.setattr(outbound_dispatcher.settings, "EVOLUTION_SEND_WORKERS", 1)
+    monkeypatch.setattr(outbound_dispatcher.settings, "EVOLUTION_STATUS_INTERVAL", 3600.0)
+    monkeypatch.setattr(outbound_dispatcher.settings, "RETRY_BASE_DELAY", 0.001)
+
+
+def ordem_de_saida(despachante):
+    saida = []
+    while (envio := despachante._proximo()) is not None:
+        saida.append((envio.numero, envio.texto))
+        despachante._liberar(envio.numero)
+    return saida
+
+
+def test_prioridade_entre_numeros_e_fifo_por_numero():
+    async def cenario():
+        despachante = OutboundDispatcher(EvolutionFalsa())
+        despachante._aberto = True
+        despachante.enviar("a", "lembrete", LEMBRETE)
+        despachante.enviar("b", "confirmacao", CONFIRMACAO)
+        despachante.enviar("c", "resposta 1", INTERATIVA)
+        despachante.enviar("c", "resposta 2", INTERATIVA)
+        return ordem_de_saida(despachante)
+
+    assert asyncio.run(cenario()) == [
+        ("c", "resposta 1"), ("c", "resposta 2"), ("b", "confirmacao"), ("a", "lembrete")
+    ]
+
+
+def test_numero_herda_a_prioridade_da_mensagem_interativa():
+    async def cenario():
+        despachante = OutboundDispatcher(EvolutionFalsa())
+        despachante._aberto = True
+        despachante.enviar("a", "lembrete", LEMBRETE)
+        despachante.enviar("b", "confirmacao", CONFIRMACAO)
+        # A resposta do número "a" sobe o número inteiro, mas continua atrás do lembrete dele
+        despachante.enviar("a", "resposta", INTERATIVA)
+        return ordem_de_saida(despachante)
+
+    assert asyncio.run(cenario()) == [("a", "lembrete"), ("a", "resposta"), ("b", "confirmacao")]
+
+
+def test_worker_ocioso_nao_consome_tokens():
+    async def cenario():
+        despachante = OutboundDispatcher(EvolutionFalsa())
+        await despachante.start()
+        await asyncio.sleep(0.01)
+        tokens = (despachante._global.tokens, despachante._instancia.tokens)
+        await despachante.stop()
+        return despachante, tokens
+
+    despachante, tokens = asyncio.run(cenario())
+    assert tokens == (despachante._global.capacidade, despachante._instancia.capacidade)
+
+
+async def enviar_com(falhas):
+    evolution = EvolutionFalsa(falhas)
+    despachante = OutboundDispatcher(evolution)
+    await despachante.start()
+    try:
+        resultado = await asyncio.wait_for(despachante.enviar("5547999990000", "oi"), 5)
+    except ErroUpstream as e:
+        resultado = e
+    await despachante.stop()
+    return evolution.envios, resultado, despachante.retentativas
+
+
+@pytest.mark.parametrize("erro", [
+    ErroUpstream(502, "Conexão recusada", "evolution", codigo="conexao_recusada"),
+    ErroUpstream(504, "Timeout de conexão", "evolution", codigo="timeout_conexao"),
+    ErroUpstream(503, "Circuito aberto", "evolution", codigo="circuito_aberto"),
+    ErroUpstream(502, "Indisponível", "evolution", codigo="erro_upstream", upstream_status=503),
+    ErroUpstream(429, "Limite", "evolution", codigo="limite_upstream", retry_after=0.01),
+])
+def test_reenvia_quando_a_mensagem_nao_foi_aceita(erro):
+    envios, resultado, retentativas = asyncio.run(enviar_com([erro]))
+    assert len(envios) == 2
+    assert resultado["key"]["id"] == "msg-2"
+    assert retentativas == 1
+
+
+@pytest.mark.parametrize("erro", [
+    ErroUpstream(502, "Conexão perdida", "evolution", codigo="conexao_upstream"),
+    ErroUpstream(504, "Timeout", "evolution", codigo="timeout_upstream"),
+    ErroUpstream(400, "Número inválido", "evolution", upstream_status=400),
+])
+def test_nao_reenvia_quando_a_mensagem_pode_ter_sido_entregue(erro):
+    envios, resultado, retentativas = asyncio.run(enviar_com([erro]))
+    assert len(envios) == 1
+    assert resultado is erro
+    assert retentativas == 0
@@ -0,0 +1,101 @@
+import asyncio
+from services.patient_index import PatientIndex, SQLitePatientBackend, variantes_telefone
+
+PACIENTES = [
+    {"id": 1, "nome": "João da Silva", "cpfcnpj": "123.456.789-01", "contato": {"telefoneCelular": "(47) 99999-0001"}},
+    {"id": 2, "nome": "Maria Conceição", "cpfcnpj": "98765432100", "telefone": "4733330002"},
+    {"id": 3, "nome": "Ana Maria Souza", "cpfCnpj": "11122233344"},
+]
+
+
+def envelhecer(indice: PatientIndex, cid: str, segundos: float) -> None:
+    for registro in indice._clinicas[cid].registros.values():
+        registro.atualizado_em -= segundos
+
+
+def test_variantes_telefone():
+    assert variantes_telefone("554799990001@s.whatsapp.net") == {"+554799990001", "+5547999990001"}
+    assert variantes_telefone("(47) 99999-0001") == {"+5547999990001", "+554799990001"}
+    assert variantes_telefone("4733330002") == {"+554733330002"}
+    assert variantes_telefone("123") == set()
+
+
+def test_busca_por_documento_telefone_e_nome():
+    async def cenario():
+        indice = PatientIndex()
+        await indice.registrar("cid", PACIENTES)
+        return (
+            await indice.buscar_documento("cid", "12345678901"),
+            await indice.buscar_documento("cid", "111.222.333-44"),
+            # Sem o nono dígito, como chega pelo WhatsApp
+            await indice.buscar_telefone("cid", "554799990001"),
+            await indice.buscar_nome("cid", "MARIA"),
+            await indice.buscar_nome("cid", "conceicao"),
+            await indice.buscar_documento("outra", "12345678901"),
+        )
+
+    documento, cpf_alternativo, telefone, maria, conceicao, outra_clinica = asyncio.run(cenario())
+    assert documento == ([PACIENTES[0]], False)
+    assert cpf_alternativo == ([PACIENTES[2]], False)
+    assert telefone == ([PACIENTES[0]], False)
+    assert [p["id"] for p in maria] == [3, 2]
+    assert [p["id"] for p in conceicao] == [2]
+    assert outra_clinica == ([], False)
+
+
+def test_entrada_vencida_e_servida_como_vencida_e_some_depois_do_max_age():
+    async def cenario():
+        indice = PatientIndex(ttl=60.0, max_age=3600.0)
+        await indice.registrar("cid", PACIENTES[:1])
+        envelhecer(indice, "cid", 120)
+        vencida = await indice.buscar_documento("cid", "12345678901")
+        envelhecer(indice, "cid", 3600)
+        expirada = await indice.buscar_documento("cid", "12345678901")
+        await indice.podar()
+        return vencida, expirada, indice.stats()
+
+    vencida, expirada, stats = asyncio.run(cenario())
+    assert vencida == ([PACIENTES[0]], True)
+    assert expirada == ([], False)
+    assert (stats["stale_hits"], stats["misses"], stats["patients"], stats["evictions"]) == (1, 1, 0, 1)
+
+
+def test_limite_por_clinica_remove_os_mais_antigos():
+    async def cenario():
+        indice = PatientIndex(max_por_clinica=2)
+        for paciente in PACIENTES:
+            await indice.registrar("cid", [paciente])
+        return [r for r in indice._clinicas["cid"].registros], indice.stats()["evictions"]
+
+    assert asyncio.run(cenario()) == ([2, 3], 1)
+
+
+def test_resposta_com_item_invalido_nao_e_indexada():
+    async def cenario():
+        indice = PatientIndex()
+        await indice.registrar("cid", [PACIENTES[0], {"nome": "sem id"}])
+        return await indice.buscar_documento("cid", "12345678901")
+
+    assert asyncio.run(cenario()) == ([], False)
+
+
+def test_sqlite_guarda_o_indice_entre_reinicios(tmp_path):
+    caminho = str(tmp_path / "pacientes.sqlite3")
+
+    async def cenario():
+        primeiro = PatientIndex(backend=SQLitePatientBackend(caminho))
+        await primeiro.registrar("cid", PACIENTES)
+        await primeiro.remover_documento("cid", "98765432100")
+        await primeiro.close()
+        segundo = PatientIndex(backend=SQLitePatientBackend(caminho))
+        try:
+            return (
+                await segundo.buscar_telefone("cid", "47999990001"),
+                await segundo.buscar_documento("cid", "98765432100"),
+            )
+        finally:
+            await segundo.close()
+
+    telefone, removido = asyncio.run(cenario())
+    assert telefone == ([PACIENTES[0]], False)
+    assert removido == ([], False)
@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from services.rate_limiter import (
+    BACKGROUND, INTERATIVA, LimitadorClinica, LimiteExcedido, TokenBucket, prioridade_atual, prioridade_baixa
+)
+
+
+def limitador(**kwargs) -> LimitadorClinica:
+    parametros = dict(
+        taxa=1000.0, rajada=1000.0, limite_inicial=4, limite_min=1, limite_max=8,
+        tolerancia_latencia=2.0, fracao_background=0.5, timeout_fila=0.2
+    )
+    parametros.update(kwargs)
+    return LimitadorClinica(**parametros)
+
+
+def test_token_bucket_rajada_e_espera():
+    bucket = TokenBucket(taxa=10.0, capacidade=2.0)
+    assert bucket.reservar() == 0.0
+    assert bucket.reservar() == 0.0
+    assert 0 < bucket.reservar() <= 0.1
+
+
+def test_token_bucket_pausado_nao_libera_tokens():
+    bucket = TokenBucket(taxa=1000.0, capacidade=10.0)
+    bucket.pausar(5.0)
+    assert bucket.reservar() > 4.0
+
+
+def test_prioridade_baixa():
+    assert prioridade_atual.get() == INTERATIVA
+    with prioridade_baixa():
+        assert prioridade_atual.get() == BACKGROUND
+    assert prioridade_atual.get() == INTERATIVA
+
+
+@pytest.mark.parametrize("status", [429, 500, 503, None])
+def test_falha_corta_o_limite_pela_metade(status):
+    lim = limitador()
+    lim.registrar(status, 0.1)
+    assert lim.limite == 2
+    # Falhas da mesma rajada contam uma vez
+    lim.registrar(status, 0.1)
+    assert lim.limite == 2
+
+
+def test_limite_nao_cai_abaixo_do_minimo():
+    lim = limitador(limite_inicial=1)
+    lim.registrar(503, 0.1)
+    assert lim.limite == 1
+
+
+def test_429_pausa_pelo_retry_after():
+    lim = limitador()
+    lim.registrar(429, 0.1, retry_after=3.0)
+    assert lim.bucket.reservar() > 2.0
+    assert lim.stats()["throttled"] == 1
+
+
+def test_limite_so_cresce_quando_esta_em_uso():
+    lim = limitador()
+    for _ in range(10):
+        lim.registrar(200, 0.05)
+    assert lim.limite == 4
+    lim.em_uso = 4
+    for _ in range(4):
+        lim.registrar(200, 0.05)
+    assert lim.limite > 4
+
+
+def test_latencia_alta_reduz_o_limite():
+    lim = limitador()
+    lim.registrar(200, 0.01)
+    lim.registrar(200, 1.0)
+    assert lim.limite == 2
+
+
+def test_interativa_passa_na_frente_da_background():
+    async def cenario():
+        lim = limitador(limite_inicial=1, timeout_fila=1.0)
+        await lim.acquire(INTERATIVA)
+        ordem = []
+
+        async def chamar(prioridade):
+            await lim.acquire(prioridade)
+            ordem.append(prioridade)
+            lim.release()
+
+        fundo = asyncio.create_task(chamar(BACKGROUND))
+        await asyncio.sleep(0)
+        atendimento = asyncio.create_task(chamar(INTERATIVA))
+        await asyncio.sleep(0)
+        lim.release()
+        await asyncio.gather(fundo, atendimento)
+        return ordem
+
+    assert asyncio.run(cenario()) == [INTERATIVA, BACKGROUND]
+
+
+def test_fila_cheia_por_tempo_demais_e_rejeitada():
+    async def cenario():
+        lim = limitador(limite_inicial=1, timeout_fila=0.05)
+        await lim.acquire(INTERATIVA)
+        with pytest.raises(LimiteExcedido):
+            await lim.acquire(INTERATIVA)
+        return lim.stats()
+
+    stats = asyncio.run(cenario())
+    assert (stats["rejections"], stats["in_flight"], stats["queued_interactive"]) == (1, 1, 0)
@@ -0,0 +1,57 @@
+import pytest
+from models import RegistroExecutor, RegistroHorario, RegistroPaciente
+
+PACIENTES = [
+    {"id": 10, "nome": "Ana", "cpfcnpj": "12345678901", "dataNascimento": "1990-01-01"},
+    # Chave alternativa do documento e campos que só existem no payload
+    {"id": 11, "nome": "Bia", "cpfCnpj": "98765432100", "contato": {"telefoneCelular": "47999990000"}},
+    # id como string e nulos explícitos voltam como vieram
+    {"id": "12", "nome": None, "cpfcnpj": None, "email": "c@x.com"},
+    {"id": 13, "nome": "Duda", "ativo": True, "convenios": [{"id": 1}]},
+]
+
+
+@pytest.mark.parametrize("item", PACIENTES)
+def test_paciente_volta_igual_ao_payload(item):
+    assert RegistroPaciente.from_cnn(item).para_cnn() == item
+
+
+def test_paciente_sem_extras_nao_guarda_bruto():
+    registro = RegistroPaciente.from_cnn(PACIENTES[0])
+    assert registro.bruto is None
+    assert registro.documento == "12345678901"
+
+
+def test_documento_usa_cpfCnpj_do_payload():
+    registro = RegistroPaciente.from_cnn(PACIENTES[1])
+    assert registro.cpfcnpj is None
+    assert registro.documento == "98765432100"
+    assert registro.telefones == ("47999990000",)
+
+
+def test_id_string_fica_tipado_e_volta_string():
+    registro = RegistroPaciente.from_cnn(PACIENTES[2])
+    assert registro.id == 12
+    assert registro.para_cnn()["id"] == "12"
+
+
+@pytest.mark.parametrize("cls, item", [
+    (RegistroExecutor, {"id": 1, "nome": "Dr. A", "idEspecialidade": 5}),
+    (RegistroExecutor, {"id": 2, "nome": "Dr. B", "idEspecialidade": "5", "crm": "123"}),
+    (RegistroHorario, {"data": "2024-05-01", "horaInicio": "08:00", "horaFim": "08:30"}),
+    (RegistroHorario, {"data": "2024-05-01", "horaInicio": "08:00", "horaFim": None, "sala": 3}),
+])
+def test_executor_e_horario_voltam_iguais_ao_payload(cls, item):
+    assert cls.from_cnn(item).para_cnn() == item
+
+
+@pytest.mark.parametrize("cls, item", [
+    (RegistroPaciente, {"nome": "Sem id"}),
+    (RegistroPaciente, {"id": True}),
+    (RegistroExecutor, {"id": 1, "nome": 2}),
+    (RegistroHorario, {"data": "ontem", "horaInicio": "08:00"}),
+    (RegistroHorario, {"data": "2024-05-01"}),
+])
+def test_payload_invalido(cls, item):
+    with pytest.raises(ValueError):
+        cls.from_cnn(item)
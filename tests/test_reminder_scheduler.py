@@ -0,0 +1,119 @@
+import asyncio
+from datetime import timedelta
+import pytest
+from services import reminder_scheduler
+from services.reminder_scheduler import ReminderScheduler, SQLiteReminderBackend, _Agendamento
+
+CNPJ = "30747815000108"
+
+
+class DespachanteFalso:
+    def __init__(self):
+        self.enviados = []
+
+    def enviar(self, numero, texto, prioridade):
+        self.enviados.append(numero)
+        resultado = asyncio.get_running_loop().create_future()
+        resultado.set_result(None)
+        return resultado
+
+
+@pytest.fixture
+def despachante(monkeypatch):
+    falso = DespachanteFalso()
+    monkeypatch.setattr(reminder_scheduler, "get_outbound_dispatcher", lambda: falso)
+    monkeypatch.setattr(reminder_scheduler.settings, "LEMBRETES_ANTECEDENCIAS", "24,2")
+    return falso
+
+
+def agendar(scheduler, *horas_ate_inicio):
+    """Registra um dia com um agendamento para cada antecedência dada."""
+    agora = scheduler._agora().replace(microsecond=0)
+    agendamentos = {
+        i: _Agendamento(i, agora + timedelta(hours=h), f"55479{i:08d}")
+        for i, h in enumerate(horas_ate_inicio, start=1)
+    }
+    scheduler._registrar_dia(CNPJ, agora.date(), agendamentos, 0.0)
+    return agendamentos
+
+
+def na_fila(scheduler):
+    return sorted((id_agenda, tipo) for _, _, _, _, id_agenda, tipo, _ in scheduler._fila)
+
+
+def vencer_tudo(scheduler):
+    vencidos = list(scheduler._fila)
+    scheduler._fila.clear()
+    return vencidos
+
+
+def test_ressincronizar_nao_duplica(despachante):
+    scheduler = ReminderScheduler()
+    agendar(scheduler, 48)
+    agendar(scheduler, 48)
+    assert na_fila(scheduler) == [(1, "24h"), (1, "2h")]
+
+
+def test_so_o_lembrete_vencido_mais_proximo(despachante):
+    scheduler = ReminderScheduler()
+    agendar(scheduler, 1)
+    assert na_fila(scheduler) == [(1, "2h")]
+
+
+def test_lembrete_enviado_nao_volta_para_a_fila(despachante):
+    scheduler = ReminderScheduler()
+
+    async def cenario():
+        agendar(scheduler, 1)
+        vencidos = vencer_tudo(scheduler)
+        # A mesma entrada duas vezes no lote sai uma vez só
+        await scheduler._enviar_lote(vencidos + vencidos)
+        agendar(scheduler, 1)
+
+    asyncio.run(cenario())
+    assert despachante.enviados == ["5547900000001"]
+    assert na_fila(scheduler) == []
+
+
+def test_remarcado_recebe_lembrete_novo(despachante):
+    scheduler = ReminderScheduler()
+
+    async def cenario():
+        agendar(scheduler, 1)
+        await scheduler._enviar_lote(vencer_tudo(scheduler))
+        # Mesmo agendamento em outro horário é outro lembrete
+        agendar(scheduler, 1.5)
+
+    asyncio.run(cenario())
+    assert na_fila(scheduler) == [(1, "2h")]
+
+
+def test_enviados_sobrevivem_ao_reinicio(despachante, tmp_path, monkeypatch):
+    async def parado(self):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(ReminderScheduler, "_sincronizar_loop", parado)
+    monkeypatch.setattr(ReminderScheduler, "_enviar_loop", parado)
+    caminho = str(tmp_path / "lembretes.sqlite3")
+
+    async def primeira_execucao():
+        scheduler = ReminderScheduler(SQLiteReminderBackend(caminho))
+        await scheduler.start()
+        agendamentos = agendar(scheduler, 1)
+        await scheduler.backend.gravar_dias(CNPJ, [
+            (a.inicio.date(), 0.0, [[a.id, a.inicio.isoformat(), a.numero]]) for a in agendamentos.values()
+        ])
+        await scheduler._enviar_lote(vencer_tudo(scheduler))
+        await scheduler.stop()
+
+    async def segunda_execucao():
+        scheduler = ReminderScheduler(SQLiteReminderBackend(caminho))
+        await scheduler.start()
+        try:
+            return na_fila(scheduler), scheduler.stats()["agendamentos"]
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(primeira_execucao())
+    assert asyncio.run(segunda_execucao()) == ([], 1)
+    assert len(despachante.enviados) == 1
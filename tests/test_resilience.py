@@ -0,0 +1,166 @@
+import asyncio
+import httpx
+import pytest
+from services import resilience
+from services.erros import ErroUpstream
+from services.resilience import ABERTO, FECHADO, MEIO_ABERTO, CircuitBreaker, chamar
+
+
+@pytest.fixture(autouse=True)
+def sem_espera(monkeypatch):
+    monkeypatch.setattr(resilience.settings, "RETRY_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(resilience.settings, "RETRY_BASE_DELAY", 0.0)
+    monkeypatch.setattr(resilience.settings, "CIRCUIT_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(resilience.settings, "CIRCUIT_RESET_TIMEOUT", 30.0)
+    monkeypatch.setattr(resilience, "_circuitos", None)
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self) -> float:
+        return self.agora
+
+
+def respostas(*itens):
+    """``enviar`` que devolve (ou levanta) cada item na ordem e conta as chamadas."""
+    fila = list(itens)
+
+    async def enviar(timeout):
+        enviar.chamadas += 1
+        item = fila.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return httpx.Response(item, request=httpx.Request("GET", "http://cnn.invalid/"))
+
+    enviar.chamadas = 0
+    return enviar
+
+
+async def _chamar(method, enviar, circuito="cnn:teste"):
+    async with httpx.AsyncClient() as client:
+        return await chamar("cnn", circuito, client, method, enviar)
+
+
+def test_get_retenta_status_transitorio():
+    enviar = respostas(503, 502, 200)
+    response = asyncio.run(_chamar("GET", enviar))
+    assert response.status_code == 200
+    assert enviar.chamadas == 3
+
+
+def test_get_retenta_falha_de_rede():
+    enviar = respostas(httpx.ConnectError("recusada"), 200)
+    assert asyncio.run(_chamar("GET", enviar)).status_code == 200
+    assert enviar.chamadas == 2
+
+
+def test_get_esgota_tentativas():
+    enviar = respostas(503, 503, 503)
+    with pytest.raises(ErroUpstream) as erro:
+        asyncio.run(_chamar("GET", enviar))
+    assert erro.value.status_code == 502
+    assert erro.value.upstream_status == 503
+    assert enviar.chamadas == 3
+
+
+def test_post_nao_retenta():
+    enviar = respostas(503, 200)
+    with pytest.raises(ErroUpstream) as erro:
+        asyncio.run(_chamar("POST", enviar))
+    assert erro.value.codigo == "falha_upstream"
+    assert enviar.chamadas == 1
+
+
+def test_erro_do_cliente_nao_retenta():
+    enviar = respostas(404, 200)
+    with pytest.raises(ErroUpstream) as erro:
+        asyncio.run(_chamar("GET", enviar))
+    assert erro.value.status_code == 404
+    assert enviar.chamadas == 1
+
+
+def test_429_retenta_sem_contar_falha_do_circuito():
+    enviar = respostas(429, 200)
+    assert asyncio.run(_chamar("GET", enviar)).status_code == 200
+    assert enviar.chamadas == 2
+    assert resilience.get_circuitos().get("cnn:teste").falhas_seguidas == 0
+
+
+def test_circuito_aberto_recusa_sem_chamar():
+    enviar = respostas(503, 503, 503)
+    with pytest.raises(ErroUpstream):
+        asyncio.run(_chamar("GET", enviar))
+    assert resilience.get_circuitos().get("cnn:teste").estado == ABERTO
+
+    outra = respostas(200)
+    with pytest.raises(ErroUpstream) as erro:
+        asyncio.run(_chamar("GET", outra))
+    assert erro.value.status_code == 503
+    assert erro.value.codigo == "circuito_aberto"
+    assert outra.chamadas == 0
+
+
+def test_circuito_abre_durante_as_retentativas():
+    resilience.get_circuitos().get("cnn:teste").falhas_seguidas = 2
+    enviar = respostas(503, 200)
+    with pytest.raises(ErroUpstream) as erro:
+        asyncio.run(_chamar("GET", enviar))
+    assert erro.value.codigo == "circuito_aberto"
+    assert enviar.chamadas == 1
+
+
+def test_prazo_esgotado_nao_chama():
+    enviar = respostas(200)
+
+    async def cenario():
+        with resilience.prazo(0):
+            await _chamar("GET", enviar)
+
+    with pytest.raises(ErroUpstream) as erro:
+        asyncio.run(cenario())
+    assert erro.value.status_code == 504
+    assert enviar.chamadas == 0
+
+
+def test_breaker_transicoes(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(resilience.time, "monotonic", relogio)
+    breaker = CircuitBreaker(limite_falhas=2, tempo_reset=10.0)
+
+    breaker.falha()
+    assert breaker.estado == FECHADO
+    breaker.falha()
+    assert breaker.estado == ABERTO
+    assert not breaker.permitir()
+
+    # Passado o tempo de reset, uma única sonda passa
+    relogio.agora += 10.0
+    assert breaker.permitir()
+    assert breaker.estado == MEIO_ABERTO
+    assert not breaker.permitir()
+
+    # Sonda com falha reabre na hora
+    breaker.falha()
+    assert breaker.estado == ABERTO
+    assert breaker.aberturas == 2
+
+    relogio.agora += 10.0
+    assert breaker.permitir()
+    breaker.sucesso()
+    assert breaker.estado == FECHADO
+    assert breaker.falhas_seguidas == 0
+    assert breaker.permitir()
+
+
+def test_breaker_sonda_liberada_sem_resultado(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(resilience.time, "monotonic", relogio)
+    breaker = CircuitBreaker(limite_falhas=1, tempo_reset=5.0)
+    breaker.falha()
+    relogio.agora += 5.0
+    assert breaker.permitir()
+    breaker.liberar_sonda()
+    assert breaker.estado == MEIO_ABERTO
+    assert breaker.permitir()
@@ -0,0 +1,129 @@
+import asyncio
+import pytest
+from services.single_flight import SingleFlight, normalizar_params
+
+
+class Chamada:
+    """Factory que fica parada até ``liberar`` e conta as execuções."""
+
+    def __init__(self, resultado=None, erro=None):
+        self.resultado = resultado
+        self.erro = erro
+        self.liberar = asyncio.Event()
+        self.execucoes = 0
+
+    async def __call__(self):
+        self.execucoes += 1
+        await self.liberar.wait()
+        if self.erro:
+            raise self.erro
+        return self.resultado
+
+
+def test_chamadas_iguais_executam_uma_vez():
+    async def cenario():
+        sf = SingleFlight()
+        chamada = Chamada({"id": 1})
+        tarefas = [asyncio.create_task(sf.do("k", chamada)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert "k" in sf
+        chamada.liberar.set()
+        resultados = await asyncio.gather(*tarefas)
+        return sf, chamada, resultados
+
+    sf, chamada, resultados = asyncio.run(cenario())
+    assert chamada.execucoes == 1
+    assert all(r is resultados[0] for r in resultados)
+    assert "k" not in sf
+    stats = sf.stats()
+    assert (stats["leaders"], stats["collapsed"], stats["inflight"]) == (1, 4, 0)
+
+
+def test_chaves_diferentes_nao_se_unem():
+    async def cenario():
+        sf = SingleFlight()
+        a, b = Chamada("a"), Chamada("b")
+        tarefas = [asyncio.create_task(sf.do("a", a)), asyncio.create_task(sf.do("b", b))]
+        await asyncio.sleep(0)
+        assert sorted(sf.chaves()) == ["a", "b"]
+        a.liberar.set()
+        b.liberar.set()
+        return await asyncio.gather(*tarefas)
+
+    assert asyncio.run(cenario()) == ["a", "b"]
+
+
+def test_cancelar_o_primeiro_chamador_nao_cancela_os_outros():
+    async def cenario():
+        sf = SingleFlight()
+        chamada = Chamada("ok")
+        lider = asyncio.create_task(sf.do("k", chamada))
+        await asyncio.sleep(0)
+        seguidor = asyncio.create_task(sf.do("k", chamada))
+        await asyncio.sleep(0)
+        lider.cancel()
+        await asyncio.sleep(0)
+        chamada.liberar.set()
+        return lider, await seguidor, chamada.execucoes
+
+    lider, resultado, execucoes = asyncio.run(cenario())
+    assert lider.cancelled()
+    assert resultado == "ok"
+    assert execucoes == 1
+
+
+def test_erro_chega_a_todos_e_a_proxima_chamada_executa_de_novo():
+    async def cenario():
+        sf = SingleFlight()
+        chamada = Chamada(erro=ValueError("falhou"))
+        tarefas = [asyncio.create_task(sf.do("k", chamada)) for _ in range(3)]
+        await asyncio.sleep(0)
+        chamada.liberar.set()
+        resultados = await asyncio.gather(*tarefas, return_exceptions=True)
+        depois = Chamada("ok")
+        depois.liberar.set()
+        return sf, resultados, await sf.do("k", depois)
+
+    sf, resultados, depois = asyncio.run(cenario())
+    assert all(isinstance(r, ValueError) for r in resultados)
+    assert depois == "ok"
+    assert sf.stats()["errors"] == 1
+
+
+def test_esquecer_dispara_outra_execucao():
+    async def cenario():
+        sf = SingleFlight()
+        vigencia = []
+
+        async def antiga():
+            await liberar.wait()
+            vigencia.append(sf.vigente("k"))
+            return "antiga"
+
+        async def nova():
+            vigencia.append(sf.vigente("k"))
+            return "nova"
+
+        liberar = asyncio.Event()
+        pendente = asyncio.create_task(sf.do("k", antiga))
+        await asyncio.sleep(0)
+        sf.esquecer("k")
+        assert "k" not in sf
+        segunda = await sf.do("k", nova)
+        liberar.set()
+        return await pendente, segunda, vigencia
+
+    primeira, segunda, vigencia = asyncio.run(cenario())
+    # Quem já aguardava recebe a execução antiga, que sabe que foi esquecida
+    assert (primeira, segunda) == ("antiga", "nova")
+    assert vigencia == [True, False]
+
+
+@pytest.mark.parametrize("a, b", [
+    ({"x": 1, "y": "2"}, {"y": 2, "x": "1"}),
+    ({"x": 1, "z": None}, {"x": 1}),
+    ({"ativo": True}, {"ativo": "true"}),
+    (None, {}),
+])
+def test_normalizar_params(a, b):
+    assert normalizar_params(a) == normalizar_params(b)
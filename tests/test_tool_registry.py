@@ -0,0 +1,99 @@
+import pytest
+from fastapi import HTTPException
+from services import tool_registry
+from services.tool_registry import ChamadaTool, planejar
+
+CNPJ = "30747815000108"
+
+
+def chamada(id_, tool="listar_tipos_convenios", params=None, depends_on=(), **extras):
+    return ChamadaTool(id=id_, tool=tool, params=params or {}, depends_on=list(depends_on), **extras)
+
+
+def ordem(lote):
+    return [c.id for c in planejar(lote, CNPJ)]
+
+
+def recusa(lote, status=400):
+    with pytest.raises(HTTPException) as erro:
+        planejar(lote, CNPJ)
+    assert erro.value.status_code == status
+    return erro.value.detail
+
+
+def test_dependencias_saem_antes_dos_dependentes():
+    lote = [
+        chamada("c", depends_on=["b"]),
+        chamada("b", depends_on=["a"]),
+        chamada("d"),
+        chamada("a"),
+    ]
+    resultado = ordem(lote)
+    assert sorted(resultado) == ["a", "b", "c", "d"]
+    assert resultado.index("a") < resultado.index("b") < resultado.index("c")
+
+
+def test_referencia_vira_dependencia():
+    lote = [
+        chamada("convenios", "listar_convenios_paciente", {"id_paciente": {"$ref": "paciente.id"}}),
+        chamada("paciente", "obter_paciente", {"cpf": "06286689966"}),
+    ]
+    assert ordem(lote) == ["paciente", "convenios"]
+    assert lote[0].depends_on == ["paciente"]
+
+
+def test_diamante():
+    lote = [
+        chamada("fim", depends_on=["esq", "dir"]),
+        chamada("esq", depends_on=["raiz"]),
+        chamada("dir", depends_on=["raiz"]),
+        chamada("raiz"),
+    ]
+    resultado = ordem(lote)
+    assert resultado[0] == "raiz" and resultado[-1] == "fim"
+
+
+def test_ciclo_recusa_o_lote():
+    detalhe = recusa([
+        chamada("a", depends_on=["c"]),
+        chamada("b", depends_on=["a"]),
+        chamada("c", depends_on=["b"]),
+        chamada("livre"),
+    ])
+    assert detalhe == "Dependências em ciclo: a, b, c"
+
+
+def test_dependencia_inexistente():
+    assert "inexistente: x" in recusa([chamada("a", depends_on=["x"])])
+
+
+def test_id_repetido():
+    assert "repetido" in recusa([chamada("a"), chamada("a")])
+
+
+def test_tool_desconhecida():
+    assert "desconhecida" in recusa([chamada("a", "apagar_tudo")])
+
+
+def test_parametros_invalidos_recusam_antes_de_executar():
+    detalhe = recusa([chamada("a"), chamada("b", "listar_convenios_paciente", {"id_paciente": "abc"})], 422)
+    assert detalhe.startswith("Chamada b:")
+
+
+def test_cnpj_de_outra_clinica():
+    assert "outra clínica" in recusa([chamada("a", params={"cnpj": "11.222.333/0001-81"})])
+
+
+def test_cnpj_da_propria_clinica_e_removido():
+    lote = [chamada("a", params={"cnpj": "30.747.815/0001-08"})]
+    planejar(lote, CNPJ)
+    assert lote[0].params == {}
+
+
+def test_idempotency_key_so_em_escrita():
+    assert "idempotency_key" in recusa([chamada("a", idempotency_key="k1")])
+
+
+def test_limite_de_chamadas(monkeypatch):
+    monkeypatch.setattr(tool_registry.settings, "TOOLS_BATCH_MAX_CALLS", 2)
+    recusa([chamada("a"), chamada("b"), chamada("c")])
@@ -0,0 +1,68 @@
+import asyncio
+from services.webhook_queue import WebhookQueue
+
+
+def test_mesmo_numero_em_ordem_e_numeros_diferentes_em_paralelo():
+    async def cenario():
+        processadas = []
+        simultaneas = {}
+        em_andamento = set()
+
+        async def handler(item):
+            numero, seq = item
+            assert numero not in em_andamento, "duas mensagens do mesmo número ao mesmo tempo"
+            em_andamento.add(numero)
+            simultaneas[numero] = len(em_andamento)
+            await asyncio.sleep(0.01)
+            em_andamento.discard(numero)
+            processadas.append(item)
+
+        fila = WebhookQueue(handler, workers=4, max_depth=100)
+        await fila.start()
+        for seq in range(5):
+            for numero in ("a", "b", "c"):
+                assert fila.enqueue(numero, (numero, seq))
+        await fila.stop()
+        return processadas, simultaneas, fila.stats()
+
+    processadas, simultaneas, stats = asyncio.run(cenario())
+    for numero in ("a", "b", "c"):
+        assert [seq for n, seq in processadas if n == numero] == list(range(5))
+    assert max(simultaneas.values()) > 1
+    assert (stats["accepted"], stats["depth"], stats["active"]) == (15, 0, 0)
+
+
+def test_falha_no_handler_nao_trava_o_numero():
+    async def cenario():
+        processadas = []
+
+        async def handler(item):
+            if item == 1:
+                raise RuntimeError("falhou")
+            processadas.append(item)
+
+        fila = WebhookQueue(handler, workers=1, max_depth=10)
+        await fila.start()
+        for item in range(3):
+            fila.enqueue("a", item)
+        await fila.stop()
+        return processadas, fila.stats()["failed"]
+
+    assert asyncio.run(cenario()) == ([0, 2], 1)
+
+
+def test_fila_cheia_rejeita():
+    async def cenario():
+        liberar = asyncio.Event()
+
+        async def handler(item):
+            await liberar.wait()
+
+        fila = WebhookQueue(handler, workers=1, max_depth=2)
+        await fila.start()
+        aceitas = [fila.enqueue(str(i), i) for i in range(3)]
+        liberar.set()
+        await fila.stop()
+        return aceitas, fila.stats()["rejected"]
+
+    assert asyncio.run(cenario()) == ([True, True, False], 1)